@@ -23,11 +23,25 @@ import logging
 import argparse
 import subprocess
 import platform
+import hashlib
+import importlib
+import sqlite3
+import threading
+import random
+import re
+import itertools
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from datetime import datetime
 from pathlib import Path
-from PIL import Image, ImageStat
+from types import SimpleNamespace
+from PIL import Image, ImageOps
 import numpy as np
-import cv2
 
 # Configure PIL for large photo processing
 import warnings
@@ -37,37 +51,207 @@ Image.MAX_IMAGE_PIXELS = 200000000
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 warnings.filterwarnings("ignore", category=Image.DecompressionBombWarning)
 
-import ollama
-from typing import List, Dict, Optional, Tuple
-
-# Enhanced RAW support
-try:
-    import rawpy
-    HAS_RAWPY = True
-    print("✅ rawpy available - Enhanced .ARW support enabled")
-except ImportError:
-    HAS_RAWPY = False
-    print("⚠️  rawpy not available - install with: pip install rawpy")
-
-# Quality analysis support
-try:
-    import cv2
-    HAS_CV2 = True
-    print("✅ OpenCV available - Quality analysis enabled")
-except ImportError:
-    HAS_CV2 = False
-    print("⚠️  OpenCV not available - install with: pip install opencv-python")
+from typing import Dict, Iterator, List, Optional, Tuple
+
+class LazyModule:
+    """Proxy that imports a module on first use"""
+    
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._loaded = False
+        
+    def _load(self):
+        if not self._loaded:
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError:
+                self._module = None
+            self._loaded = True
+        return self._module
+        
+    def __bool__(self) -> bool:
+        # ``if cv2:`` checks an optional dependency without importing it up front
+        return self._load() is not None
+        
+    def __getattr__(self, attr: str):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        module = self._load()
+        if module is None:
+            raise ImportError(f"{self._name} is not installed")
+        return getattr(module, attr)
+
+# Heavy or optional dependencies, imported on first use
+ollama = LazyModule("ollama")
+rawpy = LazyModule("rawpy")  # Enhanced RAW support
+cv2 = LazyModule("cv2")  # Quality analysis support
+
+class DependencyError(RuntimeError):
+    """Ollama or the configured model is unavailable"""
+
+# RAW formats decoded through rawpy
+RAW_EXTENSIONS = {".arw", ".cr2", ".nef", ".orf", ".rw2", ".dng"}
+
+# Resident bytes per decoded pixel: RGB frame plus analysis arrays and the encode copy
+DECODE_BYTES_PER_PIXEL = 8
+
+# Extra bytes per sensor pixel for a RAW decode: unpacked 16-bit Bayer data, LibRaw's
+# 4 x 16-bit working image and the postprocess array (preview reserves for its fallback)
+RAW_BYTES_PER_PIXEL = {"preview": 5, "half_size": 5, "full": 13}
+
+# Generation options sent with every model request
+MODEL_OPTIONS = {"temperature": 0.3, "num_predict": 50}
 
 # Configuration
 DEFAULT_CONFIG = {
     "pictures_folder": Path.home() / "Pictures",
     "ollama_model": "llava:7b",
-    "supported_formats": {".jpg", ".jpeg", ".png", ".tiff", ".tif", ".dng", ".cr2", ".nef", ".arw", ".orf", ".rw2"},
+    "supported_formats": {
+        ".jpg",
+        ".jpeg",
+        ".png",
+        ".tiff",
+        ".tif",
+        ".dng",
+        ".cr2",
+        ".nef",
+        ".arw",
+        ".orf",
+        ".rw2",
+    },
     "max_image_size": 1024,
     "batch_size": 5,
     "max_tags": 8,
-    "delay_between_batches": 3,
+    "workers": {
+        "decode_workers": 0,  # Decode/analysis processes, 0 or 1 = in-process
+        # Photos decoded ahead of inference, None = 2 x decode_workers
+        "queue_depth": None,
+    },
+    "keyword_cache": {
+        "enabled": True,
+        "path": None,  # None = ai_photo_tagger_v3_cache.sqlite in pictures_folder
+        "max_bytes": 64 * 1024 * 1024,  # LRU eviction above this total entry size
+    },
+    "burst_grouping": {
+        "enabled": False,
+        # Max dHash Hamming distance (of 64 bits) to reuse a frame's AI keywords
+        "max_distance": 6,
+        "window": 512,  # Recent tagged frames kept in the index
+    },
+    "triage": {
+        "enabled": False,  # Route photos that fail these rules to quality-only sidecars
+        "reject_blur_levels": ["very_blurry"],
+        "reject_exposure": [],  # e.g. ["underexposed", "overexposed", "low_contrast"]
+        "reject_low_light": False,  # Concert mode low-light frames
+        # CPU pass only: sidecars for rejects, keepers left for the next run
+        "triage_only": False,
+    },
+    "thumbnail_cache": {
+        "enabled": True,
+        "path": None,  # None = .ai_photo_tagger_v3_thumbs in pictures_folder
+        "max_bytes": 1024 * 1024 * 1024,  # LRU eviction above this total JPEG size
+        "shards": 16,  # Pack files entries are spread over
+    },
+    "index": {
+        "enabled": True,  # Searchable keyword/quality index, see the search subcommand
+        "path": None,  # None = ai_photo_tagger_v3_index.sqlite in pictures_folder
+    },
+    "analysis_store": {
+        # Keep raw quality metrics for re-classification, see the report subcommand
+        "enabled": True,
+        "path": None,  # None = ai_photo_tagger_v3_analysis in pictures_folder
+        # Photos buffered per segment file; a crash loses at most this many rows
+        "segment_rows": 1000,
+        # Merge all segments into one once there are more than this
+        "compact_segments": 32,
+    },
+    "watch": {
+        # Size and mtime must be unchanged this long before tagging
+        "settle_seconds": 1.0,
+        "poll_interval": 2.0,  # Rescan interval when inotify is unavailable
+        "use_inotify": True,
+        # Also tag older unprocessed photos when no new ones are waiting
+        "process_backlog": True,
+    },
+    "cluster": {
+        # Share the library with other nodes through a work queue on the share
+        "enabled": False,
+        "queue_path": None,  # None = ai_photo_tagger_v3_queue.sqlite in pictures_folder
+        "node_id": None,  # Unique per tagger process, None = host name
+        # A chunk whose node stops heartbeating is reclaimed after this
+        "lease_seconds": 300,
+        "chunk_size": 50,  # Photos leased at a time
+    },
+    "dependency_check": {
+        # Seconds a passing Ollama/model/ExifTool check is reused, 0 = always check
+        "ttl": 300,
+        "cache_path": None,  # None = ~/.cache/ai_photo_tagger/dependency_check.json
+    },
+    "metrics": {
+        "enabled": True,
+        "interval": 30,  # Seconds between exports
+        "window": 2048,  # Recent samples per stage used for p50/p95/p99
+        # None = ai_photo_tagger_v3_metrics.jsonl in pictures_folder
+        "jsonl_path": None,
+        "prometheus_path": None,  # Textfile-collector .prom file, None = disabled
+        # Fraction of photos whose CPU stage runs under cProfile
+        "profile_sample_rate": 0.0,
+        "profile_dir": None,  # None = ai_photo_tagger_v3_profiles in pictures_folder
+    },
+    "inference": {
+        # Concurrent model requests per endpoint; match OLLAMA_NUM_PARALLEL
+        "max_in_flight": 2,
+        # Photos per request with a JSON answer, 1 = one photo per request
+        "batch_images": 1,
+        # Ollama base URLs to load-balance over, empty = OLLAMA_HOST / localhost
+        "endpoints": [],
+        # Consecutive failures before an endpoint is taken out of rotation
+        "eject_after_failures": 3,
+        "eject_seconds": 60,
+        # Seconds between endpoint probes when there are several
+        "health_check_interval": 30,
+        # Seconds before a model request is abandoned, None = wait forever
+        "request_timeout": 180,
+        "load_timeout": 600,  # Seconds the startup warm-up may take to load the model
+        # Sent with every request, keeping the model loaded for the whole run
+        "keep_alive": "30m",
+        # Sent once the run ends (Ollama's default), None = leave it pinned
+        "keep_alive_after": "5m",
+        "retries": 2,  # Extra attempts per request, with jittered exponential backoff
+        # Seconds; retry n waits a random time up to backoff_base * 2**(n-1)
+        "backoff_base": 1.0,
+        "backoff_max": 30.0,
+        # Times a failed photo goes back in the queue before it counts as an error
+        "requeue_attempts": 3,
+        # Seconds with every endpoint unhealthy before the run stops, 0 = wait forever
+        "max_outage": 600,
+    },
     "embed_in_dng": True,
+    "sidecar": {
+        # Threads writing .xmp sidecars, overlapping slow network shares
+        "write_workers": 4,
+    },
+    "embedding": {
+        # Files that get keywords embedded via ExifTool (add RAW extensions to opt in)
+        "formats": {".dng"},
+        "batch_size": 32,  # Files per ExifTool round trip
+    },
+    "memory": {
+        # Decoded bytes alive at once over all workers, None = 1/4 of RAM, 0 = unbounded
+        "decode_budget_bytes": None,
+        # Let JPEG decode at 1/2, 1/4 or 1/8 scale when the stages need less
+        "draft": True,
+        # Rows read at a time when reducing uncompressed TIFFs
+        "stripe_bytes": 16 * 1024 * 1024,
+    },
+    "raw_decode": {
+        "strategy": "auto",  # auto, preview, half_size or full
+        # Smallest usable embedded preview (long edge), None = max_image_size
+        "min_preview_size": None,
+        # Full AHD decode whenever quality analysis is enabled
+        "full_for_quality": False,
+    },
     "quality_control": {
         "check_blur": True,
         "check_histogram": True,
@@ -75,6 +259,26 @@ DEFAULT_CONFIG = {
         "blur_threshold": 100.0,  # Lower = more blurry
         "histogram_balance_threshold": 0.8,  # Histogram balance
         "exposure_threshold": 0.1,  # Under/over exposure
+        # Long edge of the level metrics run on, None = full resolution
+        "analysis_size": 1024,
+        "cascade": {
+            # Settle clear-cut metrics on small previews before the analysis level
+            "enabled": False,
+            "levels": [512],  # Preview long edges, tried smallest first
+            # Escalate when clipping is within 25% of exposure_threshold
+            "exposure_margin": 0.25,
+            # ... histogram spread within 10% of the low-contrast cutoff
+            "contrast_margin": 0.1,
+            # ... a concert-mode measure within 20% of its threshold
+            "concert_margin": 0.2,
+            # Scale-dependent metrics escalate while their analysis-level value,
+            # estimated from this preview / analysis-level ratio range per halving of
+            # resolution, spans a boundary.
+            # blur_ratio: Laplacian variance vs blur_threshold / 4, / 2 and / 1
+            "blur_ratio": [0.33, 10.0],
+            # gradient_ratio: Sobel variance vs the concert camera-shake cutoff
+            "gradient_ratio": [1.5, 3.5],
+        },
     },
     "concert_mode": {
         "enabled": False,
@@ -83,162 +287,442 @@ DEFAULT_CONFIG = {
         "detect_crowd": True,
         "low_light_threshold": 50,
     },
+    "ai_batch_prompt": (
+        "You are given {count} images, numbered 1 to {count} in the order they are "
+        "attached. For each image provide exactly 6-8 essential keywords only: main "
+        "subject, key action, setting, mood. Use single words or simple phrases. "
+        "Respond with JSON only, in this form: {{\"images\": [{{\"index\": 1, "
+        "\"keywords\": [\"woman\", \"portrait\", \"smiling\", \"indoor\"]}}]}} "
+        "with one entry per image."
+    ),
     "ai_prompt": "Analyze this image and provide exactly 6-8 essential keywords only. Focus on the most important elements: main subject, key action, setting, mood. Use single words or simple phrases. Separate with commas. Be concise and avoid overly specific details. Example: 'woman, portrait, smiling, indoor, casual, natural'.",
 }
 
+class FrameLevel:
+    """One downsampled level of a decoded frame, used for quality metrics"""
+
+    def __init__(self, image: Image.Image, factor: int):
+        self.image = image
+        self.factor = factor  # Integer reduction from the decoded frame
+        self._rgb = None
+        self._gray = None
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.image.size
+
+    @property
+    def rgb(self) -> np.ndarray:
+        """RGB pixels as a uint8 (H, W, 3) array"""
+        if self._rgb is None:
+            self._rgb = np.asarray(self.image)
+        return self._rgb
+
+    @property
+    def gray(self) -> np.ndarray:
+        """Grayscale pixels as a uint8 (H, W) array"""
+        if self._gray is None:
+            if cv2:
+                self._gray = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+            else:
+                self._gray = np.asarray(self.image.convert('L'))
+        return self._gray
+
+class DecodedFrame(FrameLevel):
+    """A photo decoded once and shared by every analysis stage"""
+
+    def __init__(
+        self, path: Path, image: Image.Image, source: str = "image", release=None
+    ):
+        super().__init__(image if image.mode == 'RGB' else image.convert('RGB'), 1)
+        self.path = path
+        # How the pixels were decoded: image, draft, striped, preview, half_size or full
+        self.source = source
+        self.release = release  # Returns the frame's decode budget reservation on close
+        # Downsampled levels by reduction factor, built on first use
+        self._levels = {1: self}
+
+    def level_factor(self, max_size: Optional[int]) -> int:
+        """Reduction factor of the level whose long edge is at most max_size"""
+        return max(1, -(-max(self.size) // max_size)) if max_size else 1
+
+    def level(self, max_size: Optional[int]) -> FrameLevel:
+        """Box-filtered level whose long edge is at most max_size (None = full size)"""
+        return self.level_by_factor(self.level_factor(max_size))
+
+    def level_by_factor(self, factor: int) -> FrameLevel:
+        if factor not in self._levels:
+            # Reduce the smallest cached level this one is a whole reduction of
+            base = max(f for f in self._levels if factor % f == 0)
+            self._levels[factor] = FrameLevel(
+                self._levels[base].image.reduce(factor // base), factor
+            )
+        return self._levels[factor]
+
+    def encode_jpeg(self, max_size: int, quality: int = 85) -> bytes:
+        """Encode a downscaled JPEG copy for the AI model without touching the frame"""
+        from io import BytesIO
+
+        img = self.image
+        if max(img.size) > max_size:
+            scale = max_size / max(img.size)
+            target = (
+                max(1, round(img.width * scale)),
+                max(1, round(img.height * scale)),
+            )
+            img = img.resize(target, Image.LANCZOS, reducing_gap=2.0)
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", quality=quality)
+        return buffer.getvalue()
+
+    def close(self):
+        """Release cached pixel data"""
+        self._rgb = None
+        self._gray = None
+        self._levels = {1: self}
+        self.image.close()
+        if self.release is not None:
+            self.release()
+            self.release = None
+
+class DecodeBudget:
+    """Bounds the estimated bytes of decoded frames alive at once across processes"""
+
+    def __init__(self, max_bytes: int, shared: bool = True):
+        self.max_bytes = max_bytes
+        if shared:
+            import multiprocessing
+
+            # Shared with every decode worker, so the limit holds over the whole pool
+            self._used = multiprocessing.Value('q', 0, lock=False)
+            self._condition = multiprocessing.Condition()
+        else:
+            # Decoding stays in this process: no semaphore or shared memory needed
+            self._used = SimpleNamespace(value=0)
+            self._condition = threading.Condition()
+
+    def reserve(self, nbytes: int) -> int:
+        """Block until nbytes fit in the budget; returns the amount to release"""
+        # An image over the budget still decodes, once nothing else holds a reservation
+        nbytes = max(0, min(nbytes, self.max_bytes))
+        with self._condition:
+            while self._used.value and self._used.value + nbytes > self.max_bytes:
+                self._condition.wait()
+            self._used.value += nbytes
+        return nbytes
+
+    def release(self, nbytes: int):
+        with self._condition:
+            self._used.value -= nbytes
+            self._condition.notify_all()
+
+    @property
+    def used(self) -> int:
+        return self._used.value
+
 class QualityAnalyzer:
     """Advanced quality analysis for photos"""
     
+    # The classify_* methods accept NumPy arrays as well as scalars, so stored
+    # metrics re-classify in bulk
+    BLUR_LEVELS = ("very_blurry", "blurry", "slightly_blurry", "sharp")
+    EXPOSURE_CLASSES = ("good", "underexposed", "overexposed", "low_contrast")
+    MOTION_CLASSES = ("sharp", "motion_blur", "camera_shake")
+    
     def __init__(self, config: Dict):
         self.config = config
         self.quality_config = config.get("quality_control", {})
         self.concert_config = config.get("concert_mode", {})
+        # Metrics run on one downsampled level, so cost doesn't grow with megapixels
+        self.analysis_size = self.quality_config.get("analysis_size", 1024)
+        self.cascade_config = self.quality_config.get("cascade", {})
+        
+    def analysis_level(self, frame: DecodedFrame) -> FrameLevel:
+        """Shared pyramid level all metrics are computed from"""
+        return frame.level(self.analysis_size)
         
-    def analyze_blur(self, image_path: Path) -> Tuple[float, str]:
+    def analysis_edge(self, frame: DecodedFrame) -> int:
+        """Long edge of the analysis level, without building it"""
+        # Image.reduce rounds up, as level_by_factor does
+        return -(-max(frame.size) // frame.level_factor(self.analysis_size))
+        
+    @staticmethod
+    def gray_variance(img: np.ndarray) -> float:
+        """Variance of a single-channel array without a float64 copy"""
+        if cv2:
+            _, std = cv2.meanStdDev(img)
+            return float(std[0, 0]) ** 2
+        return float(np.var(img, dtype=np.float32))
+        
+    def decide(
+        self, frame: DecodedFrame, measure, borderline
+    ) -> Tuple[object, Dict, int]:
+        """Measure larger levels until borderline() clears; (result, values, edge)"""
+        # Cascade preview sizes first; the analysis level decides what they leave open
+        factors = []
+        if self.cascade_config.get("enabled", False):
+            factors = [
+                frame.level_factor(size)
+                for size in sorted(self.cascade_config.get("levels", [512]))
+            ]
+        final = frame.level_factor(self.analysis_size)
+        factors = sorted({f for f in factors if f > final}, reverse=True) + [final]
+        for factor in factors:
+            level = frame.level_by_factor(factor)
+            result, values = measure(level)
+            # borderline() also gets how many halvings below the analysis level this
+            # is, for scale-dependent metrics
+            if factor == final or not borderline(
+                values, float(np.log2(factor / final))
+            ):
+                return result, values, max(level.size)
+                
+    def near(self, value: float, boundaries, margin: float) -> bool:
+        """Whether value is within a relative margin of any classification boundary"""
+        return any(
+            abs(value - boundary) <= abs(boundary) * margin for boundary in boundaries
+        )
+        
+    def straddles(self, value: float, boundaries, ratio_band, octaves: float) -> bool:
+        """Whether a scale-dependent preview value may fall either side of a boundary"""
+        # ratio_band: (low, high) preview / analysis-level ratio per halving
+        low, high = ratio_band
+        lowest, highest = value / high ** octaves, value / low ** octaves
+        return any(lowest < boundary <= highest for boundary in boundaries)
+        
+    def analyze_blur(self, frame: DecodedFrame) -> Tuple[float, str]:
         """Analyze image blur using Laplacian variance"""
-        if not HAS_CV2:
-            return 0.0, "unknown"
+        return self.decide(frame, self.blur_metrics, self.blur_borderline)[0]
+        
+    def blur_metrics(self, level: FrameLevel) -> Tuple[Tuple[float, str], Dict]:
+        """Laplacian variance and blur class of one level"""
+        if not cv2:
+            return (0.0, "unknown"), {}
             
         try:
-            # Read image
-            img = cv2.imread(str(image_path))
-            if img is None:
-                return 0.0, "error"
-                
-            # Convert to grayscale
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            
-            # Calculate Laplacian variance
-            laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-            
-            # Determine blur level
-            threshold = self.quality_config.get("blur_threshold", 100.0)
-            if laplacian_var < threshold / 4:
-                return laplacian_var, "very_blurry"
-            elif laplacian_var < threshold / 2:
-                return laplacian_var, "blurry"
-            elif laplacian_var < threshold:
-                return laplacian_var, "slightly_blurry"
-            else:
-                return laplacian_var, "sharp"
+            laplacian = cv2.Laplacian(level.gray, cv2.CV_32F)
+            laplacian_var = self.gray_variance(laplacian)
+            
+            blur_level = self.BLUR_LEVELS[self.classify_blur(laplacian_var)]
+            return (laplacian_var, blur_level), {"score": laplacian_var}
                 
         except Exception as e:
-            return 0.0, "error"
+            return (0.0, "error"), {}
+            
+    def classify_blur(self, scores):
+        """Index into BLUR_LEVELS for Laplacian variances"""
+        threshold = self.quality_config.get("blur_threshold", 100.0)
+        return np.searchsorted(
+            (threshold / 4, threshold / 2, threshold), scores, side="right"
+        )
+            
+    def blur_borderline(self, values: Dict, octaves: float) -> bool:
+        # Laplacian variance shifts a lot with scale, see cascade.blur_ratio
+        if "score" not in values:
+            return False
+        threshold = self.quality_config.get("blur_threshold", 100.0)
+        return self.straddles(
+            values["score"],
+            (threshold / 4, threshold / 2, threshold),
+            self.cascade_config.get("blur_ratio", (0.33, 10.0)),
+            octaves,
+        )
     
-    def analyze_histogram(self, image_path: Path) -> Tuple[Dict, str]:
+    def analyze_histogram(self, frame: DecodedFrame) -> Tuple[Dict, str]:
         """Analyze histogram for exposure and color balance"""
+        return self.decide(frame, self.histogram_metrics, self.histogram_borderline)[0]
+        
+    def histogram_metrics(self, level: FrameLevel) -> Tuple[Tuple[Dict, str], Dict]:
+        """Clipping, spread and exposure class of one level"""
         try:
-            with Image.open(image_path) as img:
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Calculate histogram
-                hist_r = img.histogram()[0:256]
-                hist_g = img.histogram()[256:512]
-                hist_b = img.histogram()[512:768]
-                
-                # Calculate statistics
-                total_pixels = sum(hist_r)
-                
-                # Check for clipping (under/over exposure)
-                underexposed = (hist_r[0] + hist_g[0] + hist_b[0]) / (total_pixels * 3)
-                overexposed = (hist_r[255] + hist_g[255] + hist_b[255]) / (total_pixels * 3)
-                
-                # Calculate histogram spread
-                def calculate_spread(hist):
-                    first_nonzero = next((i for i, x in enumerate(hist) if x > 0), 0)
-                    last_nonzero = next((i for i, x in enumerate(reversed(hist)) if x > 0), 0)
-                    return (255 - last_nonzero - first_nonzero) / 255
-                
-                spread_r = calculate_spread(hist_r)
-                spread_g = calculate_spread(hist_g)
-                spread_b = calculate_spread(hist_b)
-                avg_spread = (spread_r + spread_g + spread_b) / 3
-                
-                # Determine quality
-                exposure_threshold = self.quality_config.get("exposure_threshold", 0.1)
-                quality = "good"
-                
-                if underexposed > exposure_threshold:
-                    quality = "underexposed"
-                elif overexposed > exposure_threshold:
-                    quality = "overexposed"
-                elif avg_spread < 0.5:
-                    quality = "low_contrast"
-                
-                return {
-                    "underexposed": underexposed,
-                    "overexposed": overexposed,
-                    "spread": avg_spread,
-                    "quality": quality
-                }, quality
-                
+            # One bincount over all three channels, offset into a 3x256 table
+            rgb = level.rgb
+            offsets = np.array([0, 256, 512], dtype=np.uint16)
+            hist = np.bincount((rgb + offsets).ravel(), minlength=768).reshape(3, 256)
+            
+            # Check for clipping (under/over exposure)
+            total_values = hist.sum()
+            underexposed = float(hist[:, 0].sum() / total_values)
+            overexposed = float(hist[:, 255].sum() / total_values)
+            
+            # Calculate histogram spread from first and last populated bins
+            populated = hist > 0
+            first_nonzero = populated.argmax(axis=1)
+            last_nonzero = populated[:, ::-1].argmax(axis=1)
+            avg_spread = float(((255 - last_nonzero - first_nonzero) / 255).mean())
+            
+            # Determine quality
+            quality = self.EXPOSURE_CLASSES[
+                int(self.classify_exposure(underexposed, overexposed, avg_spread))
+            ]
+            
+            data = {
+                "underexposed": underexposed,
+                "overexposed": overexposed,
+                "spread": avg_spread,
+                "quality": quality
+            }
+            return (data, quality), data
+            
         except Exception as e:
-            return {}, "error"
+            return ({}, "error"), {}
+            
+    def classify_exposure(self, underexposed, overexposed, spread):
+        """Index into EXPOSURE_CLASSES from clipping fractions and histogram spread"""
+        threshold = self.quality_config.get("exposure_threshold", 0.1)
+        return np.select(
+            [underexposed > threshold, overexposed > threshold, spread < 0.5],
+            [1, 2, 3],
+            0,
+        )
+            
+    def histogram_borderline(self, values: Dict, octaves: float) -> bool:
+        if not values:
+            return False
+        exposure_threshold = self.quality_config.get("exposure_threshold", 0.1)
+        margin = self.cascade_config.get("exposure_margin", 0.25)
+        return (
+            self.near(values["underexposed"], (exposure_threshold,), margin)
+            or self.near(values["overexposed"], (exposure_threshold,), margin)
+            or self.near(
+                values["spread"],
+                (0.5,),
+                self.cascade_config.get("contrast_margin", 0.1),
+            )
+        )
     
-    def analyze_concert_specific(self, image_path: Path) -> Dict:
+    def analyze_concert_specific(self, frame: DecodedFrame) -> Dict:
         """Concert photography specific analysis"""
         if not self.concert_config.get("enabled", False):
             return {}
-            
+        return self.decide(frame, self.concert_metrics, self.concert_borderline)[0]
+        
+    def concert_metrics(self, level: FrameLevel) -> Tuple[Dict, Dict]:
+        """Stage lighting, motion blur, crowd and low-light flags of one level"""
         try:
-            with Image.open(image_path) as img:
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Convert to array for analysis
-                img_array = np.array(img)
-                
-                # Stage lighting detection (high contrast, colored lights)
-                stage_lighting = self.detect_stage_lighting(img_array)
-                
-                # Motion blur detection (specific patterns)
-                motion_blur = self.detect_motion_blur(img_array)
-                
-                # Crowd detection (lots of faces/people)
-                crowd_detected = self.detect_crowd_elements(img_array)
-                
-                return {
-                    "stage_lighting": stage_lighting,
-                    "motion_blur": motion_blur,
-                    "crowd_detected": crowd_detected,
-                    "low_light": np.mean(img_array) < self.concert_config.get("low_light_threshold", 50)
-                }
-                
+            brightness, contrast = self.rgb_mean_std(level.rgb)
+            
+            # Motion blur detection (specific patterns)
+            x_var, y_var = self.sobel_variances(level.gray) if cv2 else (None, None)
+            motion_blur = self.classify_motion_blur(x_var, y_var)
+            
+            # Texture variance stands in for crowd detection
+            texture_variance = self.gray_variance(level.gray)
+            stage_lighting, crowd_detected, low_light = self.classify_concert(
+                brightness, contrast, texture_variance
+            )
+            
+            result = {
+                "stage_lighting": bool(stage_lighting),
+                "motion_blur": motion_blur,
+                "crowd_detected": bool(crowd_detected),
+                "low_light": bool(low_light)
+            }
+            values = {
+                "brightness": brightness,
+                "contrast": contrast,
+                "x_var": x_var,
+                "y_var": y_var,
+                "texture": texture_variance,
+            }
+            return result, values
+            
         except Exception as e:
-            return {"error": str(e)}
+            return {"error": str(e)}, {}
+            
+    def classify_concert(self, brightness, contrast, texture):
+        """Stage lighting, crowd and low-light flags"""
+        # Stage lighting is high contrast at moderate brightness; high texture
+        # variance often means a crowd
+        stage_lighting = (contrast > 60) & (30 < brightness) & (brightness < 200)
+        return (
+            stage_lighting,
+            texture > 1000,
+            brightness < self.concert_config.get("low_light_threshold", 50),
+        )
+            
+    def concert_borderline(self, values: Dict, octaves: float) -> bool:
+        if not values:
+            return False
+        margin = self.cascade_config.get("concert_margin", 0.2)
+        low_light_threshold = self.concert_config.get("low_light_threshold", 50)
+        if self.near(values["brightness"], (30, 200, low_light_threshold), margin):
+            return True
+        if self.near(values["contrast"], (60,), margin) or self.near(
+            values["texture"], (1000,), margin
+        ):
+            return True
+        x_var, y_var = values["x_var"], values["y_var"]
+        if x_var is None:
+            return False
+        # The directional ratio holds across scales; the gradient variances do not
+        if min(x_var, y_var) > 0 and self.near(
+            max(x_var, y_var) / min(x_var, y_var), (2,), margin
+        ):
+            return True
+        return self.straddles(
+            max(x_var, y_var),
+            (100,),
+            self.cascade_config.get("gradient_ratio", (1.5, 3.5)),
+            octaves,
+        )
+    
+    @staticmethod
+    def rgb_mean_std(img_array: np.ndarray) -> Tuple[float, float]:
+        """Mean and standard deviation over all channels of an RGB array"""
+        if cv2 and img_array.ndim == 3:
+            # Combine per-channel moments instead of flattening to float64
+            means, stds = cv2.meanStdDev(img_array)
+            means, stds = means.ravel(), stds.ravel()
+            mean = float(means.mean())
+            variance = float((stds ** 2 + means ** 2).mean()) - mean ** 2
+            return mean, max(variance, 0.0) ** 0.5
+        return float(np.mean(img_array, dtype=np.float32)), float(
+            np.std(img_array, dtype=np.float32)
+        )
     
     def detect_stage_lighting(self, img_array: np.ndarray) -> bool:
         """Detect stage lighting patterns"""
         # Look for high contrast and color saturation typical of stage lights
-        brightness = np.mean(img_array)
-        contrast = np.std(img_array)
+        brightness, contrast = self.rgb_mean_std(img_array)
         
         # Stage lighting typically has high contrast and moderate brightness
-        return contrast > 60 and 30 < brightness < 200
+        return bool(contrast > 60 and 30 < brightness < 200)
     
     def detect_motion_blur(self, img_array: np.ndarray) -> str:
         """Detect motion blur patterns"""
-        if not HAS_CV2:
+        if not cv2:
             return "unknown"
             
-        # Convert to grayscale
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+        # Accept either RGB or an already-converted grayscale array
+        gray = (
+            cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+            if img_array.ndim == 3
+            else img_array
+        )
+        return self.classify_motion_blur(*self.sobel_variances(gray))
         
-        # Use different blur detection for motion vs camera shake
-        sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
+    def sobel_variances(self, gray: np.ndarray) -> Tuple[float, float]:
+        """Variance of the horizontal and vertical Sobel gradients"""
+        x_var = self.gray_variance(cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3))
+        y_var = self.gray_variance(cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3))
+        return x_var, y_var
         
-        # Motion blur tends to be directional
-        x_var = np.var(sobelx)
-        y_var = np.var(sobely)
+    @classmethod
+    def classify_motion_blur(
+        cls, x_var: Optional[float], y_var: Optional[float]
+    ) -> str:
+        """Motion blur, camera shake or sharp from the directional gradient variances"""
+        if x_var is None:
+            return "unknown"
+        return cls.MOTION_CLASSES[int(cls.motion_blur_index(x_var, y_var))]
         
-        if max(x_var, y_var) / min(x_var, y_var) > 2:
-            return "motion_blur"
-        elif x_var < 100 and y_var < 100:
-            return "camera_shake"
-        else:
-            return "sharp"
+    @staticmethod
+    def motion_blur_index(x_var, y_var):
+        """Index into MOTION_CLASSES for directional gradient variances"""
+        low, high = np.minimum(x_var, y_var), np.maximum(x_var, y_var)
+        # Motion blur tends to be directional
+        return np.select([(low > 0) & (high > 2 * low), high < 100], [1, 2], 0)
     
     def detect_crowd_elements(self, img_array: np.ndarray) -> bool:
         """Detect crowd/audience elements"""
@@ -246,111 +730,2932 @@ class QualityAnalyzer:
         # This is a simplified version - could be enhanced with face detection
         
         # Look for repetitive patterns typical of crowds
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY) if HAS_CV2 else img_array.mean(axis=2)
+        if img_array.ndim == 2:
+            gray = img_array
+        else:
+            gray = (
+                cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+                if cv2
+                else img_array.mean(axis=2)
+            )
         
         # High texture variance often indicates crowds
-        texture_variance = np.var(gray)
-        return texture_variance > 1000  # Threshold for crowd-like texture
+        texture_variance = self.gray_variance(gray)
+        return bool(texture_variance > 1000)  # Threshold for crowd-like texture
 
-class EnhancedPhotoTagger:
-    """Enhanced photo tagger with quality control"""
+class PipelineMetrics:
+    """Thread-safe per-stage timings, counters and queue-depth gauges"""
     
-    def __init__(self, config: Dict):
-        self.config = config
-        self.quality_analyzer = QualityAnalyzer(config)
-        self.setup_logging()
-        self.setup_progress_tracking()
-        self.check_dependencies()
+    def __init__(self, window: int = 2048):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}  # Last window samples per stage, for rolling percentiles
+        self._totals = {}  # Lifetime [count, sum] per stage
+        self._counters = {}
+        self._gauges = {}
         
-    def setup_logging(self):
-        """Setup logging configuration"""
-        log_file = self.config["pictures_folder"] / "ai_photo_tagger_v3.log"
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler(sys.stdout)
-            ]
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            if stage not in self._samples:
+                self._samples[stage] = deque(maxlen=self.window)
+                self._totals[stage] = [0, 0.0]
+            self._samples[stage].append(seconds)
+            self._totals[stage][0] += 1
+            self._totals[stage][1] += seconds
+            
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+            
+    def set_counter(self, name: str, value: int):
+        with self._lock:
+            self._counters[name] = value
+            
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+            
+    def snapshot(self) -> Dict:
+        with self._lock:
+            samples = {
+                stage: np.fromiter(values, dtype=np.float64)
+                for stage, values in self._samples.items()
+            }
+            totals = {stage: list(total) for stage, total in self._totals.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        stages = {}
+        for stage, values in samples.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stages[stage] = {
+                "count": totals[stage][0],
+                "sum": totals[stage][1],
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+            }
+        return {
+            "time": datetime.now().isoformat(),
+            "stages": stages,
+            "counters": counters,
+            "queues": gauges,
+        }
+        
+    @staticmethod
+    def write_jsonl(path: Path, snapshot: Dict):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(snapshot) + "\n")
+            
+    @staticmethod
+    def write_prometheus(path: Path, snapshot: Dict):
+        """Write a textfile-collector file atomically; node_exporter never sees half"""
+        lines = [
+            "# HELP ai_photo_tagger_stage_seconds Per-photo pipeline stage latency.",
+            "# TYPE ai_photo_tagger_stage_seconds summary",
+        ]
+        for stage, stats in snapshot["stages"].items():
+            for quantile in ("0.5", "0.95", "0.99"):
+                key = {"0.5": "p50", "0.95": "p95", "0.99": "p99"}[quantile]
+                lines.append(
+                    'ai_photo_tagger_stage_seconds'
+                    f'{{stage="{stage}",quantile="{quantile}"}} {stats[key]:.6f}'
+                )
+            lines.append(
+                f'ai_photo_tagger_stage_seconds_sum{{stage="{stage}"}} '
+                f'{stats["sum"]:.6f}'
+            )
+            lines.append(
+                f'ai_photo_tagger_stage_seconds_count{{stage="{stage}"}} '
+                f'{stats["count"]}'
+            )
+        lines += [
+            "# HELP ai_photo_tagger_events_total Photos and pipeline events since the "
+            "run started.",
+            "# TYPE ai_photo_tagger_events_total counter",
+        ]
+        for name, value in snapshot["counters"].items():
+            lines.append(f'ai_photo_tagger_events_total{{event="{name}"}} {value}')
+        lines += [
+            "# HELP ai_photo_tagger_queue_depth Items waiting in each pipeline queue.",
+            "# TYPE ai_photo_tagger_queue_depth gauge",
+        ]
+        for name, value in snapshot["queues"].items():
+            lines.append(f'ai_photo_tagger_queue_depth{{queue="{name}"}} {value}')
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+def file_content_hash(path: Path, chunk_size: int = 1 << 20) -> str:
+    """BLAKE2b digest of a file's bytes, read in chunks"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def connect_sqlite(db_path: Path, shared: bool = False, **kwargs) -> sqlite3.Connection:
+    """Open one of our SQLite databases, shared ones on a network share (see cluster)"""
+    # WAL needs shared memory that does not work across hosts, so shared
+    # databases use a rollback journal
+    conn = sqlite3.connect(str(db_path), timeout=60 if shared else 5, **kwargs)
+    conn.execute("PRAGMA journal_mode=DELETE" if shared else "PRAGMA journal_mode=WAL")
+    return conn
+
+class KeywordCache:
+    """Persistent content-addressed cache of model answers, bounded with LRU eviction"""
+    
+    TOUCH_BATCH = 256  # Hits whose LRU refresh is written in one transaction
+    
+    def __init__(self, db_path: Path, max_bytes: int, shared: bool = False):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # Shared between inference threads
+        self._touched = {}  # key -> last use not yet written, so hits stay reads
+        self._conn = connect_sqlite(db_path, shared, check_same_thread=False)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL, keywords TEXT NOT NULL,"
+            " size INTEGER NOT NULL, last_used REAL NOT NULL)"
         )
-        self.logger = logging.getLogger(__name__)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)"
+        )
+        self._conn.commit()
+        self.total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
         
-    def setup_progress_tracking(self):
-        """Initialize progress tracking"""
-        self.progress_file = self.config["pictures_folder"] / "ai_photo_tagger_v3_progress.json"
-        self.processed_count = 0
-        self.skipped_count = 0
-        self.error_count = 0
-        self.quality_issues = 0
-        self.start_time = datetime.now()
-        self.progress = self.load_progress()
+    @staticmethod
+    def make_key(
+        content_hash: str, model: str, prompt: str, max_image_size: int
+    ) -> str:
+        # Keyed by content, so duplicate files and re-runs skip inference
+        prompt_hash = hashlib.sha256(
+            f"{prompt}|{json.dumps(MODEL_OPTIONS, sort_keys=True)}".encode()
+        ).hexdigest()
+        return hashlib.sha256(
+            f"{content_hash}|{model}|{prompt_hash}|{max_image_size}".encode()
+        ).hexdigest()
+        
+    def get(self, *keys: str) -> Optional[Dict]:
+        """Cached {"response", "keywords"} of the first key found; LRU update later"""
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT response, keywords FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    break
+            else:
+                self.misses += 1
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.TOUCH_BATCH:
+                self._write_touched()
+                self._conn.commit()
+            self.hits += 1
+            return {"response": row[0], "keywords": json.loads(row[1])}
+            
+    def _write_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                   [(used, key) for key, used in self._touched.items()])
+            self._touched.clear()
+            
+    def put(self, key: str, response: str, keywords: List[str]):
+        """Store an answer and evict least recently used entries over budget"""
+        keywords_json = json.dumps(keywords)
+        size = len(key) + len(response.encode('utf-8')) + len(keywords_json)
+        with self._lock:
+            # Eviction must see the hits since the last write
+            self._write_touched()
+            old = self._conn.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, response, keywords, size,"
+                " last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, response, keywords_json, size, time.time()),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            while self.total_bytes > self.max_bytes:
+                victims = self._conn.execute(
+                    "SELECT key, size FROM entries ORDER BY last_used LIMIT 64"
+                ).fetchall()
+                if not victims:
+                    break
+                # Oldest first, and only as many as it takes to get back under budget
+                evicted = []
+                for victim_key, victim_size in victims:
+                    if self.total_bytes <= self.max_bytes:
+                        break
+                    evicted.append((victim_key,))
+                    self.total_bytes -= victim_size
+                self._conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+            self._conn.commit()
+            
+    def close(self):
+        with self._lock:
+            self._write_touched()
+            self._conn.commit()
+            self._conn.close()
+
+class ThumbnailCache:
+    """Persistent cache of model inputs (resized JPEGs); one writer, any readers"""
+    
+    # A pack is rewritten once it has this many dead bytes, and half is dead
+    COMPACT_DEAD_BYTES = 16 * 1024 * 1024
+    
+    def __init__(self, directory: Path, max_bytes: int, shards: int = 16):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # JPEGs are appended to this many pack files, not one file each
+        self.shards = max(1, shards)
+        self._maps = {}  # pack -> mmap, so get() returns zero-copy views
+        directory.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(directory / "index.sqlite"))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, pack TEXT NOT NULL, offset INTEGER NOT NULL,"
+            " length INTEGER NOT NULL,"
+            " meta TEXT, last_used REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);"
+            "CREATE TABLE IF NOT EXISTS packs ("
+            " shard INTEGER PRIMARY KEY, name TEXT NOT NULL,"
+            " generation INTEGER NOT NULL, dead_bytes INTEGER NOT NULL);"
+        )
+        self._conn.commit()
+        self.total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(length), 0) FROM entries"
+        ).fetchone()[0]
+        
+    @staticmethod
+    def make_key(path: Path, size: int, mtime: float, max_image_size: int) -> str:
+        # File identity only, so re-tagging with a new model or prompt skips the decode
+        return hashlib.blake2b(
+            f"{path}|{size}|{mtime}|{max_image_size}".encode(), digest_size=16
+        ).hexdigest()
         
-    def load_progress(self) -> Dict:
-        """Load progress from previous sessions"""
-        if self.progress_file.exists():
+    def _view(self, pack: str, offset: int, length: int) -> Optional[memoryview]:
+        import mmap
+        mapped = self._maps.get(pack)
+        if mapped is None or offset + length > len(mapped):
+            # Packs only grow; remap to see bytes appended since the last map
             try:
-                with open(self.progress_file, 'r') as f:
-                    progress = json.load(f)
-                    progress["processed_files"] = set(progress.get("processed_files", []))
-                    return progress
-            except:
-                pass
-        return {"processed_files": set(), "last_processed": None}
+                with open(self.directory / pack, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return None
+            self._maps[pack] = mapped
+            if offset + length > len(mapped):
+                return None
+        return memoryview(mapped)[offset:offset + length]
         
-    def save_progress(self):
-        """Save current progress"""
-        progress_data = {
-            "processed_files": list(self.progress["processed_files"]),
-            "last_processed": self.progress["last_processed"],
-            "session_stats": {
-                "processed": self.processed_count,
-                "skipped": self.skipped_count,
-                "errors": self.error_count,
-                "quality_issues": self.quality_issues,
-                "session_start": self.start_time.isoformat()
-            }
-        }
-        with open(self.progress_file, 'w') as f:
-            json.dump(progress_data, f, indent=2)
+    def get(self, key: str) -> Optional[Tuple[memoryview, Dict]]:
+        """(JPEG bytes, metadata) for key without copying the bytes"""
+        row = self._conn.execute(
+            "SELECT pack, offset, length, meta FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        view = self._view(*row[:3]) if row is not None else None
+        if view is None:
+            return None
+        return view, json.loads(row[3]) if row[3] else {}
+        
+    def touch(self, key: str):
+        """Refresh the LRU position of key; persisted by the next commit()"""
+        self._conn.execute(
+            "UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        
+    def put(self, key: str, data: Optional[bytes], meta: Dict):
+        """Append data for key, or only replace its metadata when data is None"""
+        if data is None:
+            self._conn.execute(
+                "UPDATE entries SET meta = ?, last_used = ? WHERE key = ?",
+                (json.dumps(meta), time.time(), key),
+            )
+            return
+        shard = int(key[:8], 16) % self.shards
+        row = self._conn.execute(
+            "SELECT name FROM packs WHERE shard = ?", (shard,)
+        ).fetchone()
+        if row is None:
+            pack = f"pack-{shard:02d}.0.bin"
+            self._conn.execute(
+                "INSERT INTO packs (shard, name, generation, dead_bytes)"
+                " VALUES (?, ?, 0, 0)",
+                (shard, pack),
+            )
+        else:
+            pack = row[0]
+        with open(self.directory / pack, 'ab') as f:
+            offset = f.tell()
+            f.write(data)
+        self._release(
+            self._conn.execute(
+                "SELECT pack, length FROM entries WHERE key = ?", (key,)
+            ).fetchall()
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries (key, pack, offset, length, meta,"
+            " last_used) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, pack, offset, len(data), json.dumps(meta), time.time()),
+        )
+        self.total_bytes += len(data)
+        while self.total_bytes > self.max_bytes:
+            victims = []
+            excess = self.total_bytes - self.max_bytes
+            for victim in self._conn.execute(
+                "SELECT key, pack, length FROM entries ORDER BY last_used LIMIT 64"
+            ):
+                victims.append(victim)
+                excess -= victim[2]
+                if excess <= 0:
+                    break
+            if not victims:
+                break
+            self._conn.executemany(
+                "DELETE FROM entries WHERE key = ?", [(v[0],) for v in victims]
+            )
+            self._release([v[1:] for v in victims])
+        self._compact_dead_packs()
+        
+    def _release(self, entries: List[Tuple[str, int]]):
+        # Account for pack bytes no longer referenced by any entry
+        for pack, length in entries:
+            self.total_bytes -= length
+            self._conn.execute(
+                "UPDATE packs SET dead_bytes = dead_bytes + ? WHERE name = ?",
+                (length, pack),
+            )
             
-    def check_dependencies(self):
-        """Check if required dependencies are available"""
-        print()
-        print("=" * 70)
-        print("  🔍 ENHANCED PHOTO TAGGER v3.0 - SYSTEM CHECK  ".center(70))
-        print("=" * 70)
+    def _compact_dead_packs(self):
+        """Rewrite packs that are mostly dead bytes into a new generation"""
+        for shard, pack, generation, dead_bytes in self._conn.execute(
+            "SELECT shard, name, generation, dead_bytes FROM packs"
+        ).fetchall():
+            try:
+                pack_size = os.path.getsize(self.directory / pack)
+            except OSError:
+                continue
+            if dead_bytes < self.COMPACT_DEAD_BYTES or dead_bytes * 2 < pack_size:
+                continue
+            new_pack = f"pack-{shard:02d}.{generation + 1}.bin"
+            moved = []
+            with open(self.directory / pack, 'rb') as src, open(
+                self.directory / new_pack, 'wb'
+            ) as dst:
+                for key, offset, length in self._conn.execute(
+                    "SELECT key, offset, length FROM entries WHERE pack = ?"
+                    " ORDER BY offset",
+                    (pack,),
+                ).fetchall():
+                    src.seek(offset)
+                    moved.append((new_pack, dst.tell(), key))
+                    dst.write(src.read(length))
+            self._conn.executemany(
+                "UPDATE entries SET pack = ?, offset = ? WHERE key = ?", moved
+            )
+            self._conn.execute(
+                "UPDATE packs SET name = ?, generation = ?, dead_bytes = 0"
+                " WHERE shard = ?",
+                (new_pack, generation + 1, shard),
+            )
+            self._conn.commit()
+            # Readers holding the old map keep valid views until they drop them
+            self._maps.pop(pack, None)
+            try:
+                os.remove(self.directory / pack)
+            except OSError:
+                pass
+                
+    def commit(self):
+        self._conn.commit()
         
-        # Platform info
-        print(f"🖥️  Platform ................................ {platform.system()} {platform.release()}")
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+        self._maps.clear()
+
+def physical_memory() -> Optional[int]:
+    """Total physical memory in bytes, None where it cannot be determined"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def exiftool_command() -> str:
+    """Platform-specific ExifTool executable name"""
+    return "exiftool.exe" if platform.system() == "Windows" else "exiftool"
+
+class ExifToolSession:
+    """One long-lived ``exiftool -stay_open`` process for bulk metadata writes"""
+    
+    def __init__(self, executable: Optional[str] = None):
+        self.executable = executable or exiftool_command()
+        self.process = None
+        self._sequence = 0
+        
+    def start(self):
+        self.process = subprocess.Popen(
+            [self.executable, '-stay_open', 'True', '-@', '-'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+        )
         
-        # Check Ollama
+    def close(self):
+        """Ask ExifTool to exit and wait for it"""
+        if self.process is None:
+            return
         try:
-            ollama.list()
-            print("✅ Ollama Service .......................... RUNNING")
-        except Exception as e:
-            print("❌ Ollama Service .......................... NOT RUNNING")
-            print("   Please install Ollama and run: ollama serve")
-            sys.exit(1)
+            self.process.stdin.write("-stay_open\nFalse\n")
+            self.process.stdin.flush()
+            self.process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+        self.process = None
+        
+    def restart(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process = None
+        self.start()
+        
+    def _send(self, args: List[str]) -> int:
+        self._sequence += 1
+        # One argument per line; values must not contain newlines
+        lines = [str(a).replace("\r", " ").replace("\n", " ") for a in args]
+        self.process.stdin.write("\n".join(lines) + f"\n-execute{self._sequence}\n")
+        return self._sequence
+        
+    def _read_result(self, sequence: int) -> str:
+        marker = f"{{ready{sequence}}}"
+        output = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise BrokenPipeError("exiftool exited unexpectedly")
+            if line.strip() == marker:
+                return "".join(output)
+            output.append(line)
             
-        # Check model
+    def execute_batch(self, commands: List[List[str]]) -> List[str]:
+        """Run several commands in one round trip and return each command's output"""
+        # The batch is written before any result is read; a dead process restarts once
+        for attempt in range(2):
+            if self.process is None or self.process.poll() is not None:
+                self.start()
+            try:
+                sequences = [self._send(args) for args in commands]
+                self.process.stdin.flush()
+                return [self._read_result(seq) for seq in sequences]
+            except (BrokenPipeError, OSError):
+                if attempt:
+                    raise
+                self.restart()
+        return []
+        
+    @staticmethod
+    def write_succeeded(output: str) -> bool:
+        """Whether one file's status lines report it written or unchanged, no error"""
+        lines = [line.strip() for line in output.splitlines()]
+        if any(line.startswith("Error:") for line in lines):
+            return False
+        return any(
+            re.fullmatch(r"1 image files (updated|unchanged)", line) for line in lines
+        )
+        
+    def write_keywords(
+        self, jobs: List[Tuple[Path, List[str], Optional[Dict], List[str]]]
+    ) -> List[Tuple[bool, str]]:
+        """Replace keywords a previous run embedded with ours; (ok, output) per file"""
+        commands = []
+        for path, keywords, quality_data, owned in jobs:
+            args = ['-charset', 'filename=utf8', '-overwrite_original', '-P', '-m']
+            for keyword in owned:
+                if keyword not in keywords:
+                    args += [
+                        f'-XMP-dc:Subject-={keyword}',
+                        f'-IPTC:Keywords-={keyword}',
+                    ]
+            for keyword in keywords:
+                # Remove-then-add keeps existing keywords without duplicating ours
+                args += [f'-XMP-dc:Subject-={keyword}', f'-XMP-dc:Subject+={keyword}',
+                         f'-IPTC:Keywords-={keyword}', f'-IPTC:Keywords+={keyword}']
+            if quality_data:
+                args.append(
+                    '-XMP-photoshop:Instructions=Quality Analysis: '
+                    f'{json.dumps(quality_data)}'
+                )
+            args.append(str(path))
+            commands.append(args)
+        outputs = self.execute_batch(commands)
+        return [(self.write_succeeded(output), output.strip()) for output in outputs]
+
+# XMP namespaces written by the tagger
+XMP_NAMESPACES = {
+    "x": "adobe:ns:meta/",
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "xmp": "http://ns.adobe.com/xap/1.0/",
+    "photoshop": "http://ns.adobe.com/photoshop/1.0/",
+    "aitagger": "https://github.com/trevcodner/ai-photo-tagger/xmp/1.0/",
+}
+
+# Quality keywords generate_quality_tags makes, for sidecars before aitagger:Keywords
+QUALITY_TAG_PREFIXES = ("quality:", "exposure:")
+QUALITY_TAGS = ("stage_lighting", "motion_blur", "crowd", "low_light")
+
+# Keyword on sidecars of photos that failed triage
+REJECTED_TAG = "quality:rejected"
+
+class SidecarWriter:
+    """Atomic, merge-aware XMP sidecar writer"""
+    
+    _ns_lock = threading.Lock()
+    
+    def __init__(self, max_workers: int = 4, logger: Optional[logging.Logger] = None,
+                 metrics: Optional["PipelineMetrics"] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_workers = max(1, max_workers)
+        self.metrics = metrics
+        self._executor = None
+        
+    @staticmethod
+    def sidecar_path(image_path: Path) -> Path:
+        return image_path.with_suffix(image_path.suffix + '.xmp')
+        
+    @staticmethod
+    def is_quality_tag(keyword: str) -> bool:
+        return keyword.startswith(QUALITY_TAG_PREFIXES) or keyword in QUALITY_TAGS
+        
+    @classmethod
+    def owned_keywords(cls, xmp_path: Path) -> List[str]:
+        """Keywords the tagger wrote (quality tags if it predates aitagger:Keywords)"""
+        import xml.etree.ElementTree as ET
+        rdf = XMP_NAMESPACES["rdf"]
         try:
-            models = ollama.list()
-            available_models = [m['model'] for m in models['models']]
-            if self.config["ollama_model"] not in available_models:
+            root = ET.parse(str(xmp_path)).getroot()
+        except (OSError, ET.ParseError):
+            return []
+        owned = root.find(f'.//{{{XMP_NAMESPACES["aitagger"]}}}Keywords')
+        if owned is not None:
+            return [li.text or "" for li in owned.iter(f'{{{rdf}}}li')]
+        subject = root.find(f'.//{{{XMP_NAMESPACES["dc"]}}}subject')
+        existing = (
+            [li.text or "" for li in subject.iter(f'{{{rdf}}}li')]
+            if subject is not None
+            else []
+        )
+        return [k for k in existing if cls.is_quality_tag(k)]
+        
+    @staticmethod
+    def _parse(xmp_path: Path):
+        """(root, namespace prefixes) of an existing sidecar"""
+        import xml.etree.ElementTree as ET
+        namespaces = dict(XMP_NAMESPACES)
+        events = ET.iterparse(str(xmp_path), events=('start-ns',))
+        for _, (prefix, uri) in events:
+            if prefix and not prefix.startswith('ns'):
+                namespaces.setdefault(prefix, uri)
+        return events.root, namespaces
+        
+    @classmethod
+    def _serialize(cls, root, namespaces: Dict[str, str]) -> bytes:
+        import xml.etree.ElementTree as ET
+        # Keep the prefixes other tools used so ElementTree doesn't rename them to
+        # ns0, ns1... The registry is process-global, so no other writer may re-bind a
+        # prefix until this document is out
+        with cls._ns_lock:
+            for prefix, uri in namespaces.items():
+                ET.register_namespace(prefix, uri)
+            return ET.tostring(root, encoding='utf-8')
+            
+    @staticmethod
+    def _new_document():
+        import xml.etree.ElementTree as ET
+        rdf = XMP_NAMESPACES["rdf"]
+        root = ET.Element(f'{{{XMP_NAMESPACES["x"]}}}xmpmeta')
+        root.set(f'{{{XMP_NAMESPACES["x"]}}}xmptk', "Enhanced AI Photo Tagger v3.0")
+        rdf_root = ET.SubElement(root, f'{{{rdf}}}RDF')
+        description = ET.SubElement(rdf_root, f'{{{rdf}}}Description')
+        description.set(f'{{{rdf}}}about', "")
+        return root
+        
+    def build(
+        self, xmp_path: Path, keywords: List[str], quality_data: Optional[Dict]
+    ) -> bytes:
+        """Sidecar contents with keywords and quality data merged into any existing"""
+        # Only dc:subject and the quality data change, so edits by Lightroom,
+        # darktable and others survive
+        import xml.etree.ElementTree as ET
+        rdf = XMP_NAMESPACES["rdf"]
+        dc = XMP_NAMESPACES["dc"]
+        xmp = XMP_NAMESPACES["xmp"]
+        photoshop = XMP_NAMESPACES["photoshop"]
+        
+        root = None
+        namespaces = XMP_NAMESPACES
+        if xmp_path.exists():
+            try:
+                root, namespaces = self._parse(xmp_path)
+            except ET.ParseError as e:
+                # Never silently discard someone else's metadata
+                backup = xmp_path.with_suffix(xmp_path.suffix + '.bak')
+                os.replace(xmp_path, backup)
+                self.logger.warning(
+                    f"Unreadable sidecar {xmp_path} ({e}); moved to {backup.name}"
+                )
+        if root is None:
+            namespaces = XMP_NAMESPACES
+            root = self._new_document()
+        
+        descriptions = list(root.iter(f'{{{rdf}}}Description'))
+        if not descriptions:
+            rdf_root = root.find(f'{{{rdf}}}RDF')
+            if rdf_root is None:
+                rdf_root = ET.SubElement(root, f'{{{rdf}}}RDF')
+            descriptions = [
+                ET.SubElement(
+                    rdf_root, f'{{{rdf}}}Description', {f'{{{rdf}}}about': ""}
+                )
+            ]
+        description = next(
+            (d for d in descriptions if d.find(f'{{{dc}}}subject') is not None),
+            descriptions[0],
+        )
+        
+        def replace_bag(
+            name: str, namespace: str, values: List[str]
+        ) -> Optional[List[str]]:
+            # Returns the bag's previous values, None if it did not exist
+            element = description.find(f'{{{namespace}}}{name}')
+            previous = None
+            if element is None:
+                element = ET.SubElement(description, f'{{{namespace}}}{name}')
+            bag = element.find(f'{{{rdf}}}Bag')
+            if bag is None:
+                bag = ET.SubElement(element, f'{{{rdf}}}Bag')
+            else:
+                previous = [li.text or "" for li in bag.findall(f'{{{rdf}}}li')]
+            for li in list(bag):
+                bag.remove(li)
+            for value in values:
+                ET.SubElement(bag, f'{{{rdf}}}li').text = value
+            return previous
+            
+        # Merge keywords into dc:subject, replacing the ones we wrote last time
+        # (kept in aitagger:Keywords)
+        owned = replace_bag("Keywords", XMP_NAMESPACES["aitagger"], keywords)
+        subject = description.find(f'{{{dc}}}subject')
+        bag = subject.find(f'{{{rdf}}}Bag') if subject is not None else None
+        existing = (
+            [li.text or "" for li in bag.findall(f'{{{rdf}}}li')]
+            if bag is not None
+            else []
+        )
+        if owned is None:
+            merged = [k for k in existing if not self.is_quality_tag(k)]
+        else:
+            owned = set(owned)
+            merged = [k for k in existing if k not in owned]
+        merged += [k for k in keywords if k not in merged]
+        replace_bag("subject", dc, merged)
+            
+        def set_property(namespace: str, name: str, value: str):
+            # Properties may be stored as attributes or child elements
+            tag = f'{{{namespace}}}{name}'
+            description.attrib.pop(tag, None)
+            element = description.find(tag)
+            if element is None:
+                element = ET.SubElement(description, tag)
+            element.text = value
+            
+        set_property(
+            xmp,
+            "MetadataDate",
+            datetime.now().astimezone().isoformat(timespec='seconds'),
+        )
+        if (
+            description.find(f'{{{xmp}}}CreatorTool') is None
+            and f'{{{xmp}}}CreatorTool' not in description.attrib
+        ):
+            set_property(xmp, "CreatorTool", "Enhanced AI Photo Tagger v3.0")
+        if quality_data:
+            set_property(
+                photoshop,
+                "Instructions",
+                f"Quality Analysis: {json.dumps(quality_data)}",
+            )
+        else:
+            # Don't leave the previous run's analysis behind
+            description.attrib.pop(f'{{{photoshop}}}Instructions', None)
+            for element in description.findall(f'{{{photoshop}}}Instructions'):
+                description.remove(element)
+            
+        ET.indent(root, space="    ")
+        return (
+            b'<?xml version="1.0" encoding="UTF-8"?>\n'
+            + self._serialize(root, namespaces)
+            + b'\n'
+        )
+        
+    def write(
+        self, image_path: Path, keywords: List[str], quality_data: Optional[Dict] = None
+    ) -> bool:
+        """Merge and atomically replace the sidecar for image_path"""
+        xmp_path = self.sidecar_path(image_path)
+        tmp_path = None
+        started = time.perf_counter()
+        try:
+            content = self.build(xmp_path, keywords, quality_data)
+            import tempfile
+            fd, tmp_path = tempfile.mkstemp(
+                dir=str(xmp_path.parent), prefix=f'.{xmp_path.name}.', suffix='.tmp'
+            )
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, xmp_path)
+            if self.metrics is not None:
+                self.metrics.observe("sidecar", time.perf_counter() - started)
+            return True
+        except Exception as e:
+            self.logger.error(f"Error writing enhanced XMP for {image_path}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+            
+    def submit(
+        self, image_path: Path, keywords: List[str], quality_data: Optional[Dict] = None
+    ):
+        """Queue a write, overlapping slow shares with inference; a Future[bool]"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="sidecar"
+            )
+        return self._executor.submit(self.write, image_path, keywords, quality_data)
+        
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+class ProgressStore:
+    """SQLite-backed progress tracking with one row per file"""
+    
+    def __init__(self, db_path: Path, shared: bool = False):
+        self.db_path = db_path
+        self.session_id = None
+        # Records buffered until commit(), so checkpoints cost O(batch)
+        self._pending = []
+        self._conn = connect_sqlite(db_path, shared)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime REAL, status TEXT NOT NULL,"
+            " processed_at TEXT, prepare_seconds REAL, inference_seconds REAL,"
+            " quality TEXT);"
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, started_at TEXT NOT NULL,"
+            " updated_at TEXT,"
+            " last_processed TEXT, stats TEXT);"
+        )
+        self._conn.commit()
+        
+    def start_session(self, started_at: datetime):
+        cursor = self._conn.execute(
+            "INSERT INTO sessions (started_at) VALUES (?)", (started_at.isoformat(),)
+        )
+        self._conn.commit()
+        self.session_id = cursor.lastrowid
+        
+    def is_empty(self) -> bool:
+        return self._conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+        
+    def lookup(self, path: str) -> Optional[Tuple[Optional[int], Optional[float], str]]:
+        """(size, mtime, status) recorded for path, if any"""
+        return self._conn.execute(
+            "SELECT size, mtime, status FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        
+    def needs_processing(self, path: str) -> bool:
+        """Whether path is new, changed since processed or rejected, or it failed"""
+        row = self.lookup(path)
+        if row is None:
+            return True
+        size, mtime, status = row
+        if status not in ("processed", "rejected"):
+            return True
+        if size is None:
+            # Imported from the JSON progress file without size/mtime
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return stat.st_size != size or stat.st_mtime != mtime
+        
+    def record(
+        self,
+        path: str,
+        status: str,
+        size: Optional[int] = None,
+        mtime: Optional[float] = None,
+        prepare_seconds: Optional[float] = None,
+        inference_seconds: Optional[float] = None,
+        quality_results: Optional[Dict] = None,
+    ):
+        """Buffer a file record until the next commit()"""
+        self._pending.append((
+            path, size, mtime, status, datetime.now().isoformat(),
+            prepare_seconds, inference_seconds,
+            json.dumps(quality_results) if quality_results is not None else None,
+        ))
+        
+    def commit(self, session_stats: Optional[Dict] = None) -> List[str]:
+        """Write buffered records and session stats at once; the paths written"""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime, status, processed_at,"
+                " prepare_seconds, inference_seconds, quality)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending,
+            )
+            last_processed = next(
+                (r[0] for r in reversed(self._pending) if r[3] == "processed"), None
+            )
+            if self.session_id is not None:
+                self._conn.execute(
+                    "UPDATE sessions SET updated_at = ?,"
+                    " last_processed = COALESCE(?, last_processed),"
+                    " stats = ? WHERE id = ?",
+                    (
+                        datetime.now().isoformat(),
+                        last_processed,
+                        json.dumps(session_stats or {}),
+                        self.session_id,
+                    ),
+                )
+        committed = [r[0] for r in self._pending]
+        self._pending = []
+        return committed
+        
+    def import_json(self, json_path: Path) -> int:
+        """Import processed_files from a v3.0 JSON progress file"""
+        try:
+            with open(json_path, 'r') as f:
+                processed_files = json.load(f).get("processed_files", [])
+        except (OSError, ValueError) as e:
+            logging.getLogger(__name__).warning(f"Could not import {json_path}: {e}")
+            return 0
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO files (path, status) VALUES (?, 'processed')",
+                ((path,) for path in processed_files),
+            )
+        return len(processed_files)
+        
+    def close(self):
+        self._conn.close()
+
+class ClusterError(RuntimeError):
+    """The shared work queue cannot be joined"""
+
+class WorkQueue:
+    """Shared SQLite work queue that lets several nodes tag one library"""
+    
+    def __init__(self, db_path: Path, node: str, lease_seconds: float = 300):
+        self.db_path = db_path
+        self.node = node
+        # Heartbeats renew leases, so a dead node's chunks are leasable once they expire
+        self.lease_seconds = lease_seconds
+        self.leased = 0
+        self.reclaimed = 0
+        self.completed = 0
+        # chunk id -> paths whose progress is not committed yet; done only once empty
+        self._expected = {}
+        self._chunk_of = {}
+        self._stop = threading.Event()
+        self._heartbeat_thread = None
+        self._conn = connect_sqlite(db_path, shared=True, isolation_level=None)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, node TEXT, lease_expires REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, done INTEGER NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS chunks_open ON chunks (done, lease_expires);"
+            "CREATE TABLE IF NOT EXISTS items ("
+            " path TEXT PRIMARY KEY, chunk INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS items_by_chunk ON items (chunk);"
+            "CREATE TABLE IF NOT EXISTS seeding ("
+            " id INTEGER PRIMARY KEY CHECK (id = 1), node TEXT, lease_expires REAL,"
+            " complete INTEGER NOT NULL DEFAULT 0);"
+            "INSERT OR IGNORE INTO seeding (id) VALUES (1);"
+            "CREATE TABLE IF NOT EXISTS nodes ("
+            " node TEXT PRIMARY KEY, host TEXT, pid INTEGER, started_at TEXT,"
+            " heartbeat REAL, stats TEXT);"
+        )
+        
+    def _transaction(self, conn: sqlite3.Connection, work):
+        """Run work(conn) under a write lock taken first: read-then-update is atomic"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+        
+    def join(self):
+        """Register this node, starting a pass if needed; ClusterError if taken"""
+        def work(conn):
+            now = time.time()
+            row = conn.execute(
+                "SELECT host, pid, heartbeat FROM nodes WHERE node = ?", (self.node,)
+            ).fetchone()
+            if (
+                row
+                and (row[0], row[1]) != (platform.node(), os.getpid())
+                and row[2]
+                and now - row[2] < self.lease_seconds
+            ):
+                raise ClusterError(
+                    f"Node name {self.node} is already in use by {row[0]} "
+                    f"(pid {row[1]}, heartbeat {now - row[2]:.0f}s ago) "
+                    "- pass a distinct --node-id"
+                )
+            conn.execute(
+                "INSERT OR REPLACE INTO nodes (node, host, pid, started_at, heartbeat,"
+                " stats) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self.node,
+                    platform.node(),
+                    os.getpid(),
+                    datetime.now().isoformat(),
+                    now,
+                    json.dumps({}),
+                ),
+            )
+            # Leases left behind by an earlier run under this name
+            conn.execute(
+                "UPDATE chunks SET node = NULL WHERE node = ? AND done = 0",
+                (self.node,),
+            )
+            complete = conn.execute("SELECT complete FROM seeding").fetchone()[0]
+            if (
+                complete
+                and conn.execute(
+                    "SELECT 1 FROM chunks WHERE done = 0 LIMIT 1"
+                ).fetchone()
+                is None
+            ):
+                conn.execute("DELETE FROM items")
+                conn.execute("DELETE FROM chunks")
+                conn.execute(
+                    "UPDATE seeding SET node = NULL, lease_expires = NULL, complete = 0"
+                )
+        self._transaction(self._conn, work)
+        
+    def claim_seeding(self) -> bool:
+        """Become the seeder unless seeding is done or another live node is seeding"""
+        def work(conn):
+            node, lease_expires, complete = conn.execute(
+                "SELECT node, lease_expires, complete FROM seeding"
+            ).fetchone()
+            if complete or (
+                node not in (None, self.node) and lease_expires > time.time()
+            ):
+                return False
+            conn.execute(
+                "UPDATE seeding SET node = ?, lease_expires = ?",
+                (self.node, time.time() + self.lease_seconds),
+            )
+            return True
+        return self._transaction(self._conn, work)
+        
+    def add_chunk(self, paths: List[str]) -> int:
+        """Enqueue paths not yet queued in this pass as one chunk; how many were new"""
+        def work(conn):
+            chunk_id = conn.execute("INSERT INTO chunks DEFAULT VALUES").lastrowid
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO items (path, chunk) VALUES (?, ?)",
+                ((path, chunk_id) for path in paths),
+            )
+            added = conn.total_changes - before
+            if not added:
+                conn.execute("DELETE FROM chunks WHERE id = ?", (chunk_id,))
+            return added
+        return self._transaction(self._conn, work)
+        
+    def finish_seeding(self):
+        self._conn.execute(
+            "UPDATE seeding SET node = NULL, lease_expires = NULL, complete = 1"
+        )
+        
+    def lease(self) -> Optional[Tuple[int, List[str]]]:
+        """Lease the oldest open chunk, reclaiming expired leases; None if none is"""
+        def work(conn):
+            now = time.time()
+            row = conn.execute(
+                "SELECT id, node FROM chunks WHERE done = 0 AND (node IS NULL"
+                " OR lease_expires < ?)"
+                " ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            chunk_id, previous = row
+            conn.execute(
+                "UPDATE chunks SET node = ?, lease_expires = ?, attempts = attempts + 1"
+                " WHERE id = ?",
+                (self.node, now + self.lease_seconds, chunk_id),
+            )
+            paths = [
+                path
+                for path, in conn.execute(
+                    "SELECT path FROM items WHERE chunk = ?", (chunk_id,)
+                )
+            ]
+            return chunk_id, previous, paths
+        leased = self._transaction(self._conn, work)
+        if leased is None:
+            return None
+        chunk_id, previous, paths = leased
+        self.leased += 1
+        if previous is not None and previous != self.node:
+            self.reclaimed += 1
+            logging.getLogger(__name__).warning(
+                f"Reclaimed chunk {chunk_id} from expired lease of {previous}"
+            )
+        return chunk_id, paths
+        
+    def expect(self, chunk_id: int, paths: List[str]):
+        """Paths of a leased chunk to process; the chunk is done once all are settled"""
+        if not paths:
+            self.complete([chunk_id])
+            return
+        self._expected[chunk_id] = set(paths)
+        for path in paths:
+            self._chunk_of[path] = chunk_id
+            
+    def holding(self) -> bool:
+        """Whether leased chunks still have photos without committed progress"""
+        return bool(self._expected)
+        
+    def settle(self, paths: List[str]):
+        """Mark chunks done whose photos all have committed progress"""
+        finished = []
+        for path in paths:
+            chunk_id = self._chunk_of.pop(path, None)
+            if chunk_id is None:
+                continue
+            expected = self._expected[chunk_id]
+            expected.discard(path)
+            if not expected:
+                del self._expected[chunk_id]
+                finished.append(chunk_id)
+        if finished:
+            self.complete(finished)
+            
+    def complete(self, chunk_ids: List[int]):
+        self._transaction(self._conn, lambda conn: conn.executemany(
+            "UPDATE chunks SET done = 1, node = ?, lease_expires = NULL WHERE id = ?",
+            ((self.node, chunk_id) for chunk_id in chunk_ids),
+        ))
+        self.completed += len(chunk_ids)
+        
+    def unleased(self) -> int:
+        """Open chunks nobody holds a lease on"""
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM chunks WHERE done = 0 AND (node IS NULL"
+            " OR lease_expires < ?)",
+            (time.time(),),
+        ).fetchone()[0]
+        
+    def live_nodes(self) -> int:
+        """Nodes that joined or heartbeated within the lease time"""
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM nodes WHERE heartbeat >= ?",
+            (time.time() - self.lease_seconds,),
+        ).fetchone()[0]
+        
+    def waiting_on_others(self) -> bool:
+        """Whether another live node may still enqueue chunks or hand leases back"""
+        now = time.time()
+        node, lease_expires, complete = self._conn.execute(
+            "SELECT node, lease_expires, complete FROM seeding"
+        ).fetchone()
+        if not complete:
+            return True
+        return (
+            self._conn.execute(
+                "SELECT 1 FROM chunks WHERE done = 0 AND node IS NOT NULL AND node != ?"
+                " AND lease_expires >= ? LIMIT 1",
+                (self.node, now),
+            ).fetchone()
+            is not None
+        )
+        
+    def heartbeat(self, stats: Dict, conn: Optional[sqlite3.Connection] = None):
+        """Renew this node's chunk and seeding leases and publish its stats"""
+        conn = conn or self._conn
+        now = time.time()
+        stats = dict(
+            stats,
+            chunks_leased=self.leased,
+            chunks_done=self.completed,
+            chunks_reclaimed=self.reclaimed,
+        )
+
+        def work(conn):
+            conn.execute(
+                "UPDATE chunks SET lease_expires = ? WHERE node = ? AND done = 0",
+                (now + self.lease_seconds, self.node),
+            )
+            conn.execute(
+                "UPDATE seeding SET lease_expires = ? WHERE node = ? AND complete = 0",
+                (now + self.lease_seconds, self.node),
+            )
+            conn.execute(
+                "UPDATE nodes SET heartbeat = ?, stats = ? WHERE node = ?",
+                (now, json.dumps(stats), self.node),
+            )
+        self._transaction(conn, work)
+        
+    def start_heartbeat(self, stats_fn):
+        """Renew leases from a background thread every third of the lease time"""
+        def loop():
+            conn = connect_sqlite(self.db_path, shared=True, isolation_level=None)
+            try:
+                while not self._stop.wait(self.lease_seconds / 3):
+                    try:
+                        self.heartbeat(stats_fn(), conn)
+                    except sqlite3.Error as e:
+                        logging.getLogger(__name__).warning(
+                            f"Work queue heartbeat failed: {e}"
+                        )
+            finally:
+                conn.close()
+                
+        self._heartbeat_thread = threading.Thread(
+            target=loop, name="queue-heartbeat", daemon=True
+        )
+        self._heartbeat_thread.start()
+        
+    def close(self, stats: Optional[Dict] = None):
+        """Stop the heartbeat and hand unfinished chunks back to the other nodes"""
+        self._stop.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join(timeout=5)
+        if stats is not None:
+            self.heartbeat(stats)
+
+        def work(conn):
+            conn.execute(
+                "UPDATE chunks SET node = NULL, lease_expires = NULL WHERE node = ?"
+                " AND done = 0",
+                (self.node,),
+            )
+            conn.execute(
+                "UPDATE seeding SET node = NULL, lease_expires = NULL WHERE node = ?"
+                " AND complete = 0",
+                (self.node,),
+            )
+        self._transaction(self._conn, work)
+        self._conn.close()
+        
+    @staticmethod
+    def stats(db_path: Path) -> Dict:
+        """Queue totals and the latest stats each node published"""
+        conn = connect_sqlite(db_path, shared=True)
+        try:
+            total, done = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(done), 0) FROM chunks"
+            ).fetchone()
+            seeded = bool(conn.execute("SELECT complete FROM seeding").fetchone()[0])
+            items = conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+            nodes = [
+                {
+                    "node": node,
+                    "host": host,
+                    "pid": pid,
+                    "started_at": started_at,
+                    "heartbeat": heartbeat,
+                    **json.loads(stats or "{}"),
+                }
+                for node, host, pid, started_at, heartbeat, stats in conn.execute(
+                    "SELECT node, host, pid, started_at, heartbeat, stats FROM nodes"
+                    " ORDER BY node"
+                )
+            ]
+        finally:
+            conn.close()
+        return {
+            "chunks": total,
+            "chunks_done": done,
+            "photos": items,
+            "seeded": seeded,
+            "nodes": nodes,
+        }
+
+def read_sidecar(xmp_path: Path) -> Tuple[List[str], Dict]:
+    """Keywords and quality data stored in one of our .xmp sidecars"""
+    import xml.etree.ElementTree as ET
+    rdf = XMP_NAMESPACES["rdf"]
+    instructions_tag = f'{{{XMP_NAMESPACES["photoshop"]}}}Instructions'
+    root = ET.parse(str(xmp_path)).getroot()
+    keywords = []
+    subject = root.find(f'.//{{{XMP_NAMESPACES["dc"]}}}subject')
+    if subject is not None:
+        keywords = [li.text for li in subject.iter(f'{{{rdf}}}li') if li.text]
+    quality_data = {}
+    for description in root.iter(f'{{{rdf}}}Description'):
+        element = description.find(instructions_tag)
+        text = description.get(instructions_tag) or (
+            element.text if element is not None else None
+        )
+        if text and text.startswith("Quality Analysis: "):
+            try:
+                quality_data = json.loads(text[len("Quality Analysis: "):])
+            except ValueError:
+                pass
+            break
+    return keywords, quality_data
+
+def _read_sidecar_for_index(
+    job: Tuple[Path, Path],
+) -> Optional[Tuple[str, List[str], Dict]]:
+    xmp_path, photo_path = job
+    try:
+        keywords, quality_data = read_sidecar(xmp_path)
+    except Exception:
+        return None
+    return str(photo_path), keywords, quality_data
+
+def keyword_index_path(config: Dict) -> Path:
+    return Path(
+        config.get("index", {}).get("path")
+        or config["pictures_folder"] / "ai_photo_tagger_v3_index.sqlite"
+    )
+
+def analysis_store_path(config: Dict) -> Path:
+    return Path(
+        config.get("analysis_store", {}).get("path")
+        or config["pictures_folder"] / "ai_photo_tagger_v3_analysis"
+    )
+
+def is_cluster(config: Dict) -> bool:
+    """Whether this process is one of several nodes sharing pictures_folder"""
+    return config.get("cluster", {}).get("enabled", False)
+
+def cluster_node_id(config: Dict) -> str:
+    return config.get("cluster", {}).get("node_id") or platform.node()
+
+def queue_path(config: Dict) -> Path:
+    return Path(
+        config.get("cluster", {}).get("queue_path")
+        or config["pictures_folder"] / "ai_photo_tagger_v3_queue.sqlite"
+    )
+
+class IndexQueryError(ValueError):
+    """Malformed search query"""
+
+class KeywordIndex:
+    """Inverted index of keywords, quality tags and metrics per photo"""
+    
+    def __init__(self, db_path: Path, shared: bool = False):
+        self.db_path = db_path
+        self._term_ids = {}
+        self._field_ids = {}
+        self._conn = connect_sqlite(db_path, shared)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Keywords and string fields (as field=value) are terms; numeric fields go
+        # to metrics under dotted names like blur.score. WITHOUT ROWID postings let
+        # a lookup touch only matching rows.
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS photos ("
+            " id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, indexed_at TEXT);"
+            "CREATE TABLE IF NOT EXISTS terms ("
+            " id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);"
+            "CREATE TABLE IF NOT EXISTS fields ("
+            " id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);"
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " term_id INTEGER NOT NULL, photo_id INTEGER NOT NULL,"
+            " PRIMARY KEY (term_id, photo_id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS postings_by_photo ON postings (photo_id);"
+            "CREATE TABLE IF NOT EXISTS metrics ("
+            " field_id INTEGER NOT NULL, photo_id INTEGER NOT NULL,"
+            " value REAL NOT NULL,"
+            " PRIMARY KEY (photo_id, field_id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS metrics_by_value ON metrics (field_id, value);"
+        )
+        self._conn.commit()
+        
+    def _intern(self, table: str, cache: Dict[str, int], name: str) -> int:
+        interned = cache.get(name)
+        if interned is None:
+            self._conn.execute(
+                f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,)
+            )
+            interned = self._conn.execute(
+                f"SELECT id FROM {table} WHERE name = ?", (name,)
+            ).fetchone()[0]
+            cache[name] = interned
+        return interned
+        
+    @staticmethod
+    def flatten(
+        quality_results: Dict, prefix: str = ""
+    ) -> Iterator[Tuple[str, object]]:
+        """(dotted field name, value) for every leaf of the quality results"""
+        for key, value in quality_results.items():
+            name = f"{prefix}{key}"
+            if isinstance(value, dict):
+                yield from KeywordIndex.flatten(value, name + ".")
+            elif isinstance(value, (bool, int, float, str)):
+                yield name, value
+                
+    def add(self, path: str, keywords: List[str], quality_results: Optional[Dict]):
+        """Replace the index entry for path; call commit() to make it durable"""
+        self._conn.execute(
+            "INSERT INTO photos (path, indexed_at) VALUES (?, ?)"
+            " ON CONFLICT(path) DO UPDATE SET indexed_at = excluded.indexed_at",
+            (path, datetime.now().isoformat()),
+        )
+        photo_id = self._conn.execute(
+            "SELECT id FROM photos WHERE path = ?", (path,)
+        ).fetchone()[0]
+        self._conn.execute("DELETE FROM postings WHERE photo_id = ?", (photo_id,))
+        self._conn.execute("DELETE FROM metrics WHERE photo_id = ?", (photo_id,))
+        
+        terms = {keyword.strip().lower() for keyword in keywords if keyword.strip()}
+        metrics = []
+        for name, value in self.flatten(quality_results or {}):
+            if isinstance(value, str):
+                terms.add(f"{name}={value.lower()}")
+            else:
+                metrics.append(
+                    (
+                        self._intern("fields", self._field_ids, name),
+                        photo_id,
+                        float(value),
+                    )
+                )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO postings (term_id, photo_id) VALUES (?, ?)",
+            [(self._intern("terms", self._term_ids, term), photo_id) for term in terms],
+        )
+        self._conn.executemany(
+            "INSERT INTO metrics (field_id, photo_id, value) VALUES (?, ?, ?)", metrics
+        )
+        
+    def commit(self):
+        self._conn.commit()
+        
+    def rebuild(self, folder: Path, workers: int = 0) -> int:
+        """Replace the index with every sidecar under folder; returns how many"""
+        def iter_sidecars() -> Iterator[Tuple[Path, Path]]:
+            # (sidecar, photo): ours are <photo>.<ext>.xmp, Lightroom-style <stem>.xmp
+            for dirpath, dirnames, filenames in os.walk(folder):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                names = set(filenames)
+                by_stem = {}
+                for filename in sorted(filenames):
+                    stem, extension = os.path.splitext(filename)
+                    if extension.lower() != '.xmp':
+                        by_stem.setdefault(stem, filename)
+                for filename in filenames:
+                    if not filename.lower().endswith('.xmp') or filename.startswith(
+                        '.'
+                    ):
+                        continue
+                    photo = filename[:-len('.xmp')]
+                    if photo not in names:
+                        photo = by_stem.get(photo)
+                        # Skip sidecars without a photo or superseded by ours
+                        if photo is None or photo + '.xmp' in names:
+                            continue
+                    yield Path(dirpath) / filename, Path(dirpath) / photo
+                        
+        self._conn.executescript(
+            "DELETE FROM postings; DELETE FROM metrics; DELETE FROM photos;"
+        )
+        indexed = 0
+        workers = workers or os.cpu_count() or 1
+        # Parsed on a process pool, inserted here in one transaction
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for entry in executor.map(
+                _read_sidecar_for_index, iter_sidecars(), chunksize=64
+            ):
+                if entry is not None:
+                    self.add(*entry)
+                    indexed += 1
+        self.commit()
+        return indexed
+        
+    _TOKEN_PATTERN = re.compile(
+        r'\s*(?:(\(|\)|<=|>=|!=|=|<|>)|"([^"]*)"|([^\s()<>=!"]+))'
+    )
+    _OPERATORS = ("<", "<=", ">", ">=", "=", "!=")
+    
+    @classmethod
+    def tokenize(cls, query: str) -> List[str]:
+        """Split a query into operators, words and phrases (with a leading quote)"""
+        tokens = []
+        position = 0
+        query = query.strip()
+        while position < len(query):
+            match = cls._TOKEN_PATTERN.match(query, position)
+            if not match or match.end() == position:
+                raise IndexQueryError(
+                    f"Unexpected character at {position}: {query[position:]!r}"
+                )
+            operator, quoted, word = match.groups()
+            tokens.append(operator or ('"' + quoted if quoted is not None else word))
+            position = match.end()
+        return tokens
+        
+    def parse(self, query: str) -> Tuple:
+        """Parse a query into ("term" | "metric" | "not" | "and" | "or", ...) tuples"""
+        # Terms are keywords (quote multi-word ones), field=value for string
+        # quality fields or field <op> number for metrics, combined with AND (or
+        # juxtaposition), OR, NOT and parentheses
+        tokens = self.tokenize(query)
+        position = 0
+        
+        def peek() -> Optional[str]:
+            return tokens[position] if position < len(tokens) else None
+            
+        def take() -> str:
+            nonlocal position
+            if position >= len(tokens):
+                raise IndexQueryError("Unexpected end of query")
+            position += 1
+            return tokens[position - 1]
+            
+        def is_keyword(token: Optional[str], keyword: str) -> bool:
+            return token is not None and token.upper() == keyword
+            
+        def parse_or() -> Tuple:
+            children = [parse_and()]
+            while is_keyword(peek(), "OR"):
+                take()
+                children.append(parse_and())
+            return children[0] if len(children) == 1 else ("or", children)
+            
+        def parse_and() -> Tuple:
+            children = [parse_not()]
+            while peek() is not None and peek() != ")" and not is_keyword(peek(), "OR"):
+                if is_keyword(peek(), "AND"):
+                    take()
+                children.append(parse_not())
+            return children[0] if len(children) == 1 else ("and", children)
+            
+        def parse_not() -> Tuple:
+            if is_keyword(peek(), "NOT"):
+                take()
+                return ("not", parse_not())
+            return parse_atom()
+            
+        def parse_atom() -> Tuple:
+            token = take()
+            if token == "(":
+                node = parse_or()
+                if peek() != ")":
+                    raise IndexQueryError("Expected ')'")
+                take()
+                return node
+            if token == ")" or token in self._OPERATORS:
+                raise IndexQueryError(f"Unexpected {token!r}")
+            if token.startswith('"'):
+                return ("term", token[1:].lower())
+            if peek() not in self._OPERATORS:
+                return ("term", token.lower())
+            operator = take()
+            value = take().lstrip('"')
+            try:
+                number = float(value)
+            except ValueError:
+                if operator not in ("=", "!="):
+                    raise IndexQueryError(
+                        f"{token} {operator} needs a number, got {value!r}"
+                    )
+                node = ("term", f"{token}={value}".lower())
+                return node if operator == "=" else ("not", node)
+            return ("metric", token, operator, number)
+            
+        if not tokens:
+            raise IndexQueryError("Empty query")
+        tree = parse_or()
+        if position != len(tokens):
+            raise IndexQueryError(f"Unexpected {tokens[position]!r}")
+        return tree
+        
+    def _select(self, node: Tuple) -> Tuple[str, List]:
+        """SQL selecting the photo_id of every photo matching node"""
+        kind = node[0]
+        if kind == "term":
+            return (
+                "SELECT photo_id FROM postings WHERE term_id = (SELECT id FROM terms"
+                " WHERE name = ?)",
+                [node[1]],
+            )
+        if kind == "metric":
+            return (
+                "SELECT photo_id FROM metrics WHERE field_id = (SELECT id FROM fields"
+                " WHERE name = ?)"
+                f" AND value {node[2]} ?",
+                [node[1], node[3]],
+            )
+        if kind == "not":
+            predicate, params = self._predicate(node[1], "id")
+            return f"SELECT id AS photo_id FROM photos WHERE NOT {predicate}", params
+        if kind == "or":
+            parts = [self._select(child) for child in node[1]]
+            return (" UNION ".join(f"SELECT photo_id FROM ({sql})" for sql, _ in parts),
+                    [param for _, params in parts for param in params])
+        # AND: scan the most selective child and probe the rest per photo
+        children = node[1]
+        driver = next((c for c in children if c[0] == "term"), None) \
+            or next((c for c in children if c[0] != "not"), None)
+        if driver is None:
+            sql, params = "SELECT id AS photo_id FROM photos", []
+        else:
+            sql, params = self._select(driver)
+        predicates = [
+            self._predicate(child, "hits.photo_id")
+            for child in children
+            if child is not driver
+        ]
+        where = " AND ".join(predicate for predicate, _ in predicates)
+        return (
+            f"SELECT hits.photo_id AS photo_id FROM ({sql}) AS hits WHERE {where}",
+            params
+            + [param for _, child_params in predicates for param in child_params],
+        )
+        
+    def _predicate(self, node: Tuple, column: str) -> Tuple[str, List]:
+        """SQL condition that photo ``column`` matches node, by primary-key probes"""
+        kind = node[0]
+        if kind == "term":
+            return (
+                "EXISTS (SELECT 1 FROM postings WHERE term_id = (SELECT id FROM terms"
+                " WHERE name = ?)"
+                f" AND photo_id = {column})",
+                [node[1]],
+            )
+        if kind == "metric":
+            return (
+                f"EXISTS (SELECT 1 FROM metrics WHERE photo_id = {column}"
+                " AND field_id = (SELECT id FROM fields WHERE name = ?)"
+                f" AND value {node[2]} ?)",
+                [node[1], node[3]],
+            )
+        if kind == "not":
+            predicate, params = self._predicate(node[1], column)
+            return f"NOT {predicate}", params
+        parts = [self._predicate(child, column) for child in node[1]]
+        joiner = " AND " if kind == "and" else " OR "
+        return (f"({joiner.join(sql for sql, _ in parts)})",
+                [param for _, params in parts for param in params])
+        
+    def compile(self, query: str) -> Tuple[str, List]:
+        """Translate a query into SQL selecting matching photo ids"""
+        return self._select(self.parse(query))
+        
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """Paths of photos matching query, sorted"""
+        select, params = self.compile(query)
+        sql = f"SELECT path FROM photos WHERE id IN ({select}) ORDER BY path"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [row[0] for row in self._conn.execute(sql, params)]
+        
+    def count(self, query: str) -> int:
+        select, params = self.compile(query)
+        return self._conn.execute(
+            f"SELECT COUNT(*) FROM ({select})", params
+        ).fetchone()[0]
+        
+    def close(self):
+        self._conn.close()
+
+class AnalysisStore:
+    """Columnar store of the raw quality metrics behind each photo's classes"""
+    
+    METRICS = (
+        "blur_score",
+        "underexposed",
+        "overexposed",
+        "spread",
+        "brightness",
+        "contrast",
+        "x_var",
+        "y_var",
+        "texture",
+    )
+    # Long edge of the level each metric group was decided on, and of the analysis level
+    LEVELS = ("blur_px", "histogram_px", "concert_px", "analysis_px")
+    CLASSES = ("blur_class", "exposure_class", "motion_class", "flags")
+    NO_CLASS = 255
+    # Bits of the flags column
+    STAGE_LIGHTING = 1
+    CROWD = 2
+    LOW_LIGHT = 4
+    
+    def __init__(
+        self,
+        folder: Path,
+        writer: str,
+        segment_rows: int = 1000,
+        compact_segments: int = 32,
+    ):
+        self.folder = folder
+        # Each writer (cluster nodes included) adds its own segments; none share a file
+        self.writer = re.sub(r"[^A-Za-z0-9_.-]", "_", writer)
+        self.segment_rows = max(1, segment_rows)
+        self.compact_segments = compact_segments
+        self._rows = []
+        
+    @classmethod
+    def class_index(cls, classes: Tuple[str, ...], name: Optional[str]) -> int:
+        return classes.index(name) if name in classes else cls.NO_CLASS
+        
+    def add(self, path: str, raw: Dict, quality_results: Dict):
+        """Buffer one photo's raw metrics and the classes it was given"""
+        concert = quality_results.get("concert", {})
+        flags = (
+            (self.STAGE_LIGHTING if concert.get("stage_lighting") else 0)
+            | (self.CROWD if concert.get("crowd_detected") else 0)
+            | (self.LOW_LIGHT if concert.get("low_light") else 0)
+        )
+        classes = (
+            self.class_index(
+                QualityAnalyzer.BLUR_LEVELS,
+                quality_results.get("blur", {}).get("level"),
+            ),
+            self.class_index(
+                QualityAnalyzer.EXPOSURE_CLASSES,
+                quality_results.get("histogram", {}).get("quality"),
+            ),
+            self.class_index(
+                QualityAnalyzer.MOTION_CLASSES, concert.get("motion_blur")
+            ),
+            flags,
+        )
+        self._rows.append((path, time.time(), raw, classes))
+        
+    def flush(self, force: bool = False):
+        """Write buffered rows as a segment once there are segment_rows (or force)"""
+        if not self._rows or (len(self._rows) < self.segment_rows and not force):
+            return
+        rows, self._rows = self._rows, []
+        # One uncompressed .npz per segment: an array per column, paths as one UTF-8
+        # blob plus end offsets, missing metrics NaN and missing classes NO_CLASS
+        paths = [path.encode("utf-8") for path, _, _, _ in rows]
+        columns = {
+            "path_blob": np.frombuffer(b"".join(paths), dtype=np.uint8),
+            "path_ends": np.cumsum([len(path) for path in paths], dtype=np.int64),
+            "path_hash": np.array(
+                [
+                    int.from_bytes(
+                        hashlib.blake2b(path, digest_size=8).digest(), "little"
+                    )
+                    for path in paths
+                ],
+                dtype=np.uint64,
+            ),
+            "analyzed": np.array(
+                [analyzed for _, analyzed, _, _ in rows], dtype=np.float64
+            ),
+        }
+        for name in self.METRICS:
+            columns[name] = np.array(
+                [raw.get(name, np.nan) for _, _, raw, _ in rows], dtype=np.float64
+            )
+        for name in self.LEVELS:
+            columns[name] = np.array(
+                [raw.get(name, 0) for _, _, raw, _ in rows], dtype=np.int32
+            )
+        for i, name in enumerate(self.CLASSES):
+            columns[name] = np.array(
+                [classes[i] for _, _, _, classes in rows], dtype=np.uint8
+            )
+        self.write_segment(columns)
+        segments = self.segments(self.folder)
+        if len(segments) > self.compact_segments:
+            self.compact(segments)
+            
+    def close(self):
+        self.flush(force=True)
+        
+    def write_segment(self, columns: Dict[str, np.ndarray]):
+        # Readers only see .npz files, so the rename publishes the segment atomically
+        self.folder.mkdir(parents=True, exist_ok=True)
+        name = f"{time.time_ns()}-{self.writer}-{os.getpid()}"
+        tmp_path = self.folder / f".{name}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **columns)
+        os.replace(tmp_path, self.folder / f"{name}.npz")
+        
+    def compact(self, segments: List[Path]):
+        """Merge segments into one, dropping superseded rows"""
+        columns, merged = self.read(segments)
+        if len(merged) < 2:
+            return
+        self.write_segment(columns)
+        for segment in merged:
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass  # Another writer compacted it at the same time
+                
+    @staticmethod
+    def segments(folder: Path) -> List[Path]:
+        return sorted(folder.glob("*.npz"))
+        
+    @classmethod
+    def load(cls, folder: Path) -> Dict[str, np.ndarray]:
+        """Every segment under folder merged into columns, latest row per photo"""
+        return cls.read(cls.segments(folder))[0]
+        
+    @classmethod
+    def read(cls, segments: List[Path]) -> Tuple[Dict[str, np.ndarray], List[Path]]:
+        """Merged columns of segments and the segments actually read"""
+        parts = []
+        read = []
+        for segment in segments:
+            try:
+                with np.load(segment) as data:
+                    parts.append({name: data[name] for name in data.files})
+                read.append(segment)
+            except OSError:
+                # Removed by a concurrent compaction, whose output is read instead
+                continue
+        if not parts:
+            return cls.empty(), read
+            
+        offsets = np.cumsum([0] + [len(part["path_blob"]) for part in parts[:-1]])
+        columns = {
+            "path_blob": np.concatenate([part["path_blob"] for part in parts]),
+            "path_ends": np.concatenate(
+                [part["path_ends"] + offset for part, offset in zip(parts, offsets)]
+            ),
+        }
+        for name in parts[0]:
+            if name not in columns:
+                columns[name] = np.concatenate([part[name] for part in parts])
+        return cls.latest(columns), read
+        
+    @classmethod
+    def empty(cls) -> Dict[str, np.ndarray]:
+        columns = {
+            "path_blob": np.empty(0, np.uint8),
+            "path_ends": np.empty(0, np.int64),
+            "path_hash": np.empty(0, np.uint64),
+            "analyzed": np.empty(0, np.float64),
+        }
+        columns.update({name: np.empty(0, np.float64) for name in cls.METRICS})
+        columns.update({name: np.empty(0, np.int32) for name in cls.LEVELS})
+        columns.update({name: np.empty(0, np.uint8) for name in cls.CLASSES})
+        return columns
+        
+    @classmethod
+    def latest(cls, columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """Keep the most recently analyzed row of each path, in stored order"""
+        order = np.lexsort((columns["analyzed"], columns["path_hash"]))
+        hashes = columns["path_hash"][order]
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = hashes[:-1] != hashes[1:]
+        keep = np.sort(order[last])
+        if len(keep) == len(order):
+            return columns
+        ends = columns["path_ends"]
+        starts = np.concatenate(([0], ends[:-1]))
+        lengths = ends[keep] - starts[keep]
+        new_ends = np.cumsum(lengths)
+        # Gather the kept paths' bytes into a new contiguous blob
+        gather = np.arange(new_ends[-1]) + np.repeat(
+            starts[keep] - (new_ends - lengths), lengths
+        )
+        result = {"path_blob": columns["path_blob"][gather], "path_ends": new_ends}
+        for name, column in columns.items():
+            if name not in result:
+                result[name] = column[keep]
+        return result
+        
+    @staticmethod
+    def paths(columns: Dict[str, np.ndarray], rows: np.ndarray) -> Iterator[str]:
+        """Paths of the given row indices"""
+        blob = columns["path_blob"].tobytes()
+        ends = columns["path_ends"]
+        for start, end in zip(
+            np.where(rows > 0, ends[rows - 1], 0).tolist(), ends[rows].tolist()
+        ):
+            yield blob[start:end].decode("utf-8")
+            
+    @staticmethod
+    def on_preview(columns: Dict[str, np.ndarray], level: str) -> np.ndarray:
+        """Rows whose metric group was decided on a preview below the analysis level"""
+        return (columns[level] > 0) & (columns[level] < columns["analysis_px"])
+        
+    @classmethod
+    def classify(
+        cls, columns: Dict[str, np.ndarray], analyzer: QualityAnalyzer
+    ) -> Dict[str, np.ndarray]:
+        """Class columns for the stored metrics under analyzer's thresholds"""
+        no_class = np.uint8(cls.NO_CLASS)
+        blur = np.where(np.isnan(columns["blur_score"]), no_class,
+                        analyzer.classify_blur(columns["blur_score"])).astype(np.uint8)
+        exposure = np.where(
+            np.isnan(columns["underexposed"]),
+            no_class,
+            analyzer.classify_exposure(
+                columns["underexposed"], columns["overexposed"], columns["spread"]
+            ),
+        ).astype(np.uint8)
+        motion = np.where(
+            np.isnan(columns["x_var"]),
+            no_class,
+            analyzer.motion_blur_index(columns["x_var"], columns["y_var"]),
+        ).astype(np.uint8)
+        stage_lighting, crowd, low_light = analyzer.classify_concert(
+            columns["brightness"], columns["contrast"], columns["texture"],
+        )
+        flags = (
+            stage_lighting * cls.STAGE_LIGHTING
+            | crowd * cls.CROWD
+            | low_light * cls.LOW_LIGHT
+        ).astype(np.uint8)
+        classes = {
+            "blur_class": blur,
+            "exposure_class": exposure,
+            "motion_class": motion,
+            "flags": flags,
+        }
+        # Metrics decided on a cascade preview are on that preview's scale, so
+        # those rows keep their classes
+        for level, names in (
+            ("blur_px", ("blur_class",)),
+            ("histogram_px", ("exposure_class",)),
+            ("concert_px", ("motion_class", "flags")),
+        ):
+            preview = cls.on_preview(columns, level)
+            for name in names:
+                classes[name] = np.where(preview, columns[name], classes[name])
+        return classes
+        
+    @classmethod
+    def tag_changes(
+        cls, old: Dict[str, np.ndarray], new: Dict[str, np.ndarray]
+    ) -> np.ndarray:
+        """Rows whose quality tags differ between two sets of class columns"""
+        def tagged(classes):
+            # Only these classes become tags, see generate_quality_tags
+            blur = np.where(
+                classes["blur_class"] <= 1, classes["blur_class"], cls.NO_CLASS
+            )
+            exposure = np.where(
+                classes["exposure_class"] == 0, cls.NO_CLASS, classes["exposure_class"]
+            )
+            return blur, exposure, classes["motion_class"] == 1, classes["flags"]
+            
+        return np.logical_or.reduce([a != b for a, b in zip(tagged(old), tagged(new))])
+        
+    @classmethod
+    def quality_tags(
+        cls, blur: int, exposure: int, motion: int, flags: int
+    ) -> List[str]:
+        """Quality tags for one row's classes, as generate_quality_tags makes them"""
+        tags = []
+        if blur <= 1:
+            tags.append(f"quality:{QualityAnalyzer.BLUR_LEVELS[blur]}")
+        if exposure not in (0, cls.NO_CLASS):
+            tags.append(f"exposure:{QualityAnalyzer.EXPOSURE_CLASSES[exposure]}")
+        if flags & cls.STAGE_LIGHTING:
+            tags.append("stage_lighting")
+        if motion == 1:
+            tags.append("motion_blur")
+        if flags & cls.CROWD:
+            tags.append("crowd")
+        if flags & cls.LOW_LIGHT:
+            tags.append("low_light")
+        return tags
+
+def dhash(gray: np.ndarray, hash_size: int = 8) -> int:
+    """64-bit difference hash of a grayscale image"""
+    if cv2:
+        small = cv2.resize(
+            gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA
+        )
+    else:
+        small = np.asarray(
+            Image.fromarray(gray).resize((hash_size + 1, hash_size), Image.BOX)
+        )
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+class BurstGroup:
+    """A tagged (or in-flight) frame whose AI keywords near-duplicates reuse"""
+    
+    def __init__(self):
+        self.keywords = None  # Set once the leader's inference finishes
+        self.followers = []  # Near-duplicates waiting for the leader
+        # The leader's inference failed for good; nothing left to reuse
+        self.failed = False
+        
+    def resolve(self, keywords: Optional[List[str]]) -> List["PreparedPhoto"]:
+        """Record the leader's keywords (None if it failed); returns its followers"""
+        self.keywords = keywords
+        self.failed = keywords is None
+        followers, self.followers = self.followers, []
+        return followers
+
+class BurstIndex:
+    """BK-tree of perceptual hashes for near-duplicate lookups"""
+    
+    def __init__(self, max_distance: int, window: int = 512):
+        self.max_distance = max_distance
+        self.window = max(1, window)
+        self._recent = deque()
+        self._root = None
+        
+    def add(self, phash: int, group: BurstGroup):
+        self._recent.append((phash, group))
+        # Keep the latest window groups, rebuilding at twice that: bounded memory
+        # that still covers a burst
+        if len(self._recent) >= 2 * self.window:
+            for _ in range(len(self._recent) - self.window):
+                self._recent.popleft()
+            self._root = None
+            for item in self._recent:
+                self._insert(*item)
+        else:
+            self._insert(phash, group)
+            
+    def _insert(self, phash: int, group: BurstGroup):
+        # Nodes are [hash, group, {distance: child}]
+        node = [phash, group, {}]
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming_distance(phash, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+            
+    def find(self, phash: int) -> Optional[BurstGroup]:
+        """Closest group within max_distance, if any"""
+        best, best_distance = None, self.max_distance + 1
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(phash, node[0])
+            if distance < best_distance:
+                best, best_distance = node[1], distance
+            for child_distance, child in node[2].items():
+                if abs(child_distance - distance) <= self.max_distance:
+                    stack.append(child)
+        return best
+
+class InferenceUnavailable(RuntimeError):
+    """Every Ollama endpoint is unhealthy (the circuit is open)"""
+
+class OllamaEndpoint:
+    """One Ollama server with its own persistent HTTP client"""
+    
+    def __init__(self, host: Optional[str] = None, timeout: Optional[float] = None):
+        self.host = host or os.environ.get("OLLAMA_HOST") or "default"
+        self.url = host  # None = OLLAMA_HOST / localhost
+        self.client = ollama.Client(host=host, timeout=timeout)
+        self.outstanding = 0
+        self.completed = 0
+        self.failures = 0  # Consecutive failed requests
+        self.errors = 0
+        self.ejected_until = 0.0
+        self.has_model = True
+        
+    def healthy(self, now: float) -> bool:
+        return self.has_model and self.ejected_until <= now
+
+class InferencePool:
+    """Least-outstanding-requests routing over one or more Ollama endpoints"""
+    
+    # Seconds between probes of ejected endpoints while the circuit is open
+    PROBE_INTERVAL = 5.0
+    
+    def __init__(
+        self,
+        hosts: List[Optional[str]],
+        model: str,
+        eject_after: int = 3,
+        eject_seconds: float = 60.0,
+        health_interval: float = 30.0,
+        logger: Optional[logging.Logger] = None,
+        metrics: Optional[PipelineMetrics] = None,
+        timeout: Optional[float] = None,
+        load_timeout: Optional[float] = None,
+        keep_alive: Optional[str] = None,
+        retries: int = 0,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        max_outage: float = 0.0,
+    ):
+        self.endpoints = [OllamaEndpoint(host, timeout) for host in (hosts or [None])]
+        self.model = model
+        # Consecutive failures before an endpoint is ejected...
+        self.eject_after = max(1, eject_after)
+        # ...for this long, unless a health check reinstates it sooner
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.metrics = metrics
+        self.load_timeout = load_timeout
+        self.keep_alive = keep_alive
+        # Retries use jittered exponential backoff, on another endpoint if there is one
+        self.retries = max(0, retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_outage = max_outage
+        self._open_since = None  # When every endpoint was first seen unhealthy
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+        
+    def probe(self, endpoint: OllamaEndpoint, extend: bool = True) -> str:
+        """List models on endpoint, update its state: ok, unreachable or no_model"""
+        try:
+            models = endpoint.client.list()
+            available_models = [m['model'] for m in models['models']]
+        except Exception:
+            # (Re-)eject; probes while waiting out an outage leave the ejection as it is
+            if extend:
+                with self._lock:
+                    endpoint.ejected_until = time.time() + self.eject_seconds
+            return "unreachable"
+        with self._lock:
+            endpoint.has_model = self.model in available_models
+            if not endpoint.has_model:
+                return "no_model"
+            endpoint.failures = 0
+            endpoint.ejected_until = 0.0
+            self._open_since = None
+        return "ok"
+        
+    def start_health_checks(self):
+        """Probe every endpoint periodically on a daemon thread (useful with several)"""
+        if (
+            len(self.endpoints) < 2
+            or self.health_interval <= 0
+            or self._health_thread is not None
+        ):
+            return
+        self._stop.clear()
+        
+        def loop():
+            states = {}
+            while not self._stop.wait(self.health_interval):
+                for endpoint in self.endpoints:
+                    state = self.probe(endpoint)
+                    if state != states.get(endpoint.host, "ok"):
+                        log = self.logger.info if state == "ok" else self.logger.warning
+                        log(f"Ollama endpoint {endpoint.host}: {state}")
+                    states[endpoint.host] = state
+                    
+        self._health_thread = threading.Thread(
+            target=loop, name="ollama-health", daemon=True
+        )
+        self._health_thread.start()
+        
+    def load(self, keep_alive: Optional[str] = None) -> int:
+        """Load the model on every endpoint for keep_alive; returns how many loaded"""
+        # 0 unloads the model instead
+        keep_alive = self.keep_alive if keep_alive is None else keep_alive
+        
+        def load_on(endpoint: OllamaEndpoint) -> bool:
+            try:
+                with ollama.Client(
+                    host=endpoint.url, timeout=self.load_timeout
+                ) as client:
+                    # A chat request without messages only loads the model
+                    client.chat(model=self.model, messages=[], keep_alive=keep_alive)
+                return True
+            except Exception as e:
+                self.logger.warning(
+                    f"Could not load {self.model} on {endpoint.host}: {e}"
+                )
+                return False
+                
+        endpoints = [e for e in self.endpoints if e.has_model]
+        if not endpoints:
+            return 0
+        with ThreadPoolExecutor(
+            max_workers=len(endpoints), thread_name_prefix="ollama-load"
+        ) as executor:
+            return sum(executor.map(load_on, endpoints))
+            
+    def unpin(self, keep_alive: str):
+        """Replace the pin with keep_alive on endpoints still holding the model"""
+        for endpoint in self.endpoints:
+            try:
+                # Skip servers that already unloaded it, or the request reloads it
+                if any(
+                    m['model'] == self.model for m in endpoint.client.ps()['models']
+                ):
+                    endpoint.client.chat(
+                        model=self.model, messages=[], keep_alive=keep_alive
+                    )
+            except Exception as e:
+                self.logger.debug(
+                    f"Could not unpin {self.model} on {endpoint.host}: {e}"
+                )
+                
+    def acquire(self, exclude: Optional[OllamaEndpoint] = None) -> OllamaEndpoint:
+        """Reserve the healthy endpoint with the fewest requests outstanding"""
+        with self._lock:
+            now = time.time()
+            candidates = [
+                e for e in self.endpoints if e.healthy(now) and e is not exclude
+            ]
+            if not candidates:
+                # Everything is ejected: try whichever comes back soonest
+                candidates = (
+                    sorted(
+                        (e for e in self.endpoints if e.has_model and e is not exclude),
+                        key=lambda e: e.ejected_until,
+                    )[:1]
+                    or [e for e in self.endpoints if e.has_model][:1]
+                    or self.endpoints[:1]
+                )
+            endpoint = min(candidates, key=lambda e: e.outstanding)
+            endpoint.outstanding += 1
+            return endpoint
+            
+    def release(self, endpoint: OllamaEndpoint, succeeded: bool):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if succeeded:
+                endpoint.completed += 1
+                endpoint.failures = 0
+                self._open_since = None
+                return
+            endpoint.errors += 1
+            endpoint.failures += 1
+            if (
+                endpoint.failures >= self.eject_after
+                and endpoint.ejected_until <= time.time()
+            ):
+                endpoint.ejected_until = time.time() + self.eject_seconds
+                self.logger.warning(
+                    f"Ejecting Ollama endpoint {endpoint.host} for "
+                    f"{self.eject_seconds:.0f}s after {endpoint.failures} failures"
+                )
+                
+    def circuit_open(self) -> bool:
+        """Whether every endpoint is ejected or lacks the model"""
+        now = time.time()
+        with self._lock:
+            return not any(e.healthy(now) for e in self.endpoints)
+            
+    def wait_until_available(self):
+        """Block while the circuit is open; InferenceUnavailable after max_outage"""
+        announced = False
+        while True:
+            now = time.time()
+            with self._lock:
+                if any(e.healthy(now) for e in self.endpoints):
+                    return
+                ejected = [e for e in self.endpoints if e.has_model]
+                if not ejected:
+                    raise InferenceUnavailable(
+                        f"No Ollama endpoint serves {self.model}"
+                    )
+                if self._open_since is None:
+                    self._open_since = now
+                outage = now - self._open_since
+                reopens_in = min(e.ejected_until for e in ejected) - now
+            if self.max_outage and outage >= self.max_outage:
+                raise InferenceUnavailable(
+                    f"No Ollama endpoint has answered for {outage:.0f}s"
+                )
+            if not announced:
+                self.logger.warning(
+                    f"All Ollama endpoints are unhealthy - holding requests for up to "
+                    f"{reopens_in:.0f}s"
+                )
+                if self.metrics is not None:
+                    self.metrics.increment("circuit_open")
+                announced = True
+            # Probing closes the circuit as soon as a server answers; otherwise the
+            # soonest ejection to expire lets trial requests through
+            time.sleep(max(0.05, min(self.PROBE_INTERVAL, reopens_in)))
+            for endpoint in ejected:
+                self.probe(endpoint, extend=False)
+                
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential delay before retry number attempt (1-based)"""
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        )
+        
+    @staticmethod
+    def retryable(error: Exception) -> bool:
+        """Timeouts, connection errors, 429 and 5xx are retried; other 4xx are not"""
+        status = getattr(error, "status_code", None)
+        return status is None or status < 400 or status == 429 or status >= 500
+        
+    def chat(self, **kwargs) -> Dict:
+        """ollama.chat on the least loaded endpoint, retried with backoff on failure"""
+        # Every request renews the pin on the model
+        kwargs.setdefault("keep_alive", self.keep_alive)
+        endpoint = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                if self.metrics is not None:
+                    self.metrics.increment("retries")
+                time.sleep(self.backoff(attempt))
+            if self.circuit_open():
+                raise InferenceUnavailable("All Ollama endpoints are unhealthy")
+            endpoint = self.acquire(exclude=endpoint)
+            try:
+                response = endpoint.client.chat(**kwargs)
+            except Exception as e:
+                self.release(endpoint, False)
+                if attempt == self.retries or not self.retryable(e):
+                    raise
+                continue
+            self.release(endpoint, True)
+            return response
+            
+    def close(self):
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join(timeout=5)
+            self._health_thread = None
+
+class FolderWatcher:
+    """Reports files created or changed under a folder, ignoring dot-files and dirs"""
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    
+    def __init__(
+        self,
+        folder: Path,
+        extensions: set,
+        poll_interval: float = 2.0,
+        use_inotify: bool = True,
+    ):
+        self.folder = folder
+        self.extensions = extensions
+        self.poll_interval = poll_interval
+        self.backend = "polling"
+        self._fd = None
+        self._watches = {}
+        self._snapshot = {}
+        self._last_scan = 0.0
+        # inotify through libc on Linux; rescan every poll_interval elsewhere or
+        # if it cannot be set up
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self._start_inotify()
+                self.backend = "inotify"
+            except OSError:
+                self.close()
+        if self.backend == "polling":
+            self._snapshot = dict(self._scan())
+            self._last_scan = time.time()
+            
+    def _wanted(self, name: str) -> bool:
+        return (
+            not name.startswith('.')
+            and os.path.splitext(name)[1].lower() in self.extensions
+        )
+        
+    def _start_inotify(self):
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+        self._watch_tree(self.folder)
+        
+    def _watch_tree(self, directory: Path) -> List[Path]:
+        """Watch directory and its subdirectories; returns files already inside"""
+        import ctypes
+        found = []
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(current), mask)
+            if wd < 0:
+                if current == self.folder:
+                    raise OSError(
+                        ctypes.get_errno(), f"inotify_add_watch failed for {current}"
+                    )
+                continue
+            self._watches[wd] = Path(current)
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif self._wanted(entry.name):
+                            found.append(Path(entry.path))
+            except OSError:
+                continue
+        return found
+        
+    def _scan(self) -> Iterator[Tuple[str, Tuple[int, float]]]:
+        pending = [self.folder]
+        while pending:
+            try:
+                with os.scandir(pending.pop()) as it:
+                    for entry in it:
+                        if entry.name.startswith('.'):
+                            continue
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                            elif self._wanted(entry.name):
+                                stat = entry.stat()
+                                yield entry.path, (stat.st_size, stat.st_mtime)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+                
+    def changes(self, timeout: float) -> List[Path]:
+        """Files that appeared or changed, waiting up to timeout seconds for one"""
+        if self.backend == "inotify":
+            return self._read_inotify(timeout)
+        wait_for = self._last_scan + self.poll_interval - time.time()
+        if wait_for > 0:
+            if wait_for > timeout:
+                time.sleep(timeout)
+                return []
+            time.sleep(wait_for)
+        snapshot = dict(self._scan())
+        self._last_scan = time.time()
+        changed = [
+            Path(path)
+            for path, state in snapshot.items()
+            if self._snapshot.get(path) != state
+        ]
+        self._snapshot = snapshot
+        return changed
+        
+    def _read_inotify(self, timeout: float) -> List[Path]:
+        import select
+        import struct
+        readable, _, _ = select.select([self._fd], [], [], max(0.0, timeout))
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, _, name_length = struct.unpack_from("iIII", data, offset)
+            name = data[offset + 16:offset + 16 + name_length].rstrip(b"\0")
+            name = name.decode(errors="surrogateescape")
+            offset += 16 + name_length
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were dropped; fall back to listing everything we watch
+                changed.extend(Path(path) for path, _ in self._scan())
+                continue
+            directory = self._watches.get(wd)
+            if directory is None or not name or name.startswith('.'):
+                continue
+            path = directory / name
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    changed.extend(self._watch_tree(path))
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO) and self._wanted(name):
+                changed.append(path)
+        return changed
+        
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class PreparedPhoto:
+    """Compact result of the CPU stage, handed to inference and sidecar writing"""
+
+    def __init__(
+        self,
+        path: Path,
+        quality_results: Dict,
+        quality_tags: List[str],
+        image_bytes: bytes,
+        content_hash: Optional[str] = None,
+    ):
+        self.path = path
+        self.quality_results = quality_results
+        self.quality_tags = quality_tags
+        self.image_bytes = image_bytes  # JPEG already resized to max_image_size
+        # Hash of the source file bytes, if the keyword cache is on
+        self.content_hash = content_hash
+        self.file_size = None
+        self.file_mtime = None
+        self.prepare_seconds = None
+        self.inference_seconds = None
+        self.phash = None  # Perceptual hash for burst grouping
+        self.stage_seconds = {}  # CPU-stage timings: decode, quality, encode, hash
+        # Triage rules the photo failed; non-empty means no inference
+        self.reject_reasons = []
+        self.thumbnail_key = None  # Model-input cache entry to store or refresh
+        self.thumbnail_hit = False
+        self.thumbnail_meta = None
+        self.attempts = 0  # Failed inference attempts, each followed by a requeue
+        # Raw metrics behind quality_results, for the analysis store
+        self.quality_metrics = None
+        # Keywords a previous run embedded, removed from the file before ours are added
+        self.owned_keywords = []
+
+class EnhancedPhotoTagger:
+    """Enhanced photo tagger with quality control"""
+    
+    def __init__(self, config: Dict):
+        self.config = config
+        self.quality_analyzer = QualityAnalyzer(config)
+        self.decode_budget = self.create_decode_budget()
+        self.setup_logging()
+        self.setup_progress_tracking()
+        self.setup_work_queue()
+        self.setup_keyword_cache()
+        self.setup_keyword_index()
+        self.setup_analysis_store()
+        self.setup_thumbnail_cache()
+        if self.config.get("triage", {}).get("triage_only", False):
+            # A triage-only pass never talks to Ollama
+            self.inference_pool = None
+        else:
+            self.setup_inference_pool()
+            self.check_dependencies()
+        self.exiftool = None
+        self.embed_queue = []
+        self.setup_burst_grouping()
+        self.sidecar_writer = SidecarWriter(
+            self.config.get("sidecar", {}).get("write_workers", 4),
+            self.logger,
+            self.metrics,
+        )
+        self.pending_writes = deque()
+        
+    @classmethod
+    def for_worker(
+        cls, config: Dict, decode_budget: Optional[DecodeBudget] = None
+    ) -> "EnhancedPhotoTagger":
+        """Lightweight instance for decode/analysis worker processes"""
+        # No logging, progress tracking or dependency check: only CPU stages run
+        tagger = cls.__new__(cls)
+        tagger.config = config
+        tagger.quality_analyzer = QualityAnalyzer(config)
+        tagger.decode_budget = decode_budget  # The parent's, shared by every worker
+        tagger.logger = logging.getLogger(__name__)
+        tagger.keyword_cache = None
+        tagger.keyword_index = None
+        tagger.analysis_store = None
+        tagger.work_queue = None
+        tagger.inference_pool = None
+        tagger.metrics = PipelineMetrics()
+        tagger.setup_thumbnail_cache()
+        return tagger
+        
+    def create_decode_budget(self) -> Optional[DecodeBudget]:
+        """Decode budget from ``memory.decode_budget_bytes``, None when unbounded"""
+        max_bytes = self.config.get("memory", {}).get("decode_budget_bytes")
+        if max_bytes is None:
+            total = physical_memory()
+            max_bytes = total // 4 if total else 0
+        if max_bytes <= 0:
+            return None
+        return DecodeBudget(
+            max_bytes,
+            shared=self.config.get("workers", {}).get("decode_workers", 0) > 1,
+        )
+        
+    def setup_logging(self):
+        """Setup logging configuration"""
+        log_file = self.config["pictures_folder"] / "ai_photo_tagger_v3.log"
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            handlers=[
+                logging.FileHandler(log_file),
+                logging.StreamHandler(sys.stdout)
+            ]
+        )
+        self.logger = logging.getLogger(__name__)
+        
+    def setup_progress_tracking(self):
+        """Initialize progress tracking"""
+        self.progress_file = (
+            self.config["pictures_folder"] / "ai_photo_tagger_v3_progress.sqlite"
+        )
+        self.processed_count = 0
+        self.skipped_count = 0
+        self.error_count = 0
+        # Photos whose sidecar was written but embedding failed
+        self.embed_failed_count = 0
+        self.requeued_count = 0
+        self.quality_issues = 0
+        self.rejected_count = 0
+        self.triaged_count = 0
+        self.start_time = datetime.now()
+        self.metrics = PipelineMetrics(
+            self.config.get("metrics", {}).get("window", 2048)
+        )
+        self.last_metrics_export = 0.0
+        self.progress_store = ProgressStore(
+            self.progress_file, shared=is_cluster(self.config)
+        )
+        self.progress_store.start_session(self.start_time)
+        
+        # One-time import of the v3.0 JSON progress file
+        legacy_file = (
+            self.config["pictures_folder"] / "ai_photo_tagger_v3_progress.json"
+        )
+        if legacy_file.exists() and self.progress_store.is_empty():
+            imported = self.progress_store.import_json(legacy_file)
+            self.logger.info(
+                f"Imported {imported:,} processed files from {legacy_file.name}"
+            )
+        
+    def setup_work_queue(self):
+        """Join the shared work queue when running as one node of a cluster"""
+        self.work_queue = None
+        if not is_cluster(self.config):
+            return
+        cluster_config = self.config["cluster"]
+        path = queue_path(self.config)
+        self.work_queue = WorkQueue(
+            path, cluster_node_id(self.config), cluster_config.get("lease_seconds", 300)
+        )
+        self.work_queue.join()
+        self.logger.info(
+            f"Joined work queue {path.name} as node {self.work_queue.node}"
+        )
+        
+    def setup_keyword_cache(self):
+        """Open the persistent keyword cache if enabled"""
+        self.keyword_cache = None
+        cache_config = self.config.get("keyword_cache", {})
+        if not cache_config.get("enabled", False):
+            return
+        cache_path = (
+            cache_config.get("path")
+            or self.config["pictures_folder"] / "ai_photo_tagger_v3_cache.sqlite"
+        )
+        try:
+            self.keyword_cache = KeywordCache(
+                Path(cache_path),
+                cache_config.get("max_bytes", 64 * 1024 * 1024),
+                shared=is_cluster(self.config),
+            )
+        except sqlite3.Error as e:
+            self.logger.warning(f"Keyword cache disabled ({cache_path}): {e}")
+        
+    def setup_inference_pool(self):
+        """Create the client pool requests are routed through"""
+        inference_config = self.config.get("inference", {})
+        self.inference_pool = InferencePool(
+            inference_config.get("endpoints") or [],
+            self.config["ollama_model"],
+            eject_after=inference_config.get("eject_after_failures", 3),
+            eject_seconds=inference_config.get("eject_seconds", 60),
+            health_interval=inference_config.get("health_check_interval", 30),
+            logger=self.logger,
+            metrics=self.metrics,
+            timeout=inference_config.get("request_timeout"),
+            load_timeout=inference_config.get("load_timeout"),
+            keep_alive=inference_config.get("keep_alive"),
+            retries=inference_config.get("retries", 0),
+            backoff_base=inference_config.get("backoff_base", 1.0),
+            backoff_max=inference_config.get("backoff_max", 30.0),
+            max_outage=inference_config.get("max_outage") or 0,
+        )
+        
+    def setup_thumbnail_cache(self):
+        """Open the persistent model-input cache if enabled"""
+        self.thumbnail_cache = None
+        self.thumbnail_hits = 0
+        self.thumbnail_misses = 0
+        thumb_config = self.config.get("thumbnail_cache", {})
+        if not thumb_config.get("enabled", False):
+            return
+        thumb_dir = Path(
+            thumb_config.get("path")
+            or self.config["pictures_folder"] / ".ai_photo_tagger_v3_thumbs"
+        )
+        if is_cluster(self.config):
+            # Pack files have a single writer, so every node keeps its own
+            thumb_dir = thumb_dir / cluster_node_id(self.config)
+        try:
+            self.thumbnail_cache = ThumbnailCache(
+                thumb_dir,
+                thumb_config.get("max_bytes", 1024 * 1024 * 1024),
+                thumb_config.get("shards", 16),
+            )
+        except (OSError, sqlite3.Error) as e:
+            self.logger.warning(f"Thumbnail cache disabled ({thumb_dir}): {e}")
+        
+    def quality_fingerprint(self) -> str:
+        """Hash of the settings cached quality results depend on"""
+        settings = {
+            key: self.config.get(key)
+            for key in ("quality_control", "concert_mode", "raw_decode")
+        }
+        return hashlib.blake2b(
+            json.dumps(settings, sort_keys=True, default=str).encode(), digest_size=8
+        ).hexdigest()
+        
+    def setup_keyword_index(self):
+        """Open the searchable keyword index if enabled"""
+        self.keyword_index = None
+        if not self.config.get("index", {}).get("enabled", False):
+            return
+        index_path = keyword_index_path(self.config)
+        try:
+            self.keyword_index = KeywordIndex(
+                index_path, shared=is_cluster(self.config)
+            )
+        except sqlite3.Error as e:
+            self.logger.warning(f"Keyword index disabled ({index_path}): {e}")
+        
+    def setup_analysis_store(self):
+        """Open the columnar store of raw quality metrics if enabled"""
+        self.analysis_store = None
+        store_config = self.config.get("analysis_store", {})
+        if store_config.get("enabled", False):
+            self.analysis_store = AnalysisStore(
+                analysis_store_path(self.config), cluster_node_id(self.config),
+                segment_rows=store_config.get("segment_rows", 1000),
+                compact_segments=store_config.get("compact_segments", 32),
+            )
+        
+    def setup_burst_grouping(self):
+        """Create the near-duplicate index used to share keywords within bursts"""
+        burst_config = self.config.get("burst_grouping", {})
+        self.burst_reused = 0
+        self.burst_index = None
+        if burst_config.get("enabled", False):
+            self.burst_index = BurstIndex(
+                burst_config.get("max_distance", 6), burst_config.get("window", 512)
+            )
+        
+    def should_embed(self, photo_path: Path) -> bool:
+        """Whether keywords should also be embedded in the file itself"""
+        if not self.config.get("embed_in_dng", False):
+            return False
+        return photo_path.suffix.lower() in self.config.get("embedding", {}).get(
+            "formats", set()
+        )
+        
+    def flush_embeds(self):
+        """Embed queued keywords through the persistent ExifTool session"""
+        if not self.embed_queue:
+            return
+        queue, self.embed_queue = self.embed_queue, []
+        if self.exiftool is None:
+            self.exiftool = ExifToolSession()
+        jobs = [
+            (prepared.path, keywords, prepared.quality_results, prepared.owned_keywords)
+            for prepared, keywords in queue
+        ]
+        started = time.perf_counter()
+        try:
+            results = self.exiftool.write_keywords(jobs)
+        except (OSError, BrokenPipeError) as e:
+            self.logger.error(
+                f"ExifTool session failed, {len(jobs)} files not embedded: {e}"
+            )
+            self.embed_failed_count += len(jobs)
+            return
+        per_file = (time.perf_counter() - started) / len(jobs)
+        for _ in jobs:
+            self.metrics.observe("embed", per_file)
+        for (prepared, _), (ok, output) in zip(queue, results):
+            if not ok:
+                self.logger.error(
+                    f"Error embedding metadata in {prepared.path}: {output}"
+                )
+                self.embed_failed_count += 1
+                continue
+            # Embedding changes the file size; re-record so it doesn't look modified
+            try:
+                prepared.file_size = os.stat(prepared.path).st_size
+            except OSError:
+                pass
+            self.record_photo(prepared, "processed")
+            
+    def export_metrics(self, force: bool = False):
+        """Append a metrics snapshot to the JSON-lines file, refresh the .prom file"""
+        metrics_config = self.config.get("metrics", {})
+        if not metrics_config.get("enabled", True):
+            return
+        now = time.time()
+        # At most every metrics.interval seconds unless forced
+        if not force and now - self.last_metrics_export < metrics_config.get(
+            "interval", 30
+        ):
+            return
+        self.last_metrics_export = now
+        
+        self.metrics.set_counter("processed", self.processed_count)
+        self.metrics.set_counter("skipped", self.skipped_count)
+        self.metrics.set_counter("errors", self.error_count)
+        self.metrics.set_counter("embed_failures", self.embed_failed_count)
+        self.metrics.set_counter("quality_issues", self.quality_issues)
+        self.metrics.set_counter("rejected", self.rejected_count)
+        self.metrics.set_counter("triaged", self.triaged_count)
+        self.metrics.set_counter("burst_reused", self.burst_reused)
+        if self.keyword_cache:
+            self.metrics.set_counter("cache_hits", self.keyword_cache.hits)
+            self.metrics.set_counter("cache_misses", self.keyword_cache.misses)
+        if self.thumbnail_cache is not None:
+            self.metrics.set_counter("thumbnail_hits", self.thumbnail_hits)
+            self.metrics.set_counter("thumbnail_misses", self.thumbnail_misses)
+        snapshot = self.metrics.snapshot()
+        
+        jsonl_path = (
+            metrics_config.get("jsonl_path")
+            or self.config["pictures_folder"] / "ai_photo_tagger_v3_metrics.jsonl"
+        )
+        prometheus_path = metrics_config.get("prometheus_path")
+        try:
+            self.metrics.write_jsonl(Path(jsonl_path), snapshot)
+            if prometheus_path:
+                self.metrics.write_prometheus(Path(prometheus_path), snapshot)
+        except OSError as e:
+            self.logger.warning(f"Could not export metrics: {e}")
+        
+    def save_progress(self):
+        """Commit pending file records and session stats in one transaction"""
+        self.collect_sidecar_writes(wait_all=True)
+        self.flush_embeds()
+        committed = self.progress_store.commit(self.node_stats())
+        if self.work_queue is not None:
+            self.work_queue.settle(committed)
+        if self.keyword_index:
+            self.keyword_index.commit()
+        if self.thumbnail_cache is not None:
+            self.thumbnail_cache.commit()
+        if self.analysis_store is not None:
+            self.analysis_store.flush()
+            
+    def node_stats(self) -> Dict:
+        """Session counters, also published per node to the work queue"""
+        return {
+            "processed": self.processed_count,
+            "skipped": self.skipped_count,
+            "errors": self.error_count,
+            "embed_failures": self.embed_failed_count,
+            "quality_issues": self.quality_issues,
+            "rejected": self.rejected_count,
+            "elapsed": (datetime.now() - self.start_time).total_seconds(),
+        }
+        
+    def dependency_cache_path(self) -> Path:
+        """Where the last successful dependency check is cached"""
+        cache_path = self.config.get("dependency_check", {}).get("cache_path")
+        if cache_path:
+            return Path(cache_path)
+        cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+        return Path(cache_home) / "ai_photo_tagger" / "dependency_check.json"
+        
+    def dependency_cache_key(self) -> str:
+        hosts = ",".join(endpoint.host for endpoint in self.inference_pool.endpoints)
+        return f"{hosts}|{self.config['ollama_model']}|{exiftool_command()}"
+        
+    def load_dependency_check(self) -> Optional[Dict]:
+        """Return the cached check result if it is younger than the TTL"""
+        ttl = self.config.get("dependency_check", {}).get("ttl", 0)
+        if ttl <= 0:
+            return None
+        try:
+            with open(self.dependency_cache_path(), 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("key") != self.dependency_cache_key():
+            return None
+        if not 0 <= time.time() - cached.get("checked_at", 0) < ttl:
+            return None
+        return cached
+        
+    def save_dependency_check(self, exiftool_version: Optional[str]):
+        if self.config.get("dependency_check", {}).get("ttl", 0) <= 0:
+            return
+        cache_path = self.dependency_cache_path()
+        tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "key": self.dependency_cache_key(),
+                    "checked_at": time.time(),
+                    "exiftool": exiftool_version,
+                }, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            self.logger.warning(f"Could not cache dependency check: {e}")
+            
+    def check_dependencies(self):
+        """Check if required dependencies are available; raises DependencyError"""
+        # A passing check is reused for dependency_check.ttl seconds, skipping
+        # the Ollama and ExifTool round trips
+        cached = self.load_dependency_check()
+        if cached is not None:
+            if not cached.get("exiftool"):
+                self.config["embed_in_dng"] = False
+            age = time.time() - cached["checked_at"]
+            print(
+                f"✅ System check ........................... CACHED ({age:.0f}s ago)"
+            )
+            return
+            
+        print()
+        print("=" * 70)
+        print("  🔍 ENHANCED PHOTO TAGGER v3.0 - SYSTEM CHECK  ".center(70))
+        print("=" * 70)
+        
+        # Platform info
+        print(
+            "🖥️  Platform ................................ "
+            f"{platform.system()} {platform.release()}"
+        )
+        
+        # Check Ollama and the model on every endpoint with a single listing each
+        endpoints = self.inference_pool.endpoints
+        serving = 0
+        for endpoint in endpoints:
+            if len(endpoints) > 1:
+                print(f"🌐 Endpoint {endpoint.host}")
+            state = self.inference_pool.probe(endpoint)
+            if state == "unreachable":
+                print("❌ Ollama Service .......................... NOT RUNNING")
+                print("   Please install Ollama and run: ollama serve")
+                continue
+            print("✅ Ollama Service .......................... RUNNING")
+            if state == "no_model":
                 print(f"❌ AI Model ({self.config['ollama_model']}) ............... NOT FOUND")
                 print(f"   Install with: ollama pull {self.config['ollama_model']}")
-                sys.exit(1)
+                continue
             print(f"✅ AI Model ({self.config['ollama_model']}) ................... AVAILABLE")
-        except Exception as e:
-            print(f"❌ Error checking models: {e}")
-            sys.exit(1)
+            serving += 1
+        if not serving:
+            raise DependencyError(
+                f"No Ollama endpoint is serving {self.config['ollama_model']}"
+            )
             
         # Check ExifTool
-        exiftool_cmd = "exiftool.exe" if platform.system() == "Windows" else "exiftool"
+        exiftool_version = None
         try:
-            result = subprocess.run([exiftool_cmd, '-ver'], capture_output=True, text=True)
+            result = subprocess.run(
+                [exiftool_command(), '-ver'], capture_output=True, text=True
+            )
             if result.returncode == 0:
-                print(f"✅ ExifTool (v{result.stdout.strip()}) ...................... INSTALLED")
+                exiftool_version = result.stdout.strip()
+                print(
+                    f"✅ ExifTool (v{exiftool_version}) ...................... INSTALLED"
+                )
             else:
                 print("⚠️  ExifTool ............................... NOT FOUND")
                 self.config["embed_in_dng"] = False
@@ -358,8 +3663,15 @@ class EnhancedPhotoTagger:
             print("⚠️  ExifTool ............................... NOT FOUND")
             self.config["embed_in_dng"] = False
             
+        # Check RAW decoding support
+        if rawpy:
+            print("✅ RAW Decoding (rawpy) .................... ENABLED")
+        else:
+            print("⚠️  RAW Decoding ............................ DISABLED")
+            print("   Install with: pip install rawpy")
+            
         # Check quality analysis capabilities
-        if HAS_CV2:
+        if cv2:
             print("✅ Quality Analysis (OpenCV) ............... ENABLED")
         else:
             print("⚠️  Quality Analysis ....................... DISABLED")
@@ -372,51 +3684,280 @@ class EnhancedPhotoTagger:
             print("🎵 Concert Mode ............................ DISABLED")
             
         print("=" * 70)
+        self.save_dependency_check(exiftool_version)
+        
+    def needs_full_resolution(self) -> bool:
+        """Whether the enabled quality analyzers require a full-resolution RAW decode"""
+        if not self.config.get("raw_decode", {}).get("full_for_quality", False):
+            return False
+        quality_config = self.config.get("quality_control", {})
+        return bool(
+            quality_config.get("check_blur", False)
+            or quality_config.get("check_histogram", False)
+            or self.config.get("concert_mode", {}).get("enabled", False)
+        )
+        
+    def decode_raw(self, raw, strategy: str) -> Tuple[Image.Image, str]:
+        """Decode an open rawpy image using the cheapest strategy that is good enough"""
+        if strategy == "auto":
+            strategy = "full" if self.needs_full_resolution() else "preview"
+            
+        if strategy == "preview":
+            # Embedded camera JPEG: no demosaic at all
+            min_size = (
+                self.config.get("raw_decode", {}).get("min_preview_size")
+                or self.config["max_image_size"]
+            )
+            try:
+                thumb = raw.extract_thumb()
+                if thumb.format == rawpy.ThumbFormat.JPEG:
+                    from io import BytesIO
+                    preview = Image.open(BytesIO(thumb.data))
+                    self.apply_draft(preview, min_size)
+                else:
+                    preview = Image.fromarray(thumb.data)
+                if max(preview.size) >= min_size:
+                    preview = ImageOps.exif_transpose(preview)
+                    if preview.mode != 'RGB':
+                        preview = preview.convert('RGB')
+                    return preview, "preview"
+            except (
+                rawpy.LibRawNoThumbnailError,
+                rawpy.LibRawUnsupportedThumbnailError,
+            ):
+                pass
+            strategy = "half_size"
+            
+        if strategy == "half_size":
+            # Half-size output bins each Bayer quad, skipping demosaicing entirely
+            rgb = raw.postprocess(
+                half_size=True,
+                use_camera_wb=True,
+                output_color=rawpy.ColorSpace.sRGB,
+                gamma=(2.2, 4.5),
+                bright=1.0,
+            )
+            return Image.fromarray(rgb), "half_size"
+            
+        rgb = raw.postprocess(
+            demosaic_algorithm=rawpy.DemosaicAlgorithm.AHD,
+            half_size=False,
+            use_camera_wb=True,
+            output_color=rawpy.ColorSpace.sRGB,
+            gamma=(2.2, 4.5),
+            bright=1.0,
+        )
+        return Image.fromarray(rgb), "full"
+        
+    def decode_reduction(
+        self, size: Tuple[int, int], choices=None, min_edge: Optional[int] = None
+    ) -> int:
+        """Largest integer reduction the stages can start from instead of full size"""
+        analysis_size = self.config.get("quality_control", {}).get(
+            "analysis_size", 1024
+        )
+        if not analysis_size:
+            return 1
+        min_edge = min_edge or self.config["max_image_size"]
+        long_edge = max(size)
+        level_factor = max(1, -(-long_edge // analysis_size))
+        # Must divide the analysis level factor, so analysis sees the same level
+        # as after a full decode, and leave at least min_edge (default
+        # max_image_size) pixels for the model input
+        for factor in choices or range(level_factor, 1, -1):
+            if level_factor % factor == 0 and -(-long_edge // factor) >= min_edge:
+                return factor
+        return 1
+        
+    def apply_draft(self, img: Image.Image, min_edge: Optional[int] = None):
+        """Let the JPEG decoder skip DCT detail the stages do not need (1/2 to 1/8)"""
+        if img.format != 'JPEG' or not self.config.get("memory", {}).get("draft", True):
+            return
+        factor = self.decode_reduction(img.size, (8, 4, 2), min_edge)
+        if factor > 1:
+            img.draft('RGB', (img.width // factor, img.height // factor))
+            
+    def stripe_factor(self, img: Image.Image) -> int:
+        """Reduction for an uncompressed RGB TIFF read in stripes, 1 = decode whole"""
+        if img.format != 'TIFF' or img.mode != 'RGB' or len(img.tile) != 1:
+            return 1
+        codec, extents, offset, args = img.tile[0]
+        if (
+            codec != 'raw'
+            or tuple(extents) != (0, 0) + img.size
+            or args not in (('RGB', 0, 1), 'RGB')
+        ):
+            return 1
+        return self.decode_reduction(img.size)
+        
+    def decode_striped(self, img: Image.Image, factor: int) -> Image.Image:
+        """Box-reduce an uncompressed TIFF by factor without holding the full image"""
+        offset = img.tile[0][2]
+        width, height = img.size
+        stride = width * 3
+        stripe_bytes = self.config.get("memory", {}).get(
+            "stripe_bytes", 16 * 1024 * 1024
+        )
+        # A multiple of factor, so no box straddles two stripes
+        rows = factor * max(1, stripe_bytes // (stride * factor))
+        reduced = Image.new('RGB', (-(-width // factor), -(-height // factor)))
+        for top in range(0, height, rows):
+            count = min(rows, height - top)
+            img.fp.seek(offset + top * stride)
+            data = img.fp.read(count * stride)
+            if len(data) < count * stride:
+                raise OSError("truncated TIFF strip data")
+            reduced.paste(
+                Image.frombytes('RGB', (width, count), data).reduce(factor),
+                (0, top // factor),
+            )
+        return reduced
+        
+    def estimate_decode_bytes(self, img: Image.Image, factor: int = 1) -> int:
+        """Resident bytes an opened (not yet loaded) image will need once decoded"""
+        width, height = img.size
+        if factor > 1:
+            stride = width * 3
+            stripe_bytes = self.config.get("memory", {}).get(
+                "stripe_bytes", 16 * 1024 * 1024
+            )
+            rows = factor * max(1, stripe_bytes // (stride * factor))
+            return (
+                -(-width // factor) * -(-height // factor) * DECODE_BYTES_PER_PIXEL
+                + 2 * rows * stride
+            )
+        return width * height * DECODE_BYTES_PER_PIXEL
+        
+    def estimate_raw_bytes(self, raw, strategy: str) -> int:
+        """Resident bytes an open rawpy image will need for the given decode strategy"""
+        if strategy == "auto":
+            strategy = "full" if self.needs_full_resolution() else "preview"
+        sizes = raw.sizes
+        output = sizes.width * sizes.height
+        if strategy != "full":
+            output //= 4
+        return (
+            sizes.raw_width * sizes.raw_height * RAW_BYTES_PER_PIXEL[strategy]
+            + output * DECODE_BYTES_PER_PIXEL
+        )
         
-    def open_image_enhanced(self, image_path: Path) -> Optional[Image.Image]:
-        """Open image with enhanced RAW support"""
+    def open_image_enhanced(
+        self, image_path: Path, budget: Optional[DecodeBudget] = None
+    ) -> Optional[Image.Image]:
+        """Open image with enhanced RAW support; the decode is in img.info["decode"]"""
+        # Reserved from the header before decoding; the caller releases
+        # img.info["reserved"]
+        reserved = 0
+        decoded = None
         try:
             # RAW file handling
-            if (image_path.suffix.lower() in {'.arw', '.cr2', '.nef', '.orf', '.rw2'} and HAS_RAWPY):
+            if image_path.suffix.lower() in RAW_EXTENSIONS and rawpy:
+                strategy = self.config.get("raw_decode", {}).get("strategy", "auto")
                 with rawpy.imread(str(image_path)) as raw:
-                    rgb = raw.postprocess(
-                        demosaic_algorithm=rawpy.DemosaicAlgorithm.AHD,
-                        half_size=False,
-                        use_camera_wb=True,
-                        output_color=rawpy.ColorSpace.sRGB,
-                        gamma=(2.2, 4.5),
-                        bright=1.0,
-                    )
-                    return Image.fromarray(rgb)
+                    if budget is not None:
+                        reserved = budget.reserve(
+                            self.estimate_raw_bytes(raw, strategy)
+                        )
+                    img, source = self.decode_raw(raw, strategy)
+                    img.info["decode"] = source
+                    img.info["reserved"] = reserved
+                    return img
             
-            # Standard image handling
-            with Image.open(image_path) as img:
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                return img.copy()
+            # Standard image handling; open() parses the header, nothing is decoded yet
+            img = Image.open(image_path)
+            try:
+                full_size = img.size
+                self.apply_draft(img)
+                factor = self.stripe_factor(img)
+                if budget is not None:
+                    reserved = budget.reserve(self.estimate_decode_bytes(img, factor))
+                if factor > 1:
+                    decoded, source = self.decode_striped(img, factor), "striped"
+                else:
+                    # Keep the loaded image itself rather than a copy of it
+                    img.load()
+                    decoded = img if img.mode == 'RGB' else img.convert('RGB')
+                    source = "draft" if img.size != full_size else "image"
+            finally:
+                if decoded is not img:
+                    img.close()
+            decoded.info["decode"] = source
+            decoded.info["reserved"] = reserved
+            return decoded
                 
         except Exception as e:
+            if reserved:
+                budget.release(reserved)
             self.logger.error(f"Error opening {image_path}: {e}")
             return None
             
-    def analyze_photo_quality(self, image_path: Path) -> Dict:
+    def load_frame(self, image_path: Path) -> Optional[DecodedFrame]:
+        """Decode a photo once for all analysis stages, within the decode budget"""
+        budget = self.decode_budget
+        img = self.open_image_enhanced(image_path, budget)
+        if img is None:
+            return None
+        reserved = img.info.get("reserved", 0)
+        release = (lambda: budget.release(reserved)) if reserved else None
+        return DecodedFrame(image_path, img, img.info.get("decode", "image"), release)
+            
+    def analyze_photo_quality(
+        self, frame: DecodedFrame, raw: Optional[Dict] = None
+    ) -> Dict:
         """Perform comprehensive quality analysis"""
         quality_results = {}
+        analyzer = self.quality_analyzer
+        # With the cascade, decided_at records the deciding level's long edge, so
+        # cascaded runs can be checked against the analysis level alone; raw gets
+        # AnalysisStore.METRICS and LEVELS for the store
+        cascade = analyzer.cascade_config.get("enabled", False)
         
         if self.config.get("quality_control", {}).get("check_blur", False):
-            blur_score, blur_level = self.quality_analyzer.analyze_blur(image_path)
+            (blur_score, blur_level), values, decided_at = analyzer.decide(
+                frame, analyzer.blur_metrics, analyzer.blur_borderline,
+            )
             quality_results["blur"] = {"score": blur_score, "level": blur_level}
+            if cascade:
+                quality_results["blur"]["decided_at"] = decided_at
+            if raw is not None and values:
+                raw.update(blur_score=values["score"], blur_px=decided_at)
             
         if self.config.get("quality_control", {}).get("check_histogram", False):
-            hist_data, hist_quality = self.quality_analyzer.analyze_histogram(image_path)
-            quality_results["histogram"] = hist_data
+            (hist_data, hist_quality), values, decided_at = analyzer.decide(
+                frame, analyzer.histogram_metrics, analyzer.histogram_borderline,
+            )
+            quality_results["histogram"] = dict(hist_data)
             quality_results["histogram"]["quality"] = hist_quality
+            if cascade:
+                quality_results["histogram"]["decided_at"] = decided_at
+            if raw is not None and values:
+                raw.update(
+                    underexposed=values["underexposed"],
+                    overexposed=values["overexposed"],
+                    spread=values["spread"],
+                    histogram_px=decided_at,
+                )
             
         # Concert-specific analysis
         if self.config.get("concert_mode", {}).get("enabled", False):
-            concert_analysis = self.quality_analyzer.analyze_concert_specific(image_path)
+            concert_analysis, values, decided_at = analyzer.decide(
+                frame, analyzer.concert_metrics, analyzer.concert_borderline,
+            )
             quality_results["concert"] = concert_analysis
-            
+            if cascade:
+                quality_results["concert"]["decided_at"] = decided_at
+            if raw is not None and values:
+                raw.update(
+                    {
+                        name: value
+                        for name, value in values.items()
+                        if value is not None
+                    },
+                    concert_px=decided_at,
+                )
+                
+        if raw:
+            raw["analysis_px"] = analyzer.analysis_edge(frame)
         return quality_results
         
     def generate_quality_tags(self, quality_results: Dict) -> List[str]:
@@ -449,122 +3990,407 @@ class EnhancedPhotoTagger:
                 
         return tags
         
-    def get_enhanced_keywords(self, image_path: Path) -> List[str]:
-        """Get AI keywords with quality analysis"""
-        try:
-            # Open image
-            img = self.open_image_enhanced(image_path)
-            if not img:
-                return []
+    def triage_reasons(self, quality_results: Dict) -> List[str]:
+        """Triage rules a photo fails; any failure routes it away from the model"""
+        triage_config = self.config.get("triage", {})
+        if not triage_config.get("enabled", False):
+            return []
+        reasons = []
+        blur_level = quality_results.get("blur", {}).get("level")
+        if blur_level in triage_config.get("reject_blur_levels", []):
+            reasons.append(blur_level)
+        exposure = quality_results.get("histogram", {}).get("quality")
+        if exposure in triage_config.get("reject_exposure", []):
+            reasons.append(exposure)
+        if triage_config.get("reject_low_light", False) and quality_results.get(
+            "concert", {}
+        ).get("low_light", False):
+            reasons.append("low_light")
+        return reasons
+        
+    def encode_for_model(self, frame: DecodedFrame) -> bytes:
+        """Resize and JPEG-encode a frame for the vision model"""
+        return frame.encode_jpeg(self.config["max_image_size"])
+        
+    def request_ai_keywords(self, image_bytes: bytes) -> List[str]:
+        """Ask the vision model for keywords; raises on inference errors"""
+        # Only touches the Ollama client, so worker threads may call it
+        return self.parse_keywords(self.request_ai_response(image_bytes))
+        
+    def request_ai_response(self, image_bytes: bytes) -> str:
+        """Raw model answer for one image from the least loaded endpoint; may raise"""
+        import base64
+        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        response = self.inference_pool.chat(
+            model=self.config["ollama_model"],
+            messages=[{
+                'role': 'user',
+                'content': self.config["ai_prompt"],
+                'images': [base64_image]
+            }],
+            options=MODEL_OPTIONS
+        )
+        return response['message']['content']
+        
+    @staticmethod
+    def parse_keywords(keywords_raw: str) -> List[str]:
+        """Split a comma-separated model answer into cleaned keywords"""
+        keywords = []
+        for keyword in keywords_raw.split(','):
+            cleaned = keyword.strip().lower()
+            if cleaned and len(cleaned) > 1 and len(cleaned) < 25:
+                keywords.append(cleaned)
+        return keywords
+        
+    def combine_keywords(
+        self, ai_keywords: List[str], quality_tags: List[str]
+    ) -> List[str]:
+        """Combine AI keywords with quality tags, capped at max_tags"""
+        all_keywords = ai_keywords[:self.config["max_tags"]] + quality_tags
+        return all_keywords[:self.config["max_tags"]]
+        
+    def get_enhanced_keywords(
+        self, frame: DecodedFrame, quality_results: Dict
+    ) -> List[str]:
+        """Get AI keywords for an already decoded and analyzed frame; may raise"""
+        quality_tags = self.generate_quality_tags(quality_results)
+        if self.triage_reasons(quality_results):
+            return quality_tags + [REJECTED_TAG]
+        # Failures must not become an empty result, which would read as "no
+        # keywords" and skip the photo
+        ai_keywords = self.request_ai_keywords(self.encode_for_model(frame))
+        return self.combine_keywords(ai_keywords, quality_tags)
             
-            # Perform quality analysis
-            quality_results = self.analyze_photo_quality(image_path)
-            quality_tags = self.generate_quality_tags(quality_results)
+    def write_enhanced_xmp(
+        self, image_path: Path, keywords: List[str], quality_data: Dict = None
+    ) -> bool:
+        """Write enhanced XMP file with quality metadata, merging an existing one"""
+        return self.sidecar_writer.write(image_path, keywords, quality_data)
             
-            # Check if we should skip due to quality issues
-            if quality_results.get("blur", {}).get("level") == "very_blurry":
-                self.quality_issues += 1
-                print(f"⚠️  Very blurry image detected")
-                
-            # Resize for AI processing
-            if max(img.size) > self.config["max_image_size"]:
-                img.thumbnail((self.config["max_image_size"], self.config["max_image_size"]))
-                
-            # Convert to base64
-            from io import BytesIO
-            import base64
-            buffer = BytesIO()
-            img.save(buffer, format="JPEG", quality=85)
-            base64_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            # Get AI keywords
-            response = ollama.chat(
-                model=self.config["ollama_model"],
-                messages=[{
-                    'role': 'user',
-                    'content': self.config["ai_prompt"],
-                    'images': [base64_image]
-                }],
-                options={"temperature": 0.3, "num_predict": 50}
-            )
-            
-            # Parse keywords
-            keywords_raw = response['message']['content']
-            keywords = []
-            for keyword in keywords_raw.split(','):
-                cleaned = keyword.strip().lower()
-                if cleaned and len(cleaned) > 1 and len(cleaned) < 25:
-                    keywords.append(cleaned)
-            
-            # Combine AI keywords with quality tags
-            all_keywords = keywords[:self.config["max_tags"]] + quality_tags
-            return all_keywords[:self.config["max_tags"]]
+    def prepare_photo(self, photo_path: Path) -> Optional[PreparedPhoto]:
+        """Decode, analyze and encode a photo for inference (CPU stage)"""
+        # Touches no counters or shared state, so it can run in a worker process
+        metrics_config = self.config.get("metrics", {})
+        sample_rate = metrics_config.get("profile_sample_rate", 0.0)
+        if sample_rate and random.random() < sample_rate:
+            import cProfile
+            profile_dir = Path(
+                metrics_config.get("profile_dir")
+                or self.config["pictures_folder"] / "ai_photo_tagger_v3_profiles"
+            )
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(self._prepare_photo, photo_path)
+            finally:
+                try:
+                    profile_dir.mkdir(parents=True, exist_ok=True)
+                    profiler.dump_stats(
+                        str(
+                            profile_dir
+                            / f"{photo_path.name}.{int(time.time() * 1000)}.prof"
+                        )
+                    )
+                except OSError as e:
+                    self.logger.warning(
+                        f"Could not write profile for {photo_path}: {e}"
+                    )
+        return self._prepare_photo(photo_path)
+        
+    def _prepare_photo(self, photo_path: Path) -> Optional[PreparedPhoto]:
+        started = time.perf_counter()
+        stage_seconds = {}
+        try:
+            stat = os.stat(photo_path)
+        except OSError as e:
+            self.logger.error(f"Error reading {photo_path}: {e}")
+            return None
+        
+        # A cached model input can stand in for the decode; its quality
+        # results too, if they were computed under the same settings
+        thumbnail_key = None
+        cached = None
+        burst_enabled = self.config.get("burst_grouping", {}).get("enabled", False)
+        if self.thumbnail_cache is not None:
+            thumbnail_key = ThumbnailCache.make_key(
+                photo_path, stat.st_size, stat.st_mtime, self.config["max_image_size"]
+            )
+            cached = self.thumbnail_cache.get(thumbnail_key)
+        fingerprint = self.quality_fingerprint()
+        if cached is not None and cached[1].get("quality_key") == fingerprint and \
+                (not burst_enabled or cached[1].get("phash") is not None):
+            image_bytes, meta = cached
+            quality_results = meta["quality"]
+            quality_metrics = meta.get("metrics")
+            phash = meta.get("phash") if burst_enabled else None
+            reject_reasons = self.triage_reasons(quality_results)
+            stage_seconds["thumbnail"] = time.perf_counter() - started
+            content_hash = None
+            # Like a decode, rejects and triage-only passes skip reading the file
+            needs_hash = not reject_reasons and not self.config.get("triage", {}).get(
+                "triage_only", False
+            )
+            if needs_hash and self.config.get("keyword_cache", {}).get(
+                "enabled", False
+            ):
+                mark = time.perf_counter()
+                content_hash = file_content_hash(photo_path)
+                stage_seconds["hash"] = time.perf_counter() - mark
+        else:
+            # Decode once and share the frame with every stage
+            frame = self.load_frame(photo_path)
+            stage_seconds["decode"] = time.perf_counter() - started
+            if frame is None:
+                return None
             
-        except Exception as e:
-            self.logger.error(f"Enhanced keyword processing error for {image_path}: {e}")
-            return []
+            try:
+                mark = time.perf_counter()
+                quality_metrics = {}
+                quality_results = self.analyze_photo_quality(frame, quality_metrics)
+                stage_seconds["quality"] = time.perf_counter() - mark
+                
+                # Rejected frames and triage-only passes never reach the model
+                reject_reasons = self.triage_reasons(quality_results)
+                image_bytes = b""
+                content_hash = None
+                phash = None
+                if not reject_reasons and not self.config.get("triage", {}).get(
+                    "triage_only", False
+                ):
+                    mark = time.perf_counter()
+                    image_bytes = (
+                        cached[0]
+                        if cached is not None
+                        else self.encode_for_model(frame)
+                    )
+                    stage_seconds["encode"] = time.perf_counter() - mark
+                    
+                    mark = time.perf_counter()
+                    if self.config.get("keyword_cache", {}).get("enabled", False):
+                        content_hash = file_content_hash(photo_path)
+                    if burst_enabled:
+                        phash = dhash(self.quality_analyzer.analysis_level(frame).gray)
+                    if content_hash or phash is not None:
+                        stage_seconds["hash"] = time.perf_counter() - mark
+            except Exception as e:
+                self.logger.error(f"Error preparing {photo_path}: {e}")
+                return None
+            finally:
+                frame.close()
             
-    def write_enhanced_xmp(self, image_path: Path, keywords: List[str], quality_data: Dict = None) -> bool:
-        """Write enhanced XMP file with quality metadata"""
-        xmp_path = image_path.with_suffix(image_path.suffix + '.xmp')
+        prepared = PreparedPhoto(
+            photo_path, quality_results, self.generate_quality_tags(quality_results),
+            image_bytes, content_hash,
+        )
+        prepared.file_size = stat.st_size
+        prepared.file_mtime = stat.st_mtime
+        prepared.phash = phash
+        prepared.reject_reasons = reject_reasons
+        prepared.quality_metrics = quality_metrics
+        if thumbnail_key and image_bytes:
+            prepared.thumbnail_key = thumbnail_key
+            prepared.thumbnail_hit = cached is not None
+            prepared.thumbnail_meta = {
+                "quality_key": fingerprint,
+                "quality": quality_results,
+                "phash": phash,
+                "metrics": quality_metrics,
+            }
+        prepared.stage_seconds = stage_seconds
+        prepared.prepare_seconds = time.perf_counter() - started
+        return prepared
         
-        # Build quality metadata
-        quality_metadata = ""
-        if quality_data:
-            quality_metadata = f'''
-            <photoshop:Instructions>Quality Analysis: {json.dumps(quality_data)}</photoshop:Instructions>'''
-        
-        xmp_content = f'''<?xml version="1.0" encoding="UTF-8"?>
-<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="Enhanced AI Photo Tagger v3.0">
-    <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
-        <rdf:Description rdf:about=""
-            xmlns:dc="http://purl.org/dc/elements/1.1/"
-            xmlns:xmp="http://ns.adobe.com/xap/1.0/"
-            xmlns:photoshop="http://ns.adobe.com/photoshop/1.0/">
-            <dc:subject>
-                <rdf:Bag>
-{chr(10).join(f'                    <rdf:li>{keyword}</rdf:li>' for keyword in keywords)}
-                </rdf:Bag>
-            </dc:subject>
-            <xmp:CreatorTool>Enhanced AI Photo Tagger v3.0</xmp:CreatorTool>
-            <xmp:ModifyDate>{datetime.now().isoformat()}</xmp:ModifyDate>{quality_metadata}
-        </rdf:Description>
-    </rdf:RDF>
-</x:xmpmeta>'''
+    def accept_prepared(
+        self, photo_path: Path, prepared: Optional[PreparedPhoto]
+    ) -> bool:
+        """Record the outcome of the CPU stage in the session counters"""
+        print(f"🎯 Processing: {photo_path.name}")
+        if prepared is None:
+            print("❌ Could not open image")
+            self.error_count += 1
+            self.progress_store.record(str(photo_path), "error")
+            return False
+        for stage, seconds in prepared.stage_seconds.items():
+            self.metrics.observe(stage, seconds)
+        if self.analysis_store is not None and prepared.quality_metrics:
+            self.analysis_store.add(
+                str(photo_path), prepared.quality_metrics, prepared.quality_results
+            )
+        if self.thumbnail_cache is not None and prepared.thumbnail_key:
+            self.store_thumbnail(prepared)
+        if prepared.quality_results.get("blur", {}).get("level") == "very_blurry":
+            self.quality_issues += 1
+            print("⚠️  Very blurry image detected")
+        return True
         
+    def store_thumbnail(self, prepared: PreparedPhoto):
+        """Add a freshly encoded model input to the cache, or refresh a hit"""
+        if prepared.thumbnail_hit:
+            self.thumbnail_hits += 1
+        else:
+            self.thumbnail_misses += 1
         try:
-            with open(xmp_path, 'w', encoding='utf-8') as f:
-                f.write(xmp_content)
-            return True
-        except Exception as e:
-            self.logger.error(f"Error writing enhanced XMP for {image_path}: {e}")
-            return False
+            if not prepared.thumbnail_hit:
+                self.thumbnail_cache.put(
+                    prepared.thumbnail_key,
+                    prepared.image_bytes,
+                    prepared.thumbnail_meta,
+                )
+            elif "thumbnail" in prepared.stage_seconds:
+                self.thumbnail_cache.touch(prepared.thumbnail_key)
+            else:
+                # Bytes were reused but quality was recomputed under new settings
+                self.thumbnail_cache.put(
+                    prepared.thumbnail_key, None, prepared.thumbnail_meta
+                )
+        except (OSError, sqlite3.Error) as e:
+            self.logger.warning(f"Could not cache model input for {prepared.path}: {e}")
+        
+    def iter_prepared(
+        self, photos: Iterator[Path]
+    ) -> Iterator[Tuple[Path, Optional[PreparedPhoto]]]:
+        """Run the CPU stage over a photo stream, in order"""
+        worker_config = self.config.get("workers", {})
+        num_workers = worker_config.get("decode_workers", 0)
+        if num_workers <= 1:
+            for photo_path in photos:
+                yield photo_path, self.prepare_photo(photo_path)
+            return
             
-    def process_photo_enhanced(self, photo_path: Path) -> bool:
-        """Process photo with enhanced quality analysis"""
-        print(f"🎯 Processing: {photo_path.name}")
+        # At most queue_depth photos are decoded ahead of the consumer
+        queue_depth = max(
+            num_workers, worker_config.get("queue_depth") or num_workers * 2
+        )
+        pending = deque()
+        executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=_init_prepare_worker,
+            initargs=(self.config, self.decode_budget),
+        )
+        try:
+            for photo_path in photos:
+                pending.append(
+                    (photo_path, executor.submit(_prepare_in_worker, photo_path))
+                )
+                self.metrics.set_gauge("decode", len(pending))
+                if len(pending) >= queue_depth:
+                    yield self._pop_prepared(pending)
+            while pending:
+                yield self._pop_prepared(pending)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            
+    def _pop_prepared(self, pending: deque) -> Tuple[Path, Optional[PreparedPhoto]]:
+        photo_path, future = pending.popleft()
+        try:
+            return photo_path, future.result()
+        except Exception as e:
+            self.logger.error(f"Worker failed on {photo_path}: {e}")
+            return photo_path, None
+        
+    def submit_sidecar(self, prepared: PreparedPhoto, keywords: List[str]):
+        """Queue the sidecar write for prepared; returns a Future[bool]"""
+        if self.should_embed(prepared.path):
+            # The sidecar records what the last run embedded; read it before rewriting
+            prepared.owned_keywords = SidecarWriter.owned_keywords(
+                SidecarWriter.sidecar_path(prepared.path)
+            )
+        return self.sidecar_writer.submit(
+            prepared.path, keywords, prepared.quality_results
+        )
         
-        # Quality analysis
-        quality_results = self.analyze_photo_quality(photo_path)
+    def reject_photo(self, prepared: PreparedPhoto, wait: bool = False) -> bool:
+        """Queue a quality-only sidecar for a photo that failed triage"""
+        keywords = prepared.quality_tags + [REJECTED_TAG]
+        future = self.submit_sidecar(prepared, keywords)
+        if wait:
+            return self.complete_photo(prepared, keywords, future.result())
+        self.pending_writes.append((prepared, keywords, future))
+        self.collect_sidecar_writes()
+        return True
+        
+    def triage_photo(self, prepared: PreparedPhoto):
+        """Record a keeper from a triage-only pass; the next full run tags it"""
+        print(f"👍 {prepared.path.name} kept for tagging")
+        self.triaged_count += 1
+        self.record_photo(prepared, "triaged")
         
-        # Get enhanced keywords
-        keywords = self.get_enhanced_keywords(photo_path)
+    def finish_photo(
+        self,
+        prepared: PreparedPhoto,
+        ai_keywords: Optional[List[str]],
+        wait: bool = False,
+    ) -> bool:
+        """Queue the sidecar write for an inferred photo, recorded once it completes"""
+        photo_path = prepared.path
+        if ai_keywords is None:
+            # Recorded as an error so the next run tries it again
+            print(f"❌ Inference failed: {photo_path.name}")
+            self.error_count += 1
+            self.record_photo(prepared, "error")
+            return False
+        keywords = (
+            self.combine_keywords(ai_keywords, prepared.quality_tags)
+            if ai_keywords
+            else []
+        )
         if not keywords:
-            print("⚠️  No keywords generated")
+            print(f"⚠️  No keywords generated: {photo_path.name}")
             self.skipped_count += 1
+            self.record_photo(prepared, "skipped")
             return False
         
-        # Write enhanced XMP
-        if not self.write_enhanced_xmp(photo_path, keywords, quality_results):
-            print("❌ Failed to write enhanced XMP")
+        future = self.submit_sidecar(prepared, keywords)
+        if wait:
+            # The return value reflects the finished write
+            return self.complete_photo(prepared, keywords, future.result())
+        self.pending_writes.append((prepared, keywords, future))
+        self.collect_sidecar_writes()
+        return True
+        
+    def collect_sidecar_writes(self, wait_all: bool = False):
+        """Record finished sidecar writes in submission order"""
+        while self.pending_writes and (wait_all or self.pending_writes[0][2].done()):
+            prepared, keywords, future = self.pending_writes.popleft()
+            self.complete_photo(prepared, keywords, future.result())
+            
+    def complete_photo(
+        self, prepared: PreparedPhoto, keywords: List[str], written: bool
+    ) -> bool:
+        """Record the outcome of a sidecar write and report it"""
+        photo_path = prepared.path
+        quality_results = prepared.quality_results
+        if not written:
+            print(f"❌ Failed to write enhanced XMP: {photo_path.name}")
             self.error_count += 1
+            self.record_photo(prepared, "error")
             return False
         
+        if self.should_embed(photo_path):
+            self.embed_queue.append((prepared, keywords))
+            if len(self.embed_queue) >= self.config.get("embedding", {}).get(
+                "batch_size", 32
+            ):
+                self.flush_embeds()
+        
+        if self.keyword_index:
+            self.keyword_index.add(str(photo_path), keywords, quality_results)
+        
+        if prepared.reject_reasons:
+            print(
+                f"🗑️  {photo_path.name} rejected: {', '.join(prepared.reject_reasons)}"
+            )
+            self.rejected_count += 1
+            self.record_photo(prepared, "rejected")
+            return True
+        
         # Display results
         ai_keywords = [k for k in keywords if not k.startswith(('quality:', 'exposure:'))]
         quality_tags = [k for k in keywords if k.startswith(('quality:', 'exposure:', 'stage_', 'motion_', 'crowd', 'low_light'))]
         
-        print(f"✅ AI Tags: {', '.join(ai_keywords[:3])}{'...' if len(ai_keywords) > 3 else ''}")
+        print(
+            f"✅ {photo_path.name} AI Tags: "
+            f"{', '.join(ai_keywords[:3])}{'...' if len(ai_keywords) > 3 else ''}"
+        )
         if quality_tags:
             print(f"🔍 Quality: {', '.join(quality_tags)}")
         
@@ -575,9 +4401,684 @@ class EnhancedPhotoTagger:
             print(f"⚠️  Exposure: {quality_results['histogram']['quality']}")
         
         self.processed_count += 1
-        self.progress["processed_files"].add(str(photo_path))
+        self.record_photo(prepared, "processed")
         return True
         
+    def record_photo(self, prepared: PreparedPhoto, status: str):
+        """Queue a per-file progress record for the next checkpoint"""
+        self.progress_store.record(
+            str(prepared.path), status,
+            size=prepared.file_size, mtime=prepared.file_mtime,
+            prepare_seconds=prepared.prepare_seconds,
+            inference_seconds=prepared.inference_seconds,
+            quality_results=prepared.quality_results,
+        )
+        
+    def infer_prepared(self, prepared: PreparedPhoto) -> Optional[List[str]]:
+        """Inference for a prepared photo via the keyword cache; None if it failed"""
+        started = time.perf_counter()
+        try:
+            return self._infer_prepared(prepared)
+        finally:
+            prepared.inference_seconds = time.perf_counter() - started
+            
+    def keyword_cache_key(
+        self, prepared: PreparedPhoto, prompt: Optional[str] = None
+    ) -> Optional[str]:
+        """Cache key for prepared's answer to prompt (default ``ai_prompt``)"""
+        if not self.keyword_cache or not prepared.content_hash:
+            return None
+        return self.keyword_cache.make_key(
+            prepared.content_hash, self.config["ollama_model"],
+            prompt or self.config["ai_prompt"], self.config["max_image_size"],
+        )
+        
+    def _infer_prepared(
+        self, prepared: PreparedPhoto, lookup: bool = True
+    ) -> Optional[List[str]]:
+        cache_key = self.keyword_cache_key(prepared)
+        if cache_key and lookup:
+            cached = self.keyword_cache.get(cache_key)
+            if cached is not None:
+                return cached["keywords"]
+        try:
+            started = time.perf_counter()
+            keywords_raw = self.request_ai_response(prepared.image_bytes)
+            self.metrics.observe("inference", time.perf_counter() - started)
+            keywords = self.parse_keywords(keywords_raw)
+            if cache_key and keywords:
+                self.keyword_cache.put(cache_key, keywords_raw, keywords)
+            return keywords
+        except Exception as e:
+            self.logger.warning(f"Inference failed for {prepared.path}: {e}")
+            return None
+        
+    def infer_batch(self, batch: List[PreparedPhoto]) -> List[Optional[List[str]]]:
+        """Inference for several photos in one model request; None where it failed"""
+        if len(batch) == 1:
+            return [self.infer_prepared(batch[0])]
+        started = time.perf_counter()
+        results = [None] * len(batch)
+        # Answers to either prompt are served; batched ones are stored under its key
+        batch_keys = [
+            self.keyword_cache_key(prepared, self.config["ai_batch_prompt"])
+            for prepared in batch
+        ]
+        for i, prepared in enumerate(batch):
+            if batch_keys[i]:
+                cached = self.keyword_cache.get(
+                    self.keyword_cache_key(prepared), batch_keys[i]
+                )
+                if cached is not None:
+                    results[i] = cached["keywords"]
+        pending = [i for i, keywords in enumerate(results) if keywords is None]
+        
+        # Uncached photos go out as one multi-image request; while the circuit is
+        # open they all come back None
+        if len(pending) > 1:
+            try:
+                request_started = time.perf_counter()
+                raw = self.request_ai_batch_response(
+                    [batch[i].image_bytes for i in pending]
+                )
+                self.metrics.observe("inference", time.perf_counter() - request_started)
+                answers = self.batch_answers(raw, len(pending))
+            except InferenceUnavailable as e:
+                self.logger.warning(
+                    f"Batched request for {len(pending)} photos not sent: {e}"
+                )
+                return results
+            except Exception as e:
+                self.logger.warning(
+                    f"Batched request for {len(pending)} photos failed, retrying "
+                    f"singly: {e}"
+                )
+                answers = [None] * len(pending)
+            for i, answer in zip(pending, answers):
+                if answer:
+                    response, results[i] = answer
+                    if batch_keys[i]:
+                        # Its own part of the batched answer stands in for a response
+                        self.keyword_cache.put(batch_keys[i], response, results[i])
+                        
+        # Answers missing from the batch fall back to single-image requests
+        for i, prepared in enumerate(batch):
+            if results[i] is None:
+                self.metrics.increment("batch_fallbacks")
+                results[i] = self._infer_prepared(prepared, lookup=False)
+            prepared.inference_seconds = time.perf_counter() - started
+        return results
+        
+    def request_ai_batch_response(self, images: List[bytes]) -> str:
+        """Raw JSON answer for several images in one request; raises on errors"""
+        import base64
+        options = dict(
+            MODEL_OPTIONS, num_predict=MODEL_OPTIONS["num_predict"] * len(images) + 32
+        )
+        response = self.inference_pool.chat(
+            model=self.config["ollama_model"],
+            messages=[{
+                'role': 'user',
+                'content': self.config["ai_batch_prompt"].format(count=len(images)),
+                'images': [base64.b64encode(image).decode('utf-8') for image in images]
+            }],
+            format='json',
+            options=options
+        )
+        return response['message']['content']
+        
+    @classmethod
+    def parse_batch_keywords(cls, raw: str, count: int) -> List[Optional[List[str]]]:
+        """Per-image keyword lists from a batched answer, None where missing"""
+        return [
+            answer[1] if answer else None for answer in cls.batch_answers(raw, count)
+        ]
+        
+    @classmethod
+    def batch_answers(
+        cls, raw: str, count: int
+    ) -> List[Optional[Tuple[str, List[str]]]]:
+        """Per image (its part of the batched answer as JSON, keywords) or None"""
+        results = [None] * count
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            # Ignore text around the JSON
+            starts = [i for i in (raw.find('{'), raw.find('[')) if i >= 0]
+            if not starts:
+                return results
+            start = min(starts)
+            end = raw.rfind('}' if raw[start] == '{' else ']')
+            try:
+                data = json.loads(raw[start:end + 1])
+            except ValueError:
+                return results
+                
+        # {"images": [{"index": n, "keywords": [...]}, ...]}, a bare list of those
+        # or of keyword lists, or an object keyed by image number; keywords may be
+        # lists or comma-separated strings
+        if isinstance(data, dict):
+            nested = next((v for v in data.values() if isinstance(v, list)), None)
+            if nested is not None and len(data) == 1:
+                data = [(entry, entry) for entry in nested]
+            else:
+                # {"1": [...], "image_2": "..."}
+                keyed = []
+                for key, value in data.items():
+                    digits = "".join(c for c in str(key) if c.isdigit())
+                    if digits:
+                        keyed.append(
+                            ({key: value}, {"index": int(digits), "keywords": value})
+                        )
+                data = keyed
+        elif isinstance(data, list):
+            data = [(entry, entry) for entry in data]
+        else:
+            return results
+            
+        for position, (answer, entry) in enumerate(data):
+            index = position + 1
+            keywords = entry
+            if isinstance(entry, dict):
+                number = entry.get("index", entry.get("image"))
+                if isinstance(number, str) and number.strip().isdigit():
+                    number = int(number)
+                if isinstance(number, int):
+                    index = number
+                keywords = entry.get("keywords", entry.get("tags"))
+            if isinstance(keywords, list):
+                keywords = ", ".join(
+                    str(k) for k in keywords if isinstance(k, (str, int, float))
+                )
+            if not isinstance(keywords, str) or not 1 <= index <= count:
+                continue
+            parsed = cls.parse_keywords(keywords)
+            if parsed and results[index - 1] is None:
+                results[index - 1] = (json.dumps(answer, ensure_ascii=False), parsed)
+        return results
+        
+    def process_photo_enhanced(self, photo_path: Path) -> bool:
+        """Process photo with enhanced quality analysis"""
+        prepared = self.prepare_photo(photo_path)
+        if not self.accept_prepared(photo_path, prepared):
+            return False
+        if prepared.reject_reasons:
+            return self.reject_photo(prepared, wait=True)
+        if self.config.get("triage", {}).get("triage_only", False):
+            self.triage_photo(prepared)
+            return True
+        self.inference_pool.wait_until_available()
+        return self.finish_photo(prepared, self.infer_prepared(prepared), wait=True)
+        
+    def has_current_sidecar(self, photo_path: Path, sidecar_names: set) -> bool:
+        """Whether the photo already has an .xmp sidecar at least as new as itself"""
+        sidecar_name = photo_path.name + '.xmp'
+        if sidecar_name not in sidecar_names:
+            return False
+        try:
+            sidecar_mtime = os.stat(photo_path.with_name(sidecar_name)).st_mtime
+            return sidecar_mtime >= os.stat(photo_path).st_mtime
+        except OSError:
+            return False
+        
+    def iter_photos(self, folder: Path) -> Iterator[Path]:
+        """Stream photos under folder that still need processing"""
+        supported_formats = self.config["supported_formats"]
+        pending_dirs = [folder]
+        
+        # Walked lazily, one directory listing in memory at a time
+        while pending_dirs:
+            directory = pending_dirs.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = list(it)
+            except OSError as e:
+                self.logger.warning(f"Cannot scan {directory}: {e}")
+                continue
+                
+            sidecar_names = {e.name for e in entries if e.name.lower().endswith('.xmp')}
+            subdirs = []
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in supported_formats:
+                    continue
+                if not self.progress_store.needs_processing(entry.path):
+                    continue
+                photo_path = Path(entry.path)
+                if self.has_current_sidecar(photo_path, sidecar_names):
+                    self.skipped_count += 1
+                    continue
+                yield photo_path
+                
+            # Depth-first, alphabetical order
+            pending_dirs.extend(reversed(subdirs))
+            
+    def iter_leased(self, folder: Path) -> Iterator[Path]:
+        """Stream photos from chunks leased off the shared work queue"""
+        queue = self.work_queue
+        chunk_size = max(1, self.config["cluster"].get("chunk_size", 50))
+        walker = None
+        while True:
+            if walker is None and queue.claim_seeding():
+                print(f"🌱 Seeding the work queue from {folder}")
+                walker = self.iter_photos(folder)
+            if walker is not None:
+                # Two chunks per live node ahead; others start before the walk ends
+                target = 2 * queue.live_nodes()
+                while walker is not None and queue.unleased() < target:
+                    chunk = [str(path) for path in itertools.islice(walker, chunk_size)]
+                    if chunk:
+                        queue.add_chunk(chunk)
+                    else:
+                        queue.finish_seeding()
+                        walker = None
+                        
+            leased = queue.lease()
+            if leased is None:
+                if walker is not None:
+                    continue
+                # Finish and commit our own chunks before waiting on anyone else's
+                if queue.holding() or not queue.waiting_on_others():
+                    return
+                time.sleep(min(1.0, queue.lease_seconds / 10))
+                continue
+                
+            # Another node may have finished some of these before its lease expired
+            chunk_id, paths = leased
+            pending = []
+            for path in paths:
+                photo_path = Path(path)
+                if not self.progress_store.needs_processing(path):
+                    continue
+                if self.has_current_sidecar(photo_path, {photo_path.name + '.xmp'}):
+                    self.skipped_count += 1
+                    continue
+                pending.append(path)
+            queue.expect(chunk_id, pending)
+            for path in pending:
+                yield Path(path)
+                
+    def run(self, folder: Optional[Path] = None):
+        """Process every pending photo under folder"""
+        import heapq
+        folder = Path(folder or self.config["pictures_folder"])
+        endpoints = (
+            self.inference_pool.endpoints if self.inference_pool is not None else []
+        )
+        # Decode and analysis stay on this thread; requests run on a per-endpoint pool
+        max_in_flight = max(
+            1, self.config.get("inference", {}).get("max_in_flight", 2)
+        ) * max(1, len(endpoints))
+        batch_images = max(1, self.config.get("inference", {}).get("batch_images", 1))
+        batch_size = max(1, self.config.get("batch_size", 5))
+        requeue_attempts = max(
+            0, self.config.get("inference", {}).get("requeue_attempts", 3)
+        )
+        print(f"📂 Scanning: {folder}")
+        
+        in_flight = {}
+        request_batch = []
+        # heap of (due, sequence, prepared, group) for requests that failed after the
+        # pool's own retries
+        requeued = []
+        sequence = itertools.count()
+        completed = 0
+        
+        def finish(prepared: PreparedPhoto, ai_keywords: Optional[List[str]]):
+            nonlocal completed
+            try:
+                if prepared.reject_reasons:
+                    self.reject_photo(prepared)
+                else:
+                    self.finish_photo(prepared, ai_keywords)
+            except Exception as e:
+                self.logger.error(f"Unexpected error processing {prepared.path}: {e}")
+                self.error_count += 1
+            completed += 1
+            self.metrics.set_gauge("inference", len(in_flight))
+            if len(endpoints) > 1:
+                for endpoint in endpoints:
+                    self.metrics.set_gauge(
+                        f"inference@{endpoint.host}", endpoint.outstanding
+                    )
+            self.metrics.set_gauge("sidecar", len(self.pending_writes))
+            self.metrics.set_gauge("embed", len(self.embed_queue))
+            # Checkpoint every batch so an interrupted run resumes here
+            if completed % batch_size == 0:
+                self.save_progress()
+            if completed % (batch_size * 10) == 0:
+                self.print_enhanced_status()
+            self.export_metrics()
+        
+        def requeue(prepared: PreparedPhoto, group: Optional[BurstGroup]):
+            prepared.attempts += 1
+            self.requeued_count += 1
+            self.metrics.increment("requeued")
+            due = time.time() + self.inference_pool.backoff(prepared.attempts)
+            heapq.heappush(requeued, (due, next(sequence), prepared, group))
+            
+        def resubmit_due():
+            # Requeued photos go back out once their backoff has passed
+            now = time.time()
+            while requeued and requeued[0][0] <= now:
+                _, _, prepared, group = heapq.heappop(requeued)
+                request_batch.append((prepared, group))
+                if len(request_batch) >= batch_images:
+                    submit()
+                    
+        def drain(block_until: int):
+            # Finish photos until at most block_until requests remain in flight
+            while len(in_flight) > block_until:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    entries = in_flight.pop(future)
+                    for (prepared, group), ai_keywords in zip(entries, future.result()):
+                        if ai_keywords is None and prepared.attempts < requeue_attempts:
+                            print(
+                                "🔁 Requeued after a failed request: "
+                                f"{prepared.path.name}"
+                            )
+                            requeue(prepared, group)
+                            continue
+                        finish(prepared, ai_keywords)
+                        if group is None:
+                            continue
+                        for follower in group.resolve(ai_keywords):
+                            if ai_keywords is None:
+                                # Nothing to reuse: each follower gets a request
+                                requeue(follower, None)
+                            else:
+                                finish(follower, ai_keywords)
+                                
+        def submit():
+            # Backpressure: wait for a free inference slot, so the server stays
+            # busy without fixed delays
+            drain(max_in_flight - 1)
+            if warm_up.is_alive():
+                warm_up.join()
+            # Circuit breaker: hold requests while every endpoint is unhealthy
+            self.inference_pool.wait_until_available()
+            future = executor.submit(
+                self.infer_batch, [prepared for prepared, _ in request_batch]
+            )
+            in_flight[future] = list(request_batch)
+            request_batch.clear()
+        
+        executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="inference"
+        )
+        # Load the model while the first photos decode instead of on the first request
+        warm_up = threading.Thread(
+            target=self.warm_up_model, name="ollama-warm-up", daemon=True
+        )
+        if self.inference_pool is not None:
+            warm_up.start()
+            self.inference_pool.start_health_checks()
+        if self.work_queue is not None:
+            # As a cluster node, photos come from chunks leased off the shared queue
+            self.work_queue.start_heartbeat(self.node_stats)
+            photos = self.iter_leased(folder)
+        else:
+            photos = self.iter_photos(folder)
+        try:
+            while photos is not None:
+                for photo_path, prepared in self.iter_prepared(photos):
+                    resubmit_due()
+                    if not self.accept_prepared(photo_path, prepared):
+                        continue
+                    if prepared.reject_reasons:
+                        finish(prepared, None)
+                        continue
+                    if self.config.get("triage", {}).get("triage_only", False):
+                        self.triage_photo(prepared)
+                        continue
+                    
+                    # Near-duplicates of a frame tagged or in flight reuse its keywords
+                    group = None
+                    if self.burst_index is not None and prepared.phash is not None:
+                        group = self.burst_index.find(prepared.phash)
+                        if group is not None and not group.failed:
+                            self.burst_reused += 1
+                            if group.keywords is not None:
+                                finish(prepared, group.keywords)
+                            else:
+                                group.followers.append(prepared)
+                            continue
+                        group = BurstGroup()
+                        self.burst_index.add(prepared.phash, group)
+                    
+                    request_batch.append((prepared, group))
+                    if len(request_batch) >= batch_images:
+                        submit()
+                while request_batch or in_flight or requeued:
+                    if request_batch:
+                        submit()
+                    elif in_flight:
+                        drain(len(in_flight) - 1)
+                    else:
+                        time.sleep(max(0.0, requeued[0][0] - time.time()))
+                    resubmit_due()
+                photos = None
+                if self.work_queue is not None:
+                    # Commit so our chunks count as done, then wait for handed-back work
+                    self.save_progress()
+                    if self.work_queue.waiting_on_others():
+                        photos = self.iter_leased(folder)
+        except KeyboardInterrupt:
+            print()
+            print("⏹️  Interrupted - saving progress")
+            for future in in_flight:
+                future.cancel()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if self.inference_pool is not None:
+                self.release_model()
+                self.inference_pool.close()
+            self.save_progress()
+            if self.analysis_store is not None:
+                self.analysis_store.close()
+            if self.work_queue is not None:
+                self.work_queue.close(self.node_stats())
+            self.sidecar_writer.close()
+            if self.exiftool:
+                self.exiftool.close()
+            self.export_metrics(force=True)
+            self.print_enhanced_status()
+        
+    def warm_up_model(self):
+        """Load the model on every endpoint and pin it for ``inference.keep_alive``"""
+        started = time.perf_counter()
+        loaded = self.inference_pool.load()
+        if loaded:
+            print(
+                f"🔥 {self.config['ollama_model']} loaded on "
+                f"{loaded}/{len(self.inference_pool.endpoints)} "
+                f"endpoints in {time.perf_counter() - started:.1f}s"
+            )
+                  
+    def release_model(self):
+        """Hand the model back to Ollama's usual unloading once the run is over"""
+        keep_alive = self.config.get("inference", {}).get("keep_alive_after")
+        if keep_alive is not None:
+            self.inference_pool.unpin(keep_alive)
+                
+    def watch(self, folder: Optional[Path] = None):
+        """Tag photos as they land under folder until interrupted"""
+        import heapq
+        folder = Path(folder or self.config["pictures_folder"])
+        watch_config = self.config.get("watch", {})
+        settle_seconds = watch_config.get("settle_seconds", 1.0)
+        requeue_attempts = max(
+            0, self.config.get("inference", {}).get("requeue_attempts", 3)
+        )
+        supported_formats = self.config["supported_formats"]
+        watcher = FolderWatcher(
+            folder, supported_formats,
+            poll_interval=watch_config.get("poll_interval", 2.0),
+            use_inotify=watch_config.get("use_inotify", True),
+        )
+        print(f"👀 Watching: {folder} ({watcher.backend})")
+        if self.inference_pool is not None:
+            self.warm_up_model()
+        
+        backlog = (
+            self.iter_photos(folder)
+            if watch_config.get("process_backlog", True)
+            else None
+        )
+        settling = {}  # path -> [arrived, size, mtime, unchanged since]
+        # heap of (-arrived, path, arrived): newest first, ahead of the backlog
+        ready = []
+        # heap of (due, sequence, prepared, arrived) for photos whose request failed
+        retry = []
+        sequence = itertools.count()
+        done = set()
+        dirty = False
+        holding = False  # Whether an outage is holding photos back
+        
+        def tagged(photo_path: Path, arrived: Optional[float]):
+            if arrived is not None:
+                latency = time.time() - arrived
+                self.metrics.observe("ingest", latency)  # Arrival to sidecar
+                print(f"⏱️  {photo_path.name} tagged {latency:.1f}s after arrival")
+                
+        def retry_later(prepared: PreparedPhoto, arrived: Optional[float]):
+            due = time.time() + self.inference_pool.backoff(max(1, prepared.attempts))
+            heapq.heappush(retry, (due, next(sequence), prepared, arrived))
+            
+        def infer(prepared: PreparedPhoto, arrived: Optional[float]):
+            nonlocal holding
+            try:
+                # Circuit breaker: hold requests while every endpoint is unhealthy
+                self.inference_pool.wait_until_available()
+            except InferenceUnavailable as e:
+                # Keep watching through the outage; the photo is retried without losing
+                # an attempt
+                if not holding:
+                    self.logger.warning(
+                        f"{e} - holding photos until an endpoint answers"
+                    )
+                    holding = True
+                retry_later(prepared, arrived)
+                return
+            ai_keywords = self.infer_prepared(prepared)
+            if ai_keywords is not None:
+                holding = False
+            if ai_keywords is None and prepared.attempts < requeue_attempts:
+                print(f"🔁 Requeued after a failed request: {prepared.path.name}")
+                prepared.attempts += 1
+                self.requeued_count += 1
+                self.metrics.increment("requeued")
+                retry_later(prepared, arrived)
+                return
+            if self.finish_photo(prepared, ai_keywords, wait=True):
+                tagged(prepared.path, arrived)
+            elif ai_keywords is None:
+                # Out of attempts: a later change to the file may try it again
+                done.discard(str(prepared.path))
+                
+        def tag(photo_path: Path, arrived: Optional[float] = None):
+            prepared = self.prepare_photo(photo_path)
+            if not self.accept_prepared(photo_path, prepared):
+                return
+            if prepared.reject_reasons:
+                if self.reject_photo(prepared, wait=True):
+                    tagged(photo_path, arrived)
+            elif self.config.get("triage", {}).get("triage_only", False):
+                self.triage_photo(prepared)
+                tagged(photo_path, arrived)
+            else:
+                infer(prepared, arrived)
+                
+        try:
+            while True:
+                now = time.time()
+                # While failed photos wait out an open circuit, don't start new ones
+                blocked = bool(retry) and self.inference_pool.circuit_open()
+                busy = (bool(ready) or backlog is not None) and not blocked
+                timeout = (
+                    0.0 if busy else (min(0.25, settle_seconds) if settling else 1.0)
+                )
+                if retry:
+                    timeout = max(0.0, min(timeout, retry[0][0] - now))
+                for path in watcher.changes(timeout):
+                    # Ignore our own writes (e.g. DNG embeds) to photos already tagged
+                    if str(path) not in done:
+                        settling.setdefault(path, [now, None, None, now])
+                        
+                # Hold files until writers are finished with them
+                now = time.time()
+                for path, state in list(settling.items()):
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        del settling[path]
+                        continue
+                    if (stat.st_size, stat.st_mtime) != (state[1], state[2]):
+                        state[1:] = [stat.st_size, stat.st_mtime, now]
+                    elif now - state[3] >= settle_seconds:
+                        heapq.heappush(ready, (-state[0], str(path), state[0]))
+                        del settling[path]
+                        
+                if retry and retry[0][0] <= time.time():
+                    _, _, prepared, arrived = heapq.heappop(retry)
+                    infer(prepared, arrived)
+                    dirty = True
+                elif ready and not blocked:
+                    _, path, arrived = heapq.heappop(ready)
+                    done.add(path)
+                    tag(Path(path), arrived)
+                    dirty = True
+                elif backlog is not None and not blocked:
+                    photo_path = next(backlog, None)
+                    if photo_path is None:
+                        backlog = None
+                    elif str(photo_path) not in done:
+                        try:
+                            still_writing = (
+                                time.time() - os.stat(photo_path).st_mtime
+                                < settle_seconds
+                            )
+                        except OSError:
+                            continue
+                        if still_writing:
+                            settling.setdefault(
+                                photo_path, [time.time(), None, None, time.time()]
+                            )
+                        else:
+                            done.add(str(photo_path))
+                            tag(photo_path)
+                            dirty = True
+                elif dirty and not settling:
+                    # Idle: checkpoint and flush embeds while nothing is waiting
+                    self.save_progress()
+                    self.export_metrics()
+                    dirty = False
+        except KeyboardInterrupt:
+            print()
+            print("⏹️  Stopped watching - saving progress")
+        finally:
+            watcher.close()
+            if self.inference_pool is not None:
+                self.release_model()
+            self.save_progress()
+            if self.analysis_store is not None:
+                self.analysis_store.close()
+            self.sidecar_writer.close()
+            if self.exiftool:
+                self.exiftool.close()
+            self.export_metrics(force=True)
+            self.print_enhanced_status()
+            
     def print_enhanced_status(self):
         """Print enhanced processing status"""
         elapsed = datetime.now() - self.start_time
@@ -592,10 +5093,351 @@ class EnhancedPhotoTagger:
         print(f"🔍 Quality Issues Detected ................. {self.quality_issues:,}")
         print(f"⚠️  Files Skipped .......................... {self.skipped_count:,}")
         print(f"❌ Processing Errors ....................... {self.error_count:,}")
+        if self.embed_failed_count:
+            print(
+                "⚠️  Embedding Failed ....................... "
+                f"{self.embed_failed_count:,}"
+            )
+        if self.config.get("triage", {}).get("enabled", False):
+            print(
+                f"🗑️  Rejected by Triage ..................... {self.rejected_count:,}"
+            )
+            if self.config["triage"].get("triage_only", False):
+                print(
+                    "👍 Kept for Tagging ........................ "
+                    f"{self.triaged_count:,}"
+                )
+        if self.burst_index is not None:
+            print(f"📸 Burst Frames Reusing Tags .............. {self.burst_reused:,}")
+        if self.requeued_count:
+            print(
+                f"🔁 Requeued After Failed Requests .......... {self.requeued_count:,}"
+            )
+        if self.keyword_cache:
+            print(
+                "♻️  Keyword Cache Hits ...................... "
+                f"{self.keyword_cache.hits:,}"
+            )
+        if self.thumbnail_cache is not None:
+            print(
+                f"🖼️  Thumbnail Cache Hits .................... {self.thumbnail_hits:,}"
+            )
+        endpoints = (
+            self.inference_pool.endpoints if self.inference_pool is not None else []
+        )
+        if len(endpoints) > 1:
+            now = time.time()
+            for endpoint in endpoints:
+                state = (
+                    "ok"
+                    if endpoint.healthy(now)
+                    else ("no model" if not endpoint.has_model else "ejected")
+                )
+                print(
+                    f"🌐 {endpoint.host} ... {endpoint.completed:,} done, "
+                    f"{endpoint.errors:,} errors ({state})"
+                )
+        if self.work_queue is not None:
+            queue = self.work_queue
+            print(
+                f"🧩 Node {queue.node} ... {queue.completed:,} chunks done, "
+                f"{queue.reclaimed:,} reclaimed"
+            )
         print(f"⚡ Current Rate ............................ {rate:.1f} photos/hour")
         print(f"🕒 Elapsed Time ............................ {str(elapsed).split('.')[0]}")
+        stages = self.metrics.snapshot()["stages"]
+        if stages:
+            print("-" * 70)
+            for stage, stats in stages.items():
+                print(
+                    f"⏱️  {stage:<10} p50 {stats['p50'] * 1000:8.1f} ms   "
+                    f"p95 {stats['p95'] * 1000:8.1f} ms   "
+                    f"p99 {stats['p99'] * 1000:8.1f} ms"
+                )
         print("=" * 70)
 
+# Per-process tagger used by decode/analysis workers
+_worker_tagger = None
+
+def _init_prepare_worker(config: Dict, decode_budget: Optional[DecodeBudget] = None):
+    global _worker_tagger
+    _worker_tagger = EnhancedPhotoTagger.for_worker(config, decode_budget)
+
+def _prepare_in_worker(photo_path: Path) -> Optional[PreparedPhoto]:
+    prepared = _worker_tagger.prepare_photo(photo_path)
+    if prepared is not None and isinstance(prepared.image_bytes, memoryview):
+        # Cache hits are views into a worker-local mmap; only bytes cross the pipe
+        prepared.image_bytes = prepared.image_bytes.tobytes()
+    return prepared
+
+def search_index(
+    config: Dict, query: str, limit: Optional[int] = None, count_only: bool = False
+):
+    """Print photos matching query, one path per line"""
+    index_path = keyword_index_path(config)
+    if not index_path.exists():
+        print(
+            f"❌ No keyword index at {index_path} - "
+            "run a tagging pass or 'reindex' first",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    index = KeywordIndex(index_path, shared=is_cluster(config))
+    try:
+        started = time.perf_counter()
+        if count_only:
+            print(index.count(query))
+        else:
+            paths = index.search(query, limit)
+            for path in paths:
+                print(path)
+        elapsed = (time.perf_counter() - started) * 1000
+        if not count_only:
+            print(f"🔎 {len(paths):,} matches in {elapsed:.1f} ms", file=sys.stderr)
+    except IndexQueryError as e:
+        print(f"❌ Invalid query: {e}", file=sys.stderr)
+        sys.exit(2)
+    finally:
+        index.close()
+
+def rebuild_index(config: Dict, workers: int = 0):
+    """Rebuild the keyword index from every sidecar under pictures_folder"""
+    index_path = keyword_index_path(config)
+    print(
+        f"📚 Rebuilding {index_path.name} from sidecars in {config['pictures_folder']}"
+    )
+    started = time.perf_counter()
+    index = KeywordIndex(index_path, shared=is_cluster(config))
+    try:
+        indexed = index.rebuild(config["pictures_folder"], workers)
+    finally:
+        index.close()
+    print(f"✅ Indexed {indexed:,} sidecars in {time.perf_counter() - started:.1f}s")
+
+def print_cluster_status(config: Dict):
+    """Print work queue progress and each node's latest published stats"""
+    path = queue_path(config)
+    if not path.exists():
+        print(
+            f"❌ No work queue at {path} - start a node with --cluster first",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    status = WorkQueue.stats(path)
+    now = time.time()
+    print("=" * 70)
+    print(
+        "🧩 Chunks Done ............................. "
+        f"{status['chunks_done']:,} / {status['chunks']:,}"
+    )
+    print(f"📸 Photos Queued ........................... {status['photos']:,}")
+    print(
+        "🌱 Seeding ................................. "
+        f"{'complete' if status['seeded'] else 'in progress'}"
+    )
+    print("-" * 70)
+    for node in status["nodes"]:
+        age = now - (node["heartbeat"] or 0)
+        elapsed = node.get("elapsed") or 0
+        rate = node.get("processed", 0) / (elapsed / 3600) if elapsed else 0
+        print(
+            f"🖥️  {node['node']} ({node['host']}, pid {node['pid']}) heartbeat "
+            f"{age:.0f}s ago"
+        )
+        print(
+            f"    {node.get('processed', 0):,} processed, "
+            f"{node.get('errors', 0):,} errors, "
+            f"{node.get('chunks_done', 0):,} chunks, "
+            f"{node.get('chunks_reclaimed', 0):,} reclaimed, "
+            f"{rate:.1f} photos/hour"
+        )
+    print("=" * 70)
+
+REPORT_FIELDS = (
+    "path",
+    "analyzed",
+    "blur_score",
+    "blur",
+    "underexposed",
+    "overexposed",
+    "spread",
+    "exposure",
+    "brightness",
+    "contrast",
+    "x_var",
+    "y_var",
+    "texture",
+    "motion_blur",
+    "stage_lighting",
+    "crowd",
+    "low_light",
+    "tags",
+    "changed",
+    "preview",
+)
+
+def _class_names(names: Tuple[str, ...], classes: np.ndarray) -> List[Optional[str]]:
+    table = np.array(list(names) + [None] * (256 - len(names)), dtype=object)
+    return table[classes].tolist()
+
+def _per_distinct(keys: np.ndarray, function) -> List:
+    """function(key) for every key, calling it once per distinct key"""
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    table = np.empty(len(distinct), dtype=object)
+    for i, key in enumerate(distinct.tolist()):
+        table[i] = function(key)
+    return table[inverse].tolist()
+
+def _values(values: np.ndarray, missing: np.ndarray, text: bool) -> List:
+    """Column as Python values with None where missing, or as CSV text"""
+    if text and values.dtype.kind == "f":
+        return [
+            "" if absent else f"{value:.7g}"
+            for value, absent in zip(values.tolist(), missing.tolist())
+        ]
+    values = values.astype(object)
+    values[missing] = "" if text else None
+    return values.tolist()
+
+def _report_rows(
+    columns: Dict[str, np.ndarray],
+    classes: Dict[str, np.ndarray],
+    changed: np.ndarray,
+    changed_only: bool,
+    text: bool,
+) -> Iterator[Tuple]:
+    rows = np.flatnonzero(changed) if changed_only else np.arange(len(changed))
+    selected = {
+        name: column[rows]
+        for name, column in columns.items()
+        if name not in ("path_blob", "path_ends")
+    }
+    new = {name: column[rows] for name, column in classes.items()}
+    concert_missing = np.isnan(selected["brightness"])
+    fields = [
+        AnalysisStore.paths(columns, rows),
+        _per_distinct(
+            selected["analyzed"].astype(np.int64),
+            lambda t: datetime.fromtimestamp(t).isoformat(),
+        ),
+        _values(selected["blur_score"], np.isnan(selected["blur_score"]), text),
+        _class_names(QualityAnalyzer.BLUR_LEVELS, new["blur_class"]),
+    ]
+    for name in ("underexposed", "overexposed", "spread"):
+        fields.append(_values(selected[name], np.isnan(selected[name]), text))
+    fields.append(_class_names(QualityAnalyzer.EXPOSURE_CLASSES, new["exposure_class"]))
+    for name in ("brightness", "contrast", "x_var", "y_var", "texture"):
+        fields.append(_values(selected[name], np.isnan(selected[name]), text))
+    fields.append(_class_names(QualityAnalyzer.MOTION_CLASSES, new["motion_class"]))
+    for bit in (
+        AnalysisStore.STAGE_LIGHTING,
+        AnalysisStore.CROWD,
+        AnalysisStore.LOW_LIGHT,
+    ):
+        fields.append(_values(new["flags"] & bit > 0, concert_missing, text))
+    # Few class combinations occur, so tags are built once per combination
+    combinations = (
+        new["blur_class"].astype(np.int32) << 24
+        | new["exposure_class"].astype(np.int32) << 16
+        | new["motion_class"].astype(np.int32) << 8
+        | new["flags"]
+    )
+    
+    def tags(key: int):
+        tags = AnalysisStore.quality_tags(
+            key >> 24, key >> 16 & 255, key >> 8 & 255, key & 255
+        )
+        return ", ".join(tags) if text else tags
+        
+    fields.append(_per_distinct(combinations, tags))
+    fields.append(changed[rows].tolist())
+    preview = np.logical_or.reduce(
+        [
+            AnalysisStore.on_preview(selected, level)
+            for level in ("blur_px", "histogram_px", "concert_px")
+        ]
+    )
+    fields.append(preview.tolist())
+    return zip(*fields)
+
+def _report_summary(columns: Dict[str, np.ndarray], classes: Dict[str, np.ndarray],
+                    changed: np.ndarray) -> Iterator[Tuple]:
+    for metric, column, names in (
+        ("blur", "blur_class", QualityAnalyzer.BLUR_LEVELS),
+        ("exposure", "exposure_class", QualityAnalyzer.EXPOSURE_CLASSES),
+        ("motion_blur", "motion_class", QualityAnalyzer.MOTION_CLASSES),
+    ):
+        now = np.bincount(classes[column], minlength=256)
+        analyzed = np.bincount(columns[column], minlength=256)
+        for i, name in enumerate(names):
+            yield metric, name, int(now[i]), int(analyzed[i])
+    for name, bit in (
+        ("stage_lighting", AnalysisStore.STAGE_LIGHTING),
+        ("crowd", AnalysisStore.CROWD),
+        ("low_light", AnalysisStore.LOW_LIGHT),
+    ):
+        yield "concert", name, int(np.count_nonzero(classes["flags"] & bit)), int(
+            np.count_nonzero(columns["flags"] & bit)
+        )
+    yield "tags", "changed", int(np.count_nonzero(changed)), None
+
+def write_report(
+    config: Dict,
+    fmt: str = "csv",
+    output: Optional[str] = None,
+    changed_only: bool = False,
+    summary: bool = False,
+):
+    """Re-classify stored quality metrics under the current thresholds, streamed"""
+    import csv
+    folder = analysis_store_path(config)
+    if not folder.exists():
+        print(
+            f"❌ No analysis store at {folder} - run a tagging pass with quality "
+            "analysis first",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    # Only the analysis store is read, so no photo is decoded again
+    started = time.perf_counter()
+    columns = AnalysisStore.load(folder)
+    classes = AnalysisStore.classify(columns, QualityAnalyzer(config))
+    changed = AnalysisStore.tag_changes(columns, classes)
+    # Summary: per-class counts now and as analyzed; otherwise one row per
+    # photo, flagged where its tags changed
+    if summary:
+        fields, records = ("metric", "class", "count", "analyzed"), _report_summary(
+            columns, classes, changed
+        )
+    else:
+        fields, records = REPORT_FIELDS, _report_rows(
+            columns, classes, changed, changed_only, text=fmt == "csv"
+        )
+        
+    out = open(output, "w", newline="", encoding="utf-8") if output else sys.stdout
+    try:
+        if fmt == "jsonl":
+            for record in records:
+                out.write(json.dumps(dict(zip(fields, record))) + "\n")
+        else:
+            writer = csv.writer(out)
+            writer.writerow(fields)
+            writer.writerows(records)
+        out.flush()
+    except BrokenPipeError:
+        # The reader stopped early (e.g. piped into head); keep the exit quiet
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    finally:
+        if output:
+            out.close()
+    print(
+        f"📊 {len(changed):,} photos re-classified in "
+        f"{time.perf_counter() - started:.1f}s, "
+        f"{int(np.count_nonzero(changed)):,} with different quality tags",
+        file=sys.stderr,
+    )
+
 def main():
     """Main function for Enhanced Photo Tagger v3.0"""
     parser = argparse.ArgumentParser(
@@ -608,6 +5450,162 @@ def main():
     parser.add_argument('--concert-mode', action='store_true', help='Enable concert photography mode')
     parser.add_argument('--quality-check', action='store_true', help='Enable quality analysis')
     parser.add_argument('--blur-threshold', type=float, default=100.0, help='Blur detection threshold')
+    parser.add_argument(
+        '--cascade',
+        action='store_true',
+        help='Settle clear-cut quality metrics on a 512px preview, '
+        'escalating borderline ones',
+    )
+    parser.add_argument(
+        '--triage',
+        action='store_true',
+        help='Skip AI tagging for frames that fail quality triage',
+    )
+    parser.add_argument(
+        '--triage-only',
+        action='store_true',
+        help='Quality triage pass without AI tagging',
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Keep running and tag new photos as they arrive',
+    )
+    parser.add_argument('--batch-size', type=int, help='Photos per progress checkpoint')
+    parser.add_argument(
+        '--max-in-flight',
+        type=int,
+        help='Concurrent Ollama requests per endpoint (default: 2)',
+    )
+    parser.add_argument(
+        '--batch-images', type=int, help='Photos per model request (default: 1)'
+    )
+    parser.add_argument(
+        '--endpoints', type=str, help='Comma-separated Ollama URLs to load-balance over'
+    )
+    parser.add_argument(
+        '--request-timeout',
+        type=float,
+        help='Seconds before an Ollama request is abandoned and retried (default: 180)',
+    )
+    parser.add_argument(
+        '--keep-alive',
+        type=str,
+        help='How long Ollama keeps the model loaded between requests (default: 30m)',
+    )
+    parser.add_argument(
+        '--cluster',
+        action='store_true',
+        help='Share the folder with other nodes through a work queue in it',
+    )
+    parser.add_argument(
+        '--node-id',
+        type=str,
+        help='Unique name of this node '
+        '(default: host name; set it per process on one host)',
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        help='Photos a cluster node leases at a time (default: 50)',
+    )
+    parser.add_argument('--workers', type=int, help='Decode/analysis worker processes')
+    parser.add_argument(
+        '--queue-depth', type=int, help='Photos decoded ahead of inference'
+    )
+    parser.add_argument(
+        '--decode-budget-mb',
+        type=int,
+        help='Decoded image memory shared by all workers in MiB '
+        '(default: 1/4 of RAM, 0 = unbounded)',
+    )
+    parser.add_argument('--burst-grouping', action='store_true',
+                        help='Reuse AI keywords across near-identical burst frames')
+    parser.add_argument(
+        '--no-cache', action='store_true', help='Disable the keyword cache'
+    )
+    parser.add_argument(
+        '--no-thumbnail-cache',
+        action='store_true',
+        help='Disable the model-input thumbnail cache',
+    )
+    parser.add_argument(
+        '--metrics-prom', type=str, help='Prometheus textfile-collector output file'
+    )
+    parser.add_argument(
+        '--profile-sample',
+        type=float,
+        help='Fraction of photos to profile with cProfile',
+    )
+    parser.add_argument(
+        '--raw-decode',
+        choices=['auto', 'preview', 'half_size', 'full'],
+        help='RAW decode strategy (default: auto)',
+    )
+    
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    search_parser = subparsers.add_parser(
+        'search',
+        help='Search the keyword index',
+        description='Boolean and range search over indexed keywords and quality '
+        'metrics, e.g. \'stage_lighting guitar AND blur.score >= 100\' or '
+        '\'NOT quality:blurry OR crowd\'',
+    )
+    search_parser.add_argument('query', nargs='+', help='Query terms')
+    search_parser.add_argument('--limit', type=int, help='Maximum paths to print')
+    search_parser.add_argument(
+        '--count', action='store_true', help='Print only the number of matches'
+    )
+    subparsers.add_parser(
+        'reindex', help='Rebuild the keyword index from existing .xmp sidecars'
+    )
+    subparsers.add_parser(
+        'status', help='Show work queue progress and per-node stats of a cluster'
+    )
+    report_parser = subparsers.add_parser(
+        'report',
+        help='Re-classify stored quality metrics and stream a CSV/JSONL report',
+        description='Re-classifies the raw quality metrics kept by tagging passes '
+        'under the given thresholds without decoding any photo, e.g. to tune '
+        'thresholds for a venue or camera',
+    )
+    report_parser.add_argument(
+        '--format',
+        choices=['csv', 'jsonl'],
+        default='csv',
+        help='Output format (default: csv)',
+    )
+    report_parser.add_argument(
+        '--output', type=str, help='Write to this file instead of stdout'
+    )
+    report_parser.add_argument(
+        '--summary',
+        action='store_true',
+        help='Only per-class counts, now and as analyzed',
+    )
+    report_parser.add_argument(
+        '--changed',
+        action='store_true',
+        help='Only photos whose quality tags would change',
+    )
+    report_parser.add_argument(
+        '--blur-threshold',
+        type=float,
+        dest='report_blur_threshold',
+        help='Laplacian variance below which a photo is slightly blurry',
+    )
+    report_parser.add_argument(
+        '--exposure-threshold',
+        type=float,
+        dest='report_exposure_threshold',
+        help='Clipped fraction above which a photo is under- or overexposed',
+    )
+    report_parser.add_argument(
+        '--low-light-threshold',
+        type=float,
+        dest='report_low_light_threshold',
+        help='Mean brightness below which a concert photo is low light',
+    )
     
     args = parser.parse_args()
     
@@ -624,18 +5622,97 @@ def main():
         config["quality_control"]["check_histogram"] = True
     if args.blur_threshold:
         config["quality_control"]["blur_threshold"] = args.blur_threshold
+    if args.cascade:
+        config["quality_control"]["cascade"]["enabled"] = True
+    if args.triage or args.triage_only:
+        config["triage"]["enabled"] = True
+        config["triage"]["triage_only"] = args.triage_only
+    if args.raw_decode:
+        config["raw_decode"]["strategy"] = args.raw_decode
+    if args.batch_size:
+        config["batch_size"] = args.batch_size
+    if args.burst_grouping:
+        config["burst_grouping"]["enabled"] = True
+    if args.no_cache:
+        config["keyword_cache"]["enabled"] = False
+    if args.no_thumbnail_cache:
+        config["thumbnail_cache"]["enabled"] = False
+    if args.metrics_prom:
+        config["metrics"]["prometheus_path"] = Path(args.metrics_prom).expanduser()
+    if args.profile_sample:
+        config["metrics"]["profile_sample_rate"] = args.profile_sample
+    if args.workers:
+        config["workers"]["decode_workers"] = args.workers
+    if args.queue_depth:
+        config["workers"]["queue_depth"] = args.queue_depth
+    if args.decode_budget_mb is not None:
+        config["memory"]["decode_budget_bytes"] = args.decode_budget_mb * 1024 * 1024
+    if args.max_in_flight:
+        config["inference"]["max_in_flight"] = args.max_in_flight
+    if args.batch_images:
+        config["inference"]["batch_images"] = args.batch_images
+    if args.endpoints:
+        config["inference"]["endpoints"] = [
+            url.strip() for url in args.endpoints.split(',') if url.strip()
+        ]
+    if args.request_timeout:
+        config["inference"]["request_timeout"] = args.request_timeout
+    if args.keep_alive:
+        config["inference"]["keep_alive"] = args.keep_alive
+    if args.cluster or args.node_id:
+        config["cluster"]["enabled"] = True
+    if args.node_id:
+        config["cluster"]["node_id"] = args.node_id
+    if args.chunk_size:
+        config["cluster"]["chunk_size"] = args.chunk_size
+    if args.watch and config["cluster"]["enabled"]:
+        parser.error("--watch cannot be combined with --cluster")
+    
+    if args.command == 'search':
+        search_index(config, ' '.join(args.query), args.limit, args.count)
+        return
+    if args.command == 'reindex':
+        rebuild_index(config, args.workers or 0)
+        return
+    if args.command == 'status':
+        print_cluster_status(config)
+        return
+    if args.command == 'report':
+        if args.report_blur_threshold is not None:
+            config["quality_control"]["blur_threshold"] = args.report_blur_threshold
+        if args.report_exposure_threshold is not None:
+            config["quality_control"][
+                "exposure_threshold"
+            ] = args.report_exposure_threshold
+        if args.report_low_light_threshold is not None:
+            config["concert_mode"][
+                "low_light_threshold"
+            ] = args.report_low_light_threshold
+        write_report(config, args.format, args.output, args.changed, args.summary)
+        return
     
     # Create and run enhanced tagger
-    tagger = EnhancedPhotoTagger(config)
+    try:
+        tagger = EnhancedPhotoTagger(config)
+    except DependencyError:
+        sys.exit(1)
+    except ClusterError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
     
     print()
     print("🚀 Enhanced AI Photo Tagger v3.0 ready!")
     print("   New features: Quality control, concert mode, cross-platform support")
     print()
     
-    # This is a demo version - full implementation would continue here
-    print("✅ Enhanced Photo Tagger v3.0 initialized successfully!")
-    print("📝 This is the foundation for the enhanced version with quality control")
+    try:
+        if args.watch:
+            tagger.watch()
+        else:
+            tagger.run()
+    except InferenceUnavailable as e:
+        print(f"❌ {e} - stopping, progress saved")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
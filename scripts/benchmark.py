@@ -0,0 +1,693 @@
+#!/usr/bin/env python3
+"""
+AI Photo Tagger v3.0 - Throughput Benchmark
+
+Generates a synthetic corpus (JPEG/PNG/TIFF at several resolutions, plus a
+DNG when rawpy is available) and runs the tagger against a local stand-in
+Ollama server, so the whole pipeline can be measured offline.
+
+Reports per-stage timings for open_image_enhanced, each QualityAnalyzer
+method, the JPEG/base64 encode and write_enhanced_xmp, plus end-to-end
+photos/hour and peak RSS.
+
+Usage:
+    python scripts/benchmark.py --count 20 --sizes 1920x1280,6000x4000 --latency 0.5
+    python scripts/benchmark.py --workers 4 --max-in-flight 4 --json results.json
+    python scripts/benchmark.py --nodes 3 --count 20 --sizes 1920x1280
+    python scripts/benchmark.py --load-seconds 5 --fail-rate 0.1 --stall-rate 0.05 \
+        --request-timeout 5
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import struct
+import shutil
+import argparse
+import tempfile
+import subprocess
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+STUB_KEYWORDS = [
+    "musician",
+    "guitar",
+    "stage",
+    "concert",
+    "performance",
+    "crowd",
+    "lights",
+    "night",
+]
+
+
+class StubOllamaServer:
+    """Minimal HTTP stand-in for Ollama's /api/tags, /api/ps and /api/chat"""
+
+    def __init__(
+        self,
+        models: List[str],
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        load_seconds: float = 0.0,
+        fail_rate: float = 0.0,
+        stall_rate: float = 0.0,
+        stall_seconds: float = 600.0,
+    ):
+        self.models = models
+        # Each chat sleeps this long (plus up to jitter) before a fixed keyword list
+        self.latency = latency
+        self.jitter = jitter
+        # Extra wait on the first request for a model that is not loaded
+        self.load_seconds = load_seconds
+        self.fail_rate = fail_rate  # Fraction of requests answered with a 500
+        # Fraction of requests that hang for stall_seconds first
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.chat_requests = 0
+        self.failed_requests = 0
+        self.loaded = set()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload: Dict, status: int = 200):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/api/tags":
+                    self._send_json(
+                        {"models": [stub.model_entry(name) for name in stub.models]}
+                    )
+                elif self.path.rstrip("/") == "/api/ps":
+                    self._send_json(
+                        {
+                            "models": [
+                                stub.model_entry(name) for name in sorted(stub.loaded)
+                            ]
+                        }
+                    )
+                elif self.path.rstrip("/") in ("", "/"):
+                    body = b"Ollama is running"
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.rstrip("/") != "/api/chat":
+                    self._send_json({"error": "not found"}, 404)
+                    return
+                model = request.get("model")
+                if model not in stub.models:
+                    self._send_json({"error": f"model '{model}' not found"}, 404)
+                    return
+                if not request.get("messages") and request.get("keep_alive") in (
+                    0,
+                    "0",
+                    "0s",
+                ):
+                    stub.loaded.discard(model)
+                    self._send_json(
+                        {
+                            "model": model,
+                            "message": {"role": "assistant", "content": ""},
+                            "done": True,
+                            "done_reason": "unload",
+                        }
+                    )
+                    return
+                with stub._load_lock:
+                    if model not in stub.loaded:
+                        time.sleep(stub.load_seconds)
+                        stub.loaded.add(model)
+                if not request.get("messages"):
+                    self._send_json(
+                        {
+                            "model": model,
+                            "message": {"role": "assistant", "content": ""},
+                            "done": True,
+                            "done_reason": "load",
+                        }
+                    )
+                    return
+                with stub._lock:
+                    stub.chat_requests += 1
+                if random.random() < stub.stall_rate:
+                    time.sleep(stub.stall_seconds)
+                if random.random() < stub.fail_rate:
+                    with stub._lock:
+                        stub.failed_requests += 1
+                    self._send_json({"error": "stub failure"}, 500)
+                    return
+                time.sleep(stub.latency + random.random() * stub.jitter)
+                self._send_json(
+                    {
+                        "model": request.get("model"),
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                        "message": {
+                            "role": "assistant",
+                            "content": ", ".join(random.sample(STUB_KEYWORDS, 6)),
+                        },
+                        "done": True,
+                        "done_reason": "stop",
+                    }
+                )
+
+        return Handler
+
+    @staticmethod
+    def model_entry(name: str) -> Dict:
+        return {
+            "name": name,
+            "model": name,
+            "modified_at": datetime.now(timezone.utc).isoformat(),
+            "size": 0,
+            "digest": "0" * 64,
+            "details": {
+                "format": "gguf",
+                "family": "stub",
+                "parameter_size": "0B",
+                "quantization_level": "none",
+            },
+        }
+
+    def start(self) -> "StubOllamaServer":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="stub-ollama", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def write_dng(path: Path, width: int, height: int, rng: np.random.Generator):
+    """Write a minimal uncompressed 16-bit RGGB CFA DNG"""
+    width -= width % 2
+    height -= height % 2
+    # Smooth scene so demosaic and blur metrics behave like a photo, not noise
+    scene = (
+        np.asarray(
+            Image.fromarray(
+                (rng.random((height // 16 + 1, width // 16 + 1, 3)) * 255).astype(
+                    np.uint8
+                )
+            ).resize((width, height), Image.BICUBIC),
+            dtype=np.uint16,
+        )
+        * 16
+    )
+    mosaic = np.empty((height, width), dtype="<u2")
+    mosaic[0::2, 0::2] = scene[0::2, 0::2, 0]
+    mosaic[0::2, 1::2] = scene[0::2, 1::2, 1]
+    mosaic[1::2, 0::2] = scene[1::2, 0::2, 1]
+    mosaic[1::2, 1::2] = scene[1::2, 1::2, 2]
+    data = mosaic.tobytes()
+
+    identity = [(1, 1), (0, 1), (0, 1), (0, 1), (1, 1), (0, 1), (0, 1), (0, 1), (1, 1)]
+    model = b"AI Photo Tagger Synthetic\0"
+    # (tag, type, values); types: 1 BYTE, 2 ASCII, 3 SHORT, 4 LONG, 10 SRATIONAL
+    entries = [
+        (254, 4, [0]),
+        (256, 4, [width]),
+        (257, 4, [height]),
+        (258, 3, [16]),
+        (259, 3, [1]),
+        (262, 3, [32803]),
+        (271, 2, b"Synthetic\0"),
+        (272, 2, model),
+        (273, 4, [0]),  # Patched below
+        (274, 3, [1]),
+        (277, 3, [1]),
+        (278, 4, [height]),
+        (279, 4, [len(data)]),
+        (284, 3, [1]),
+        (33421, 3, [2, 2]),
+        (33422, 1, [0, 1, 1, 2]),
+        (50706, 1, [1, 4, 0, 0]),
+        (50708, 2, model),
+        (50717, 4, [4095]),
+        (50721, 10, identity),
+        (50778, 3, [21]),
+    ]
+
+    def pack_values(tag_type, values) -> bytes:
+        if tag_type == 2:
+            return values
+        if tag_type == 10:
+            return b"".join(struct.pack("<ii", n, d) for n, d in values)
+        fmt = {1: "B", 3: "H", 4: "I"}[tag_type]
+        return struct.pack(f"<{len(values)}{fmt}", *values)
+
+    ifd_offset = 8
+    ifd_size = 2 + 12 * len(entries) + 4
+    extra_offset = ifd_offset + ifd_size
+    extra = b""
+    packed_entries = []
+    for tag, tag_type, values in entries:
+        payload = pack_values(tag_type, values)
+        count = len(values) if tag_type != 2 else len(payload)
+        if len(payload) <= 4:
+            packed_entries.append((tag, tag_type, count, payload.ljust(4, b"\0"), None))
+        else:
+            packed_entries.append(
+                (tag, tag_type, count, None, extra_offset + len(extra))
+            )
+            extra += payload + (b"\0" if len(payload) % 2 else b"")
+    data_offset = extra_offset + len(extra)
+
+    ifd = struct.pack("<H", len(packed_entries))
+    for tag, tag_type, count, inline, offset in packed_entries:
+        if tag == 273:
+            inline = struct.pack("<I", data_offset)
+        ifd += struct.pack("<HHI", tag, tag_type, count)
+        ifd += inline if inline is not None else struct.pack("<I", offset)
+    ifd += struct.pack("<I", 0)
+
+    with open(path, "wb") as f:
+        f.write(b"II*\0" + struct.pack("<I", ifd_offset))
+        f.write(ifd)
+        f.write(extra)
+        f.write(data)
+
+
+def generate_corpus(
+    folder: Path,
+    sizes: List[Tuple[int, int]],
+    count: int,
+    include_dng: bool,
+    seed: int = 0,
+) -> List[Path]:
+    """Create count photos per size, cycling through JPEG, PNG and TIFF"""
+    rng = np.random.default_rng(seed)
+    formats = [(".jpg", {"quality": 90}), (".png", {}), (".tif", {})]
+    paths = []
+    for width, height in sizes:
+        for i in range(count):
+            # Low-frequency colour field plus grain: compresses like a real frame
+            base = (
+                rng.random((max(2, height // 32), max(2, width // 32), 3)) * 255
+            ).astype(np.uint8)
+            img = Image.fromarray(base).resize((width, height), Image.BICUBIC)
+            grain = rng.integers(-8, 9, (height, width, 3), dtype=np.int16)
+            img = Image.fromarray(
+                np.clip(np.asarray(img, dtype=np.int16) + grain, 0, 255).astype(
+                    np.uint8
+                )
+            )
+            suffix, options = formats[i % len(formats)]
+            path = folder / f"synthetic_{width}x{height}_{i:04d}{suffix}"
+            img.save(path, **options)
+            paths.append(path)
+        if include_dng:
+            path = folder / f"synthetic_{width}x{height}_raw.dng"
+            write_dng(path, width, height, rng)
+            paths.append(path)
+    return paths
+
+
+def peak_rss_mb() -> Optional[Dict[str, float]]:
+    """Peak resident set size of this process and its children, in MB"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    values = np.asarray(samples) * 1000
+    return {
+        "count": int(values.size),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "max_ms": float(values.max()),
+    }
+
+
+def time_stages(tagger, photos: List[Path]) -> Dict[str, Dict[str, float]]:
+    """Time each pipeline stage in isolation for every corpus photo"""
+    import base64
+    import ai_photo_tagger
+
+    analyzer = tagger.quality_analyzer
+    timings = {
+        name: []
+        for name in (
+            "open_image_enhanced",
+            "analyze_blur",
+            "analyze_histogram",
+            "analyze_concert_specific",
+            "encode_jpeg_base64",
+            "write_enhanced_xmp",
+        )
+    }
+
+    def timed(name, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        timings[name].append(time.perf_counter() - started)
+        return result
+
+    for photo in photos:
+        img = timed("open_image_enhanced", tagger.open_image_enhanced, photo)
+        if img is None:
+            continue
+        frame = ai_photo_tagger.DecodedFrame(
+            photo, img, img.info.get("decode", "image")
+        )
+        blur = timed("analyze_blur", analyzer.analyze_blur, frame)
+        histogram = timed("analyze_histogram", analyzer.analyze_histogram, frame)
+        concert = timed(
+            "analyze_concert_specific", analyzer.analyze_concert_specific, frame
+        )
+        timed(
+            "encode_jpeg_base64",
+            lambda f: base64.b64encode(tagger.encode_for_model(f)),
+            frame,
+        )
+        quality = {
+            "blur": {"score": blur[0], "level": blur[1]},
+            "histogram": histogram[0],
+            "concert": concert,
+        }
+        timed(
+            "write_enhanced_xmp",
+            tagger.write_enhanced_xmp,
+            photo,
+            ["benchmark"],
+            quality,
+        )
+        frame.close()
+    return {name: summarize(samples) for name, samples in timings.items() if samples}
+
+
+def run_nodes(corpus: Path, nodes: int, args, endpoints: List[str]) -> float:
+    """Tag the corpus with several processes sharing a work queue; returns wall time"""
+    command = [
+        sys.executable,
+        str(REPO_ROOT / "ai_photo_tagger.py"),
+        "--folder",
+        str(corpus),
+        "--cluster",
+        "--concert-mode",
+        "--no-cache",
+        "--no-thumbnail-cache",
+        "--max-in-flight",
+        str(args.max_in_flight),
+        "--endpoints",
+        ",".join(endpoints),
+        "--chunk-size",
+        str(args.chunk_size),
+    ]
+    if args.workers:
+        command += ["--workers", str(args.workers)]
+    if args.request_timeout:
+        command += ["--request-timeout", str(args.request_timeout)]
+    started = time.perf_counter()
+    processes = [
+        subprocess.Popen(
+            command + ["--node-id", f"bench-{i + 1}"], stdout=subprocess.DEVNULL
+        )
+        for i in range(nodes)
+    ]
+    for process in processes:
+        process.wait()
+    return time.perf_counter() - started
+
+
+def parse_sizes(value: str) -> List[Tuple[int, int]]:
+    sizes = []
+    for item in value.split(","):
+        width, height = item.lower().split("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark AI Photo Tagger v3.0 against a stub Ollama server"
+    )
+    parser.add_argument("--count", type=int, default=6, help="Photos per resolution")
+    parser.add_argument(
+        "--sizes",
+        type=parse_sizes,
+        default=parse_sizes("1920x1280,4000x3000,6000x4000"),
+        help="Comma-separated WIDTHxHEIGHT list",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.5, help="Stub inference latency in seconds"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.1, help="Extra random latency in seconds"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0, help="Decode/analysis worker processes"
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=2,
+        help="Concurrent inference requests per server",
+    )
+    parser.add_argument(
+        "--servers",
+        type=int,
+        default=1,
+        help="Stub Ollama servers to load-balance over",
+    )
+    parser.add_argument(
+        "--load-seconds",
+        type=float,
+        default=0.0,
+        help="Stub model load time on first use",
+    )
+    parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of stub requests answering 500",
+    )
+    parser.add_argument(
+        "--stall-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of stub requests that hang",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        help="Seconds before the tagger abandons a request",
+    )
+    parser.add_argument(
+        "--nodes",
+        type=int,
+        default=1,
+        help="Tagger processes sharing the corpus through a work queue",
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=5, help="Photos each node leases at a time"
+    )
+    parser.add_argument(
+        "--corpus", type=str, help="Reuse or keep the corpus in this folder"
+    )
+    parser.add_argument(
+        "--no-dng",
+        action="store_true",
+        help="Skip the synthetic DNG even if rawpy is installed",
+    )
+    parser.add_argument("--json", type=str, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    model = "llava:7b"
+    servers = [
+        StubOllamaServer(
+            [model],
+            latency=args.latency,
+            jitter=args.jitter,
+            load_seconds=args.load_seconds,
+            fail_rate=args.fail_rate,
+            stall_rate=args.stall_rate,
+        ).start()
+        for _ in range(max(1, args.servers))
+    ]
+    # The ollama module binds its default client to OLLAMA_HOST at import time
+    os.environ["OLLAMA_HOST"] = servers[0].url
+    sys.path.insert(0, str(REPO_ROOT))
+    import copy
+    import ai_photo_tagger
+
+    corpus = (
+        Path(args.corpus)
+        if args.corpus
+        else Path(tempfile.mkdtemp(prefix="ai_photo_tagger_bench_"))
+    )
+    corpus.mkdir(parents=True, exist_ok=True)
+    try:
+        photos = sorted(
+            p
+            for p in corpus.iterdir()
+            if p.suffix.lower() in ai_photo_tagger.DEFAULT_CONFIG["supported_formats"]
+        )
+        if not photos:
+            print(f"🧪 Generating synthetic corpus in {corpus}")
+            photos = generate_corpus(
+                corpus,
+                args.sizes,
+                args.count,
+                bool(ai_photo_tagger.rawpy) and not args.no_dng,
+            )
+        for leftover in corpus.iterdir():
+            if leftover.name.endswith(".xmp") or leftover.name.startswith(
+                "ai_photo_tagger_v3"
+            ):
+                # The analysis store and profile dumps are directories
+                if leftover.is_dir():
+                    shutil.rmtree(leftover)
+                else:
+                    leftover.unlink()
+
+        config = copy.deepcopy(ai_photo_tagger.DEFAULT_CONFIG)
+        config["pictures_folder"] = corpus
+        config["ollama_model"] = model
+        config["dependency_check"]["ttl"] = 0
+        config["concert_mode"]["enabled"] = True
+        config["keyword_cache"]["enabled"] = False
+        config["thumbnail_cache"]["enabled"] = False
+        config["workers"]["decode_workers"] = args.workers
+        config["inference"]["max_in_flight"] = args.max_in_flight
+        if args.request_timeout:
+            config["inference"]["request_timeout"] = args.request_timeout
+        if len(servers) > 1:
+            config["inference"]["endpoints"] = [server.url for server in servers]
+
+        # End-to-end run
+        if args.nodes > 1:
+            elapsed = run_nodes(
+                corpus, args.nodes, args, [server.url for server in servers]
+            )
+            node_stats = ai_photo_tagger.WorkQueue.stats(
+                ai_photo_tagger.queue_path(config)
+            )["nodes"]
+            processed = sum(node.get("processed", 0) for node in node_stats)
+            errors = sum(node.get("errors", 0) for node in node_stats)
+            tagger = ai_photo_tagger.EnhancedPhotoTagger(config)
+        else:
+            node_stats = []
+            tagger = ai_photo_tagger.EnhancedPhotoTagger(config)
+            started = time.perf_counter()
+            tagger.run()
+            elapsed = time.perf_counter() - started
+            processed, errors = tagger.processed_count, tagger.error_count
+        end_to_end = {
+            "photos": processed,
+            "errors": errors,
+            "seconds": elapsed,
+            "photos_per_hour": processed / elapsed * 3600 if elapsed else 0.0,
+            "inference_requests": sum(server.chat_requests for server in servers),
+            "failed_requests": sum(server.failed_requests for server in servers),
+            "nodes": {node["node"]: node.get("processed", 0) for node in node_stats},
+        }
+
+        # Per-stage timings
+        stages = time_stages(tagger, photos)
+        results = {
+            "corpus": {
+                "folder": str(corpus),
+                "photos": len(photos),
+                "sizes": [f"{w}x{h}" for w, h in args.sizes],
+            },
+            "settings": {
+                "latency": args.latency,
+                "jitter": args.jitter,
+                "workers": args.workers,
+                "max_in_flight": args.max_in_flight,
+                "servers": len(servers),
+                "nodes": args.nodes,
+            },
+            "end_to_end": end_to_end,
+            "stages": stages,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+        print()
+        print("=" * 70)
+        print("  ⏱️  BENCHMARK RESULTS  ".center(70))
+        print("=" * 70)
+        for name, stats in stages.items():
+            print(
+                f"{name:<28} mean {stats['mean_ms']:8.1f} ms   "
+                f"p50 {stats['p50_ms']:8.1f} ms   p95 {stats['p95_ms']:8.1f} ms"
+            )
+        print("-" * 70)
+        for node, photos_done in end_to_end["nodes"].items():
+            print(f"🧩 {node:<38} {photos_done:,} photos")
+        print(
+            "⚡ End-to-end ............................ "
+            f"{end_to_end['photos_per_hour']:.0f} photos/hour"
+        )
+        rss = results["peak_rss_mb"]
+        if rss:
+            print(
+                f"🧠 Peak RSS .............................. {rss['self']:.0f} MB "
+                f"(child processes {rss['children']:.0f} MB)"
+            )
+        print("=" * 70)
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+    finally:
+        for server in servers:
+            server.stop()
+        if not args.corpus:
+            shutil.rmtree(corpus, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
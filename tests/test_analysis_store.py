@@ -0,0 +1,184 @@
+import copy
+import csv
+import json
+
+import numpy as np
+import pytest
+
+import ai_photo_tagger
+from ai_photo_tagger import DEFAULT_CONFIG, AnalysisStore, QualityAnalyzer, write_report
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ai_photo_tagger.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def config(tmp_path):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config["pictures_folder"] = tmp_path
+    return config
+
+
+def blur_row(score, decided_at=1024):
+    return {"blur_score": score, "blur_px": decided_at, "analysis_px": 1024}
+
+
+def level_of(score, threshold=100.0):
+    return QualityAnalyzer.BLUR_LEVELS[
+        int(
+            np.searchsorted(
+                (threshold / 4, threshold / 2, threshold), score, side="right"
+            )
+        )
+    ]
+
+
+@pytest.fixture
+def store(config, clock):
+    store = AnalysisStore(
+        ai_photo_tagger.analysis_store_path(config), "node-1", segment_rows=2
+    )
+    # Analyzed as blurry under the default threshold of 100
+    store.add("/photos/a.jpg", blur_row(40.0), {"blur": {"level": level_of(40.0)}})
+    store.add(
+        "/photos/b.jpg",
+        blur_row(40.0, decided_at=512),
+        {"blur": {"level": level_of(40.0)}},
+    )
+    store.flush()
+    store.add("/photos/c.jpg", blur_row(10.0), {"blur": {"level": level_of(10.0)}})
+    store.flush()
+    assert len(AnalysisStore.segments(store.folder)) == 1  # Below segment_rows
+    store.add("/photos/c.jpg", blur_row(500.0), {"blur": {"level": level_of(500.0)}})
+    store.close()
+    return store
+
+
+def test_flush_writes_segments(store):
+    assert len(AnalysisStore.segments(store.folder)) == 2
+
+
+def test_load_keeps_latest_row_per_photo(store):
+    columns = AnalysisStore.load(store.folder)
+    paths = list(AnalysisStore.paths(columns, np.arange(len(columns["analyzed"]))))
+    assert sorted(paths) == ["/photos/a.jpg", "/photos/b.jpg", "/photos/c.jpg"]
+    scores = dict(zip(paths, columns["blur_score"].tolist()))
+    assert scores["/photos/c.jpg"] == 500.0
+    assert np.isnan(columns["underexposed"]).all()
+    assert (columns["exposure_class"] == AnalysisStore.NO_CLASS).all()
+
+
+def test_compaction_merges_segments(config, store):
+    compacting = AnalysisStore(
+        store.folder, "node-2", segment_rows=1, compact_segments=1
+    )
+    compacting.add("/photos/d.jpg", blur_row(300.0), {"blur": {"level": "sharp"}})
+    compacting.close()
+    assert len(AnalysisStore.segments(store.folder)) == 1
+    assert len(AnalysisStore.load(store.folder)["analyzed"]) == 4
+
+
+def classified(store, blur_threshold):
+    config = {
+        "quality_control": dict(
+            DEFAULT_CONFIG["quality_control"], blur_threshold=blur_threshold
+        )
+    }
+    columns = AnalysisStore.load(store.folder)
+    paths = list(AnalysisStore.paths(columns, np.arange(len(columns["analyzed"]))))
+    classes = AnalysisStore.classify(columns, QualityAnalyzer(config))
+    return (
+        columns,
+        classes,
+        {
+            path: QualityAnalyzer.BLUR_LEVELS[c]
+            for path, c in zip(paths, classes["blur_class"])
+        },
+    )
+
+
+def test_classify_under_new_thresholds(store):
+    columns, classes, levels = classified(store, 100.0)
+    assert levels == {
+        "/photos/a.jpg": "blurry",
+        "/photos/b.jpg": "blurry",
+        "/photos/c.jpg": "sharp",
+    }
+    assert not AnalysisStore.tag_changes(columns, classes).any()
+
+    columns, classes, levels = classified(store, 60.0)
+    assert levels["/photos/a.jpg"] == "slightly_blurry"
+    assert levels["/photos/c.jpg"] == "sharp"
+
+
+def test_preview_rows_keep_their_classes(store):
+    # b was decided on a 512px preview, so its score is not on the analysis scale
+    columns, classes, levels = classified(store, 60.0)
+    assert levels["/photos/b.jpg"] == "blurry"
+    changed = dict(
+        zip(
+            AnalysisStore.paths(columns, np.arange(len(columns["analyzed"]))),
+            AnalysisStore.tag_changes(columns, classes).tolist(),
+        )
+    )
+    assert changed == {
+        "/photos/a.jpg": True,
+        "/photos/b.jpg": False,
+        "/photos/c.jpg": False,
+    }
+
+
+def report(config, tmp_path, **kwargs):
+    config["quality_control"]["blur_threshold"] = 60.0
+    output = tmp_path / "report.out"
+    write_report(config, output=str(output), **kwargs)
+    return output.read_text(encoding="utf-8")
+
+
+def test_report_rows(config, store, tmp_path):
+    rows = list(csv.DictReader(report(config, tmp_path).splitlines()))
+    by_path = {row["path"]: row for row in rows}
+    assert set(by_path) == {"/photos/a.jpg", "/photos/b.jpg", "/photos/c.jpg"}
+    assert by_path["/photos/a.jpg"]["blur"] == "slightly_blurry"
+    assert by_path["/photos/a.jpg"]["tags"] == ""
+    assert by_path["/photos/a.jpg"]["changed"] == "True"
+    assert by_path["/photos/b.jpg"]["preview"] == "True"
+    assert by_path["/photos/b.jpg"]["tags"] == "quality:blurry"
+    assert by_path["/photos/c.jpg"]["preview"] == "False"
+
+
+def test_report_changed_only(config, store, tmp_path):
+    records = [
+        json.loads(line)
+        for line in report(
+            config, tmp_path, fmt="jsonl", changed_only=True
+        ).splitlines()
+    ]
+    assert [record["path"] for record in records] == ["/photos/a.jpg"]
+    assert records[0]["tags"] == []
+    assert records[0]["blur_score"] == 40.0
+
+
+def test_report_summary(config, store, tmp_path):
+    rows = list(csv.reader(report(config, tmp_path, summary=True).splitlines()))
+    assert rows[0] == ["metric", "class", "count", "analyzed"]
+    counts = {
+        (metric, name): (now, analyzed) for metric, name, now, analyzed in rows[1:]
+    }
+    assert counts[("blur", "blurry")] == ("1", "2")
+    assert counts[("blur", "slightly_blurry")] == ("1", "0")
+    assert counts[("blur", "sharp")] == ("1", "1")
+    assert counts[("tags", "changed")] == ("1", "")
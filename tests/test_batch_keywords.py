@@ -0,0 +1,114 @@
+import json
+
+import pytest
+
+from ai_photo_tagger import EnhancedPhotoTagger
+
+parse = EnhancedPhotoTagger.parse_batch_keywords
+
+
+def test_documented_form():
+    raw = json.dumps(
+        {
+            "images": [
+                {"index": 1, "keywords": ["Woman", "portrait"]},
+                {"index": 2, "keywords": ["stage", "guitar"]},
+            ]
+        }
+    )
+    assert parse(raw, 2) == [["woman", "portrait"], ["stage", "guitar"]]
+
+
+def test_entries_are_placed_by_index_not_position():
+    raw = json.dumps(
+        {
+            "images": [
+                {"index": 2, "keywords": "stage, guitar"},
+                {"index": "1", "keywords": ["crowd"]},
+            ]
+        }
+    )
+    assert parse(raw, 2) == [["crowd"], ["stage", "guitar"]]
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        json.dumps([["crowd", "night"], ["stage", "lights"]]),
+        json.dumps(
+            [
+                {"image": 1, "tags": "crowd, night"},
+                {"image": 2, "tags": ["stage", "lights"]},
+            ]
+        ),
+        json.dumps({"1": ["crowd", "night"], "image_2": "stage, lights"}),
+        'Sure! Here you go:\n{"images": [{"index": 1, "keywords": ["crowd", "night"]},'
+        ' {"index": 2, "keywords": ["stage", "lights"]}]}\nHope that helps.',
+    ],
+)
+def test_accepted_shapes(raw):
+    assert parse(raw, 2) == [["crowd", "night"], ["stage", "lights"]]
+
+
+def test_missing_and_out_of_range_entries_are_none():
+    raw = json.dumps(
+        {
+            "images": [
+                {"index": 3, "keywords": ["crowd"]},
+                {"index": 7, "keywords": ["stage"]},
+            ]
+        }
+    )
+    assert parse(raw, 3) == [None, None, ["crowd"]]
+
+
+def test_first_answer_for_an_index_wins():
+    raw = json.dumps(
+        [{"index": 1, "keywords": ["crowd"]}, {"index": 1, "keywords": ["stage"]}]
+    )
+    assert parse(raw, 1) == [["crowd"]]
+
+
+def test_unusable_keywords_are_none():
+    raw = json.dumps(
+        [
+            {"index": 1, "keywords": ["x", ""]},
+            {"index": 2, "keywords": {"not": "a list"}},
+        ]
+    )
+    assert parse(raw, 2) == [None, None]
+
+
+@pytest.mark.parametrize(
+    "raw", ["", "no json here", "{not json}", "42", '"just a string"']
+)
+def test_garbage_gives_all_none(raw):
+    assert parse(raw, 2) == [None, None]
+
+
+def test_answers_carry_each_photos_part_of_the_response():
+    answers = EnhancedPhotoTagger.batch_answers(
+        json.dumps(
+            {
+                "images": [
+                    {"index": 2, "keywords": ["stage", "guitar"]},
+                    {"index": 1, "keywords": "Crowd, night"},
+                ]
+            }
+        ),
+        3,
+    )
+    assert answers[0] == (
+        json.dumps({"index": 1, "keywords": "Crowd, night"}),
+        ["crowd", "night"],
+    )
+    assert json.loads(answers[1][0]) == {"index": 2, "keywords": ["stage", "guitar"]}
+    assert answers[2] is None
+
+    keyed = EnhancedPhotoTagger.batch_answers(
+        json.dumps({"1": "crowd", "image_2": ["stage"]}), 2
+    )
+    assert [json.loads(answer[0]) for answer in keyed] == [
+        {"1": "crowd"},
+        {"image_2": ["stage"]},
+    ]
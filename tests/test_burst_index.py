@@ -0,0 +1,54 @@
+import random
+
+from ai_photo_tagger import BurstGroup, BurstIndex, hamming_distance
+
+
+def flip_bits(phash, count, rng):
+    for bit in rng.sample(range(64), count):
+        phash ^= 1 << bit
+    return phash
+
+
+def brute_force(items, phash, max_distance):
+    distances = [hamming_distance(phash, item) for item, _ in items]
+    best = min(distances, default=max_distance + 1)
+    return best if best <= max_distance else None
+
+
+def test_find_matches_a_brute_force_scan():
+    rng = random.Random(0)
+    index = BurstIndex(max_distance=6, window=1000)
+    items = []
+    for _ in range(40):
+        # Clusters of near-duplicates, as a burst produces
+        center = rng.getrandbits(64)
+        for _ in range(5):
+            phash = flip_bits(center, rng.randint(0, 4), rng)
+            group = BurstGroup()
+            index.add(phash, group)
+            items.append((phash, group))
+    groups = {id(group): phash for phash, group in items}
+
+    for _ in range(500):
+        if rng.random() < 0.8:
+            phash = flip_bits(rng.choice(items)[0], rng.randint(0, 10), rng)
+        else:
+            phash = rng.getrandbits(64)
+        expected = brute_force(items, phash, index.max_distance)
+        found = index.find(phash)
+        if expected is None:
+            assert found is None
+        else:
+            assert hamming_distance(phash, groups[id(found)]) == expected
+
+
+def test_find_only_sees_the_window():
+    index = BurstIndex(max_distance=2, window=4)
+    first = BurstGroup()
+    index.add(0, first)
+    assert index.find(0b11) is first
+    for i in range(1, 8):
+        index.add(0xFFFF << (4 * i), BurstGroup())
+    # Rebuilt with the latest four once it held twice the window
+    assert index.find(0) is None
+    assert index.find(0xFFFF << 28) is not None
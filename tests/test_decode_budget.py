@@ -0,0 +1,51 @@
+import copy
+import threading
+
+from ai_photo_tagger import DEFAULT_CONFIG, DecodeBudget, EnhancedPhotoTagger
+
+
+def test_reserve_blocks_past_the_budget_until_a_release():
+    budget = DecodeBudget(100, shared=False)
+    first = budget.reserve(60)
+    assert budget.used == 60
+
+    reserved = []
+    thread = threading.Thread(target=lambda: reserved.append(budget.reserve(60)))
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive() and not reserved
+
+    # Finishing the first decode lets the second one in
+    budget.release(first)
+    thread.join(5)
+    assert reserved == [60]
+    assert budget.used == 60
+
+
+def test_oversized_reservation_waits_for_an_empty_budget():
+    budget = DecodeBudget(100, shared=False)
+    small = budget.reserve(10)
+    thread = threading.Thread(target=budget.reserve, args=(500,))
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive()
+
+    budget.release(small)
+    thread.join(5)
+    assert not thread.is_alive()
+    # Clamped to the budget, so it still decodes on its own
+    assert budget.used == 100
+
+
+def test_shared_only_with_a_process_pool(tmp_path):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config["pictures_folder"] = tmp_path
+    config["memory"]["decode_budget_bytes"] = 1024
+    tagger = EnhancedPhotoTagger.for_worker(config)
+
+    assert isinstance(tagger.create_decode_budget()._condition, threading.Condition)
+    config["workers"]["decode_workers"] = 2
+    assert not isinstance(tagger.create_decode_budget()._condition, threading.Condition)
+
+    config["memory"]["decode_budget_bytes"] = 0
+    assert tagger.create_decode_budget() is None
@@ -0,0 +1,64 @@
+from pathlib import Path
+
+from ai_photo_tagger import ExifToolSession
+
+
+def test_write_replaces_previously_embedded_keywords(monkeypatch):
+    session = ExifToolSession()
+    sent = []
+
+    def execute_batch(commands):
+        sent.extend(commands)
+        return ["    1 image files updated\n"] * len(commands)
+
+    monkeypatch.setattr(session, "execute_batch", execute_batch)
+    results = session.write_keywords(
+        [
+            (
+                Path("a.dng"),
+                ["guitar", "quality:blurry"],
+                None,
+                ["stage", "quality:sharp", "guitar"],
+            ),
+        ]
+    )
+    assert results == [(True, "1 image files updated")]
+    args = sent[0]
+    # Stale keywords from the last run are removed; ours are removed and added so they
+    # are not duplicated
+    assert "-XMP-dc:Subject-=stage" in args and "-IPTC:Keywords-=quality:sharp" in args
+    assert "-XMP-dc:Subject+=stage" not in args
+    assert args.count("-XMP-dc:Subject-=guitar") == 1
+    assert args.index("-XMP-dc:Subject-=guitar") < args.index("-XMP-dc:Subject+=guitar")
+    assert args[-1] == "a.dng"
+
+
+def test_write_status_parsing():
+    assert ExifToolSession.write_succeeded("    1 image files updated\n")
+    assert ExifToolSession.write_succeeded("    1 image files unchanged\n")
+    assert ExifToolSession.write_succeeded(
+        "Warning: [minor] Ignored empty rational value\n    1 image files updated\n"
+    )
+    assert not ExifToolSession.write_succeeded(
+        "Error: File not found - Error_shot.dng\n"
+    )
+    assert not ExifToolSession.write_succeeded(
+        "Error: Not a valid DNG - a.dng\n    0 image files updated\n"
+        "    1 files weren't updated due to errors\n"
+    )
+    assert not ExifToolSession.write_succeeded("")
+
+
+def test_file_names_do_not_read_as_errors(monkeypatch):
+    session = ExifToolSession()
+    monkeypatch.setattr(
+        session,
+        "execute_batch",
+        lambda commands: [
+            "Warning: Duplicate keyword in Error_2023/IMG_1.dng\n"
+            "    1 image files updated\n",
+        ],
+    )
+    assert session.write_keywords(
+        [(Path("Error_2023/IMG_1.dng"), ["guitar"], None, [])]
+    )[0][0]
@@ -0,0 +1,119 @@
+import copy
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import ai_photo_tagger
+from ai_photo_tagger import DEFAULT_CONFIG, EnhancedPhotoTagger, FolderWatcher
+
+EXTENSIONS = {".jpg", ".png"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ai_photo_tagger.time, "time", clock)
+    monkeypatch.setattr(ai_photo_tagger.time, "sleep", clock.sleep)
+    return clock
+
+
+def jpeg_bytes():
+    pixels = np.random.default_rng(0).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def test_polling_reports_new_and_changed_files(tmp_path, clock):
+    (tmp_path / "old.jpg").write_bytes(b"old")
+    watcher = FolderWatcher(tmp_path, EXTENSIONS, poll_interval=2.0, use_inotify=False)
+    assert watcher.backend == "polling"
+
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "new.png").write_bytes(b"new")
+    (tmp_path / ".hidden.jpg").write_bytes(b"hidden")
+    (tmp_path / "notes.txt").write_bytes(b"notes")
+    # Nothing is rescanned before the poll interval is up
+    assert watcher.changes(1.0) == []
+    assert watcher.changes(5.0) == [tmp_path / "sub" / "new.png"]
+    assert watcher.changes(5.0) == []
+
+    (tmp_path / "old.jpg").write_bytes(b"rewritten")
+    assert watcher.changes(5.0) == [tmp_path / "old.jpg"]
+
+
+class WritingWatcher(FolderWatcher):
+    """Polls the real folder while a photo is copied into it in two parts"""
+
+    clock = None
+    data = b""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.polls = 0
+
+    def changes(self, timeout):
+        self.polls += 1
+        self.clock.now += 0.1
+        target = self.folder / "arrived.jpg"
+        half = len(self.data) // 2
+        if self.polls == 1:
+            target.write_bytes(self.data[:half])
+        elif self.polls == 5:
+            with open(target, "ab") as f:
+                f.write(self.data[half:])
+        elif self.polls > 60:
+            raise KeyboardInterrupt
+        return super().changes(timeout)
+
+
+def test_watch_tags_a_new_file_once_it_is_stable(tmp_path, monkeypatch, clock):
+    WritingWatcher.clock = clock
+    WritingWatcher.data = jpeg_bytes()
+    monkeypatch.setattr(ai_photo_tagger, "FolderWatcher", WritingWatcher)
+
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config["pictures_folder"] = tmp_path
+    config["watch"].update(
+        settle_seconds=1.0, poll_interval=0.0, use_inotify=False, process_backlog=False
+    )
+    config["triage"].update(enabled=True, triage_only=True)
+    for section in (
+        "keyword_cache",
+        "thumbnail_cache",
+        "index",
+        "analysis_store",
+        "metrics",
+    ):
+        config[section]["enabled"] = False
+    tagger = EnhancedPhotoTagger(config)
+
+    prepared = []
+    prepare_photo = tagger.prepare_photo
+
+    def recording_prepare(photo_path):
+        prepared.append((photo_path.name, photo_path.stat().st_size, clock.now))
+        return prepare_photo(photo_path)
+
+    monkeypatch.setattr(tagger, "prepare_photo", recording_prepare)
+    started = clock.now
+    tagger.watch(tmp_path)
+
+    # Seen half-written, but only picked up whole, after settle_seconds without a change
+    assert [(name, size) for name, size, _ in prepared] == [
+        ("arrived.jpg", len(WritingWatcher.data))
+    ]
+    assert prepared[0][2] - started >= 0.5 + 1.0
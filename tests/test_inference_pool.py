@@ -0,0 +1,225 @@
+import copy
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import ai_photo_tagger
+from ai_photo_tagger import (
+    DEFAULT_CONFIG,
+    EnhancedPhotoTagger,
+    InferencePool,
+    InferenceUnavailable,
+)
+
+MODEL = "llava:7b"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ai_photo_tagger.time, "time", clock)
+    monkeypatch.setattr(ai_photo_tagger.time, "sleep", clock.sleep)
+    return clock
+
+
+class StubClient:
+    """Stands in for ollama.Client: fails the first `failures` chats (all with None)"""
+
+    def __init__(self, failures=0, reachable=True, models=(MODEL,)):
+        self.failures = failures
+        self.reachable = reachable
+        self.models = models
+        self.calls = 0
+
+    def chat(self, **kwargs):
+        self.calls += 1
+        if self.failures is None or self.calls <= self.failures:
+            raise ConnectionError("stub failure")
+        return {"message": {"role": "assistant", "content": "guitar, stage, crowd"}}
+
+    def list(self):
+        if not self.reachable:
+            raise ConnectionError("stub unreachable")
+        return {"models": [{"model": model} for model in self.models]}
+
+
+def make_pool(*clients, **kwargs):
+    kwargs.setdefault("eject_after", 2)
+    kwargs.setdefault("eject_seconds", 60)
+    kwargs.setdefault("backoff_base", 0.0)
+    pool = InferencePool(
+        [f"http://host-{i}" for i in range(len(clients))], MODEL, **kwargs
+    )
+    for endpoint, client in zip(pool.endpoints, clients):
+        endpoint.client = client
+    return pool
+
+
+def chat(pool):
+    return pool.chat(model=MODEL, messages=[])
+
+
+def test_routes_to_least_outstanding(clock):
+    pool = make_pool(StubClient(), StubClient())
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+    pool.release(first, True)
+    assert pool.acquire() is first
+
+
+def test_retry_moves_to_another_endpoint(clock):
+    broken, healthy = StubClient(failures=None), StubClient()
+    pool = make_pool(broken, healthy, retries=1)
+    assert chat(pool)["message"]["content"]
+    assert (broken.calls, healthy.calls) == (1, 1)
+    assert pool.endpoints[0].failures == 1
+
+
+def test_ejection_and_readmission(clock):
+    broken, healthy = StubClient(failures=2), StubClient()
+    pool = make_pool(broken, healthy)
+    a, b = pool.endpoints
+    for _ in range(2):
+        # Keep b busy so a gets the request
+        b.outstanding += 1
+        with pytest.raises(ConnectionError):
+            chat(pool)
+        b.outstanding -= 1
+    assert not a.healthy(clock.now)
+
+    # While ejected, every request goes to b even when it is busier
+    b.outstanding += 5
+    chat(pool)
+    assert (broken.calls, healthy.calls) == (2, 1)
+    b.outstanding -= 5
+
+    # A health probe reinstates it as soon as it answers
+    assert pool.probe(a) == "ok"
+    assert a.healthy(clock.now) and a.failures == 0
+    chat(pool)
+    assert broken.calls == 3
+
+
+def test_ejection_expires(clock):
+    pool = make_pool(StubClient(failures=None), StubClient(), eject_after=1)
+    a = pool.endpoints[0]
+    with pytest.raises(ConnectionError):
+        chat(pool)
+    assert not a.healthy(clock.now)
+    clock.now += 61
+    assert a.healthy(clock.now)
+
+
+def test_circuit_opens_when_every_endpoint_is_ejected(clock):
+    clients = [StubClient(failures=None, reachable=False) for _ in range(2)]
+    pool = make_pool(*clients, eject_after=1, max_outage=30)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            chat(pool)
+    assert pool.circuit_open()
+    with pytest.raises(InferenceUnavailable):
+        chat(pool)
+    assert sum(client.calls for client in clients) == 2
+
+    started = clock.now
+    with pytest.raises(InferenceUnavailable, match="has answered"):
+        pool.wait_until_available()
+    assert 30 <= clock.now - started < 60
+
+
+def test_wait_returns_once_a_probe_answers(clock):
+    client = StubClient(failures=None, reachable=False)
+    pool = make_pool(client, eject_after=1)
+    with pytest.raises(ConnectionError):
+        chat(pool)
+    client.reachable = True
+    pool.wait_until_available()
+    assert not pool.circuit_open()
+    assert clock.now - 1_000_000.0 <= InferencePool.PROBE_INTERVAL
+
+
+def test_wait_raises_at_once_without_the_model(clock):
+    pool = make_pool(StubClient(models=("other",)))
+    assert pool.probe(pool.endpoints[0]) == "no_model"
+    with pytest.raises(InferenceUnavailable, match="serves"):
+        pool.wait_until_available()
+
+
+class StubWatcher:
+    """Sees no new files and interrupts the watch after a number of polls"""
+
+    def __init__(self, folder, extensions, poll_interval=2.0, use_inotify=True):
+        self.backend = "stub"
+        self.polls = 0
+
+    def changes(self, timeout):
+        self.polls += 1
+        if self.polls > 20:
+            raise KeyboardInterrupt
+        return []
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def watch_tagger(tmp_path, monkeypatch, clock):
+    pixels = np.random.default_rng(0).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(tmp_path / "photo.jpg")
+    monkeypatch.setattr(ai_photo_tagger, "FolderWatcher", StubWatcher)
+
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config["pictures_folder"] = tmp_path
+    config["watch"]["settle_seconds"] = 0
+    # Constructed without an inference pool or dependency check
+    config["triage"]["triage_only"] = True
+    for section in (
+        "keyword_cache",
+        "thumbnail_cache",
+        "index",
+        "analysis_store",
+        "metrics",
+    ):
+        config[section]["enabled"] = False
+    config["inference"].update(
+        retries=0, backoff_base=0.0, eject_after_failures=100, keep_alive_after=None
+    )
+    tagger = EnhancedPhotoTagger(config)
+    config["triage"]["triage_only"] = False
+    tagger.setup_inference_pool()
+    monkeypatch.setattr(tagger, "warm_up_model", lambda: None)
+    return tagger
+
+
+def test_watch_requeues_a_failed_photo(watch_tagger, tmp_path):
+    client = StubClient(failures=2)
+    watch_tagger.inference_pool.endpoints[0].client = client
+    watch_tagger.watch(tmp_path)
+    assert client.calls == 3
+    assert watch_tagger.requeued_count == 2
+    assert watch_tagger.error_count == 0
+    assert (tmp_path / "photo.jpg.xmp").exists()
+
+
+def test_watch_gives_up_once_attempts_run_out(watch_tagger, tmp_path):
+    watch_tagger.config["inference"]["requeue_attempts"] = 2
+    client = StubClient(failures=None)
+    watch_tagger.inference_pool.endpoints[0].client = client
+    watch_tagger.watch(tmp_path)
+    assert client.calls == 3
+    assert watch_tagger.requeued_count == 2
+    assert watch_tagger.error_count == 1
+    assert not (tmp_path / "photo.jpg.xmp").exists()
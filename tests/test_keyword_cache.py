@@ -0,0 +1,97 @@
+import sqlite3
+
+import pytest
+
+import ai_photo_tagger
+from ai_photo_tagger import KeywordCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ai_photo_tagger.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "cache.sqlite"
+
+
+def last_used(db_path, key):
+    with sqlite3.connect(str(db_path)) as conn:
+        return conn.execute(
+            "SELECT last_used FROM entries WHERE key = ?", (key,)
+        ).fetchone()[0]
+
+
+def test_round_trip_and_counters(db_path, clock):
+    cache = KeywordCache(db_path, 1024 * 1024)
+    cache.put("a", "guitar, stage", ["guitar", "stage"])
+    assert cache.get("missing", "a") == {
+        "response": "guitar, stage",
+        "keywords": ["guitar", "stage"],
+    }
+    assert cache.get("missing") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_hits_are_not_written_until_the_next_write(db_path, clock):
+    cache = KeywordCache(db_path, 1024 * 1024)
+    cache.put("a", "guitar", ["guitar"])
+    stored = last_used(db_path, "a")
+    cache.get("a")
+    assert last_used(db_path, "a") == stored
+
+    cache.put("b", "stage", ["stage"])
+    assert last_used(db_path, "a") > stored
+    cache.get("b")
+    cache.close()
+    assert last_used(db_path, "b") > last_used(db_path, "a")
+
+
+def test_many_hits_are_written_in_batches(db_path, clock, monkeypatch):
+    monkeypatch.setattr(KeywordCache, "TOUCH_BATCH", 2)
+    cache = KeywordCache(db_path, 1024 * 1024)
+    cache.put("a", "guitar", ["guitar"])
+    cache.put("b", "stage", ["stage"])
+    stored = last_used(db_path, "a")
+    cache.get("a")
+    assert last_used(db_path, "a") == stored
+    cache.get("b")
+    assert last_used(db_path, "a") > stored
+    cache.close()
+
+
+def keys(db_path):
+    with sqlite3.connect(str(db_path)) as conn:
+        return {row[0] for row in conn.execute("SELECT key FROM entries")}
+
+
+def test_eviction_drops_least_recently_used_first(db_path, clock):
+    # Each entry is 1 + 6 + 10 = 17 bytes, so four fit
+    cache = KeywordCache(db_path, 4 * 17)
+    for key in "abcd":
+        cache.put(key, "guitar", ["guitar"])
+    assert cache.get("a") is not None  # Now the most recently used
+
+    cache.put("e", "guitar", ["guitar"])
+    assert keys(db_path) == {"a", "c", "d", "e"}
+    cache.put("f", "guitar", ["guitar"])
+    assert keys(db_path) == {"a", "d", "e", "f"}
+    assert cache.total_bytes == 4 * 17
+    cache.close()
+
+    reopened = KeywordCache(db_path, 4 * 17)
+    assert reopened.total_bytes == 4 * 17
+    reopened.close()
@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+from ai_photo_tagger import IndexQueryError, KeywordIndex, SidecarWriter
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = KeywordIndex(tmp_path / "index.sqlite")
+    index.add(
+        "a.jpg",
+        ["Guitar", "stage_lighting"],
+        {"blur": {"score": 150.0, "level": "sharp"}},
+    )
+    index.add(
+        "b.jpg", ["guitar", "crowd"], {"blur": {"score": 40.0, "level": "blurry"}}
+    )
+    index.add(
+        "c.jpg",
+        ["drums", "live music"],
+        {"blur": {"score": 90.0, "level": "slightly_blurry"}},
+    )
+    index.commit()
+    yield index
+    index.close()
+
+
+def test_tokenize_keeps_phrases_and_operators():
+    assert KeywordIndex.tokenize('"live music" blur.score>=100') == [
+        '"live music',
+        "blur.score",
+        ">=",
+        "100",
+    ]
+
+
+def test_parse_implicit_and_with_precedence(index):
+    assert index.parse("guitar crowd OR drums") == (
+        "or",
+        [("and", [("term", "guitar"), ("term", "crowd")]), ("term", "drums")],
+    )
+
+
+def test_parse_not_parentheses_and_metrics(index):
+    assert index.parse("NOT (guitar OR drums) AND blur.score < 50") == (
+        "and",
+        [
+            ("not", ("or", [("term", "guitar"), ("term", "drums")])),
+            ("metric", "blur.score", "<", 50.0),
+        ],
+    )
+
+
+def test_parse_string_fields_become_terms(index):
+    assert index.parse("blur.level=Sharp") == ("term", "blur.level=sharp")
+    assert index.parse("blur.level != sharp") == ("not", ("term", "blur.level=sharp"))
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "",
+        "   ",
+        "(guitar",
+        "guitar)",
+        "blur.score >",
+        "blur.score > high",
+        ">= 3",
+        "guitar !",
+    ],
+)
+def test_parse_errors(index, query):
+    with pytest.raises(IndexQueryError):
+        index.parse(query)
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("guitar", ["a.jpg", "b.jpg"]),
+        ("GUITAR AND crowd", ["b.jpg"]),
+        ("guitar OR drums", ["a.jpg", "b.jpg", "c.jpg"]),
+        ("NOT guitar", ["c.jpg"]),
+        ('"live music"', ["c.jpg"]),
+        ("blur.score >= 90", ["a.jpg", "c.jpg"]),
+        ("guitar blur.score < 100", ["b.jpg"]),
+        ("blur.level=blurry OR stage_lighting", ["a.jpg", "b.jpg"]),
+        ("NOT blur.level=sharp NOT drums", ["b.jpg"]),
+    ],
+)
+def test_search(index, query, expected):
+    assert index.search(query) == expected
+    assert index.count(query) == len(expected)
+
+
+def test_add_replaces_previous_entry(index):
+    index.add("b.jpg", ["bass"], None)
+    index.commit()
+    assert index.search("crowd") == []
+    assert index.search("bass") == ["b.jpg"]
+    assert index.search("blur.score < 100") == ["c.jpg"]
+
+
+def test_rebuild_resolves_each_sidecar_to_its_photo(tmp_path):
+    library = tmp_path / "library"
+    library.mkdir()
+    writer = SidecarWriter()
+    for name in ("a.jpg", "IMG_0001.CR2", "IMG_0002.CR2"):
+        (library / name).write_bytes(b"")
+    writer.write(library / "a.jpg", ["guitar"])
+    # Lightroom-style sidecar named after the stem
+    writer.write(library / "IMG_0001.CR2", ["drums"])
+    os.replace(library / "IMG_0001.CR2.xmp", library / "IMG_0001.xmp")
+    # Ours supersedes one named after the stem
+    writer.write(library / "IMG_0002.CR2", ["stage"])
+    writer.write(library / "IMG_0002.CR3", ["crowd"])
+    os.replace(library / "IMG_0002.CR3.xmp", library / "IMG_0002.xmp")
+    # A sidecar without a photo is left out
+    writer.write(library / "orphan.jpg", ["bass"])
+
+    index = KeywordIndex(tmp_path / "index.sqlite")
+    assert index.rebuild(library, workers=1) == 3
+    assert index.search("guitar") == [str(library / "a.jpg")]
+    assert index.search("drums") == [str(library / "IMG_0001.CR2")]
+    assert index.search("stage") == [str(library / "IMG_0002.CR2")]
+    assert index.search("crowd OR bass") == []
+    index.close()
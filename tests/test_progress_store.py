@@ -0,0 +1,78 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from ai_photo_tagger import ProgressStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ProgressStore(tmp_path / "progress.sqlite")
+    store.start_session(datetime.now())
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(b"x" * 100)
+    return path
+
+
+def record(store, path, status):
+    stat = os.stat(path)
+    store.record(str(path), status, size=stat.st_size, mtime=stat.st_mtime)
+    store.commit()
+
+
+def test_new_file_needs_processing(store, photo):
+    assert store.needs_processing(str(photo))
+
+
+@pytest.mark.parametrize("status", ["processed", "rejected"])
+def test_unchanged_file_is_done(store, photo, status):
+    record(store, photo, status)
+    assert not store.needs_processing(str(photo))
+
+
+@pytest.mark.parametrize("status", ["error", "skipped"])
+def test_failed_file_is_retried(store, photo, status):
+    record(store, photo, status)
+    assert store.needs_processing(str(photo))
+
+
+def test_changed_size_or_mtime_is_reprocessed(store, photo):
+    record(store, photo, "processed")
+    stat = os.stat(photo)
+    os.utime(photo, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert store.needs_processing(str(photo))
+
+    record(store, photo, "processed")
+    photo.write_bytes(b"x" * 101)
+    os.utime(photo, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert store.needs_processing(str(photo))
+
+
+def test_records_are_buffered_until_commit(store, photo):
+    stat = os.stat(photo)
+    store.record(str(photo), "processed", size=stat.st_size, mtime=stat.st_mtime)
+    assert store.needs_processing(str(photo))
+    assert store.commit() == [str(photo)]
+    assert not store.needs_processing(str(photo))
+
+
+def test_missing_file_is_not_reprocessed(store, photo):
+    record(store, photo, "processed")
+    photo.unlink()
+    assert not store.needs_processing(str(photo))
+
+
+def test_json_import_without_size_is_trusted(store, tmp_path, photo):
+    json_path = tmp_path / "ai_photo_tagger_v3_progress.json"
+    json_path.write_text(json.dumps({"processed_files": [str(photo)]}))
+    assert store.import_json(json_path) == 1
+    photo.write_bytes(b"changed")
+    assert not store.needs_processing(str(photo))
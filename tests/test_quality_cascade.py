@@ -0,0 +1,66 @@
+import copy
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from ai_photo_tagger import DEFAULT_CONFIG, DecodedFrame, QualityAnalyzer
+
+
+def analyzer(cascade=True):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config["quality_control"]["cascade"]["enabled"] = cascade
+    return QualityAnalyzer(config)
+
+
+@pytest.fixture
+def frame():
+    return DecodedFrame(Path("photo.jpg"), Image.new("RGB", (4096, 3072)))
+
+
+def decide(analyzer, frame, preview_score, analysis_score=80.0):
+    """Long edges measure() saw, and the edge decide() settled on"""
+    seen = []
+
+    def measure(level):
+        seen.append(max(level.size))
+        score = (
+            preview_score
+            if max(level.size) < analyzer.analysis_size
+            else analysis_score
+        )
+        return score, {"score": score}
+
+    result, values, edge = analyzer.decide(frame, measure, analyzer.blur_borderline)
+    assert result == values["score"]
+    return seen, edge
+
+
+@pytest.mark.parametrize("preview_score", [5000.0, 1.0])
+def test_clear_cut_preview_decides(frame, preview_score):
+    # With blur_ratio (0.33, 10) a preview one halving down maps to score / 10 ..
+    # score / 0.33, which clears every boundary (25, 50, 100) for these scores
+    seen, edge = decide(analyzer(), frame, preview_score)
+    assert seen == [512]
+    assert edge == 512
+
+
+@pytest.mark.parametrize("preview_score", [200.0, 30.0, 9.0])
+def test_straddling_preview_escalates(frame, preview_score):
+    seen, edge = decide(analyzer(), frame, preview_score)
+    assert seen == [512, 1024]
+    assert edge == 1024
+
+
+def test_without_the_cascade_only_the_analysis_level_runs(frame):
+    seen, edge = decide(analyzer(cascade=False), frame, 5000.0)
+    assert seen == [1024]
+    assert edge == 1024
+
+
+def test_straddles_scales_the_band_by_octaves():
+    quality = analyzer()
+    assert not quality.straddles(5000.0, (100,), (0.33, 10.0), 1.0)
+    assert quality.straddles(5000.0, (100,), (0.33, 10.0), 2.0)
+    # At the analysis level itself the value is the estimate
+    assert not quality.straddles(100.5, (100,), (0.33, 10.0), 0.0)
@@ -0,0 +1,153 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from ai_photo_tagger import REJECTED_TAG, XMP_NAMESPACES, SidecarWriter
+
+RDF = XMP_NAMESPACES["rdf"]
+DC = XMP_NAMESPACES["dc"]
+PHOTOSHOP = XMP_NAMESPACES["photoshop"]
+LIGHTROOM = "http://ns.adobe.com/lightroom/1.0/"
+
+FOREIGN_SIDECAR = f"""<?xml version="1.0" encoding="UTF-8"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+  <rdf:RDF xmlns:rdf="{RDF}">
+    <rdf:Description rdf:about="" xmlns:dc="{DC}" xmlns:lr="{LIGHTROOM}"
+        xmlns:photoshop="{PHOTOSHOP}" photoshop:Instructions="old analysis">
+      <dc:subject><rdf:Bag>
+        <rdf:li>family</rdf:li><rdf:li>quality:blurry</rdf:li><rdf:li>exposure:underexposed</rdf:li>
+        <rdf:li>crowd</rdf:li>
+      </rdf:Bag></dc:subject>
+      <lr:hierarchicalSubject><rdf:Bag><rdf:li>Places|Berlin</rdf:li></rdf:Bag></lr:hierarchicalSubject>
+    </rdf:Description>
+  </rdf:RDF>
+</x:xmpmeta>
+"""
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(b"")
+    return path
+
+
+def subjects(xmp_path):
+    root = ET.parse(str(xmp_path)).getroot()
+    return [li.text for li in root.find(f".//{{{DC}}}subject").iter(f"{{{RDF}}}li")]
+
+
+def instructions(xmp_path):
+    description = ET.parse(str(xmp_path)).getroot().find(f".//{{{RDF}}}Description")
+    element = description.find(f"{{{PHOTOSHOP}}}Instructions")
+    return description.get(f"{{{PHOTOSHOP}}}Instructions") or (
+        element.text if element is not None else None
+    )
+
+
+def test_new_sidecar(photo):
+    assert SidecarWriter().write(
+        photo, ["guitar", "a & b"], {"blur": {"level": "sharp"}}
+    )
+    xmp_path = SidecarWriter.sidecar_path(photo)
+    assert xmp_path.name == "photo.jpg.xmp"
+    assert subjects(xmp_path) == ["guitar", "a & b"]
+    assert instructions(xmp_path).startswith("Quality Analysis: ")
+
+
+def test_merge_keeps_foreign_keywords_and_namespaces(photo):
+    xmp_path = SidecarWriter.sidecar_path(photo)
+    xmp_path.write_text(FOREIGN_SIDECAR, encoding="utf-8")
+    SidecarWriter().write(
+        photo, ["guitar", "stage_lighting"], {"blur": {"level": "sharp"}}
+    )
+
+    # Legacy quality tags are ours to replace; the user's keyword stays
+    assert subjects(xmp_path) == ["family", "guitar", "stage_lighting"]
+    text = xmp_path.read_text(encoding="utf-8")
+    assert 'xmlns:lr="http://ns.adobe.com/lightroom/1.0/"' in text
+    assert "Places|Berlin" in text
+    assert "ns0:" not in text
+
+
+def test_rerun_replaces_what_the_tagger_wrote(photo):
+    writer = SidecarWriter()
+    xmp_path = SidecarWriter.sidecar_path(photo)
+    xmp_path.write_text(FOREIGN_SIDECAR, encoding="utf-8")
+    writer.write(
+        photo,
+        ["guitar", "crowd", "low_light", REJECTED_TAG],
+        {"blur": {"level": "blurry"}},
+    )
+    writer.write(photo, ["drums", "stage_lighting"], None)
+    assert subjects(xmp_path) == ["family", "drums", "stage_lighting"]
+    assert instructions(xmp_path) is None
+
+
+def test_round_trip_is_stable(photo):
+    writer = SidecarWriter()
+    xmp_path = SidecarWriter.sidecar_path(photo)
+    xmp_path.write_text(FOREIGN_SIDECAR, encoding="utf-8")
+    writer.write(photo, ["guitar"], {"blur": {"level": "sharp"}})
+    first = ET.tostring(ET.parse(str(xmp_path)).getroot())
+    writer.write(photo, ["guitar"], {"blur": {"level": "sharp"}})
+    second = ET.tostring(ET.parse(str(xmp_path)).getroot())
+
+    # Only xmp:MetadataDate may differ
+    def strip(data):
+        return [line for line in data.split(b">") if b"MetadataDate" not in line]
+
+    assert strip(first) == strip(second)
+    assert subjects(xmp_path) == ["family", "guitar"]
+
+
+def test_unreadable_sidecar_is_backed_up(photo):
+    xmp_path = SidecarWriter.sidecar_path(photo)
+    xmp_path.write_text("<x:xmpmeta not xml", encoding="utf-8")
+    assert SidecarWriter().write(photo, ["guitar"])
+    assert subjects(xmp_path) == ["guitar"]
+    assert (
+        xmp_path.with_suffix(".xmp.bak").read_text(encoding="utf-8")
+        == "<x:xmpmeta not xml"
+    )
+    assert not list(photo.parent.glob(".*.tmp"))
+
+
+def test_owned_keywords(photo):
+    xmp_path = SidecarWriter.sidecar_path(photo)
+    assert SidecarWriter.owned_keywords(xmp_path) == []
+
+    # Sidecars from before aitagger:Keywords only give up their quality tags
+    xmp_path.write_text(FOREIGN_SIDECAR, encoding="utf-8")
+    assert SidecarWriter.owned_keywords(xmp_path) == [
+        "quality:blurry",
+        "exposure:underexposed",
+        "crowd",
+    ]
+
+    SidecarWriter().write(photo, ["guitar", "quality:blurry"])
+    assert SidecarWriter.owned_keywords(xmp_path) == ["guitar", "quality:blurry"]
+
+
+def test_concurrent_writes_keep_each_documents_prefixes(tmp_path):
+    # Both documents bind the prefix "foo", to different namespaces
+    photos = []
+    for i in range(2):
+        photo = tmp_path / f"photo{i}.jpg"
+        photo.write_bytes(b"")
+        SidecarWriter.sidecar_path(photo).write_text(
+            FOREIGN_SIDECAR.replace(
+                f'xmlns:lr="{LIGHTROOM}"',
+                f'xmlns:lr="{LIGHTROOM}" xmlns:foo="urn:foo:{i}" foo:label="{i}"',
+            ),
+            encoding="utf-8",
+        )
+        photos.append(photo)
+
+    writer = SidecarWriter(max_workers=8)
+    futures = [writer.submit(photos[n % 2], ["guitar"]) for n in range(200)]
+    assert all(future.result() for future in futures)
+    writer.close()
+    for i, photo in enumerate(photos):
+        text = SidecarWriter.sidecar_path(photo).read_text(encoding="utf-8")
+        assert f'xmlns:foo="urn:foo:{i}"' in text and f'foo:label="{i}"' in text
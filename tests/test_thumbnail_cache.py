@@ -0,0 +1,171 @@
+import copy
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import ai_photo_tagger
+from ai_photo_tagger import DEFAULT_CONFIG, EnhancedPhotoTagger, ThumbnailCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ai_photo_tagger.time, "time", clock)
+    return clock
+
+
+def open_cache(tmp_path, max_bytes=1024 * 1024, shards=1):
+    return ThumbnailCache(tmp_path / "thumbs", max_bytes, shards)
+
+
+def read(cache, key):
+    cached = cache.get(key)
+    return None if cached is None else bytes(cached[0])
+
+
+def test_round_trip(tmp_path):
+    cache = open_cache(tmp_path, shards=4)
+    cache.put("00000001" + "0" * 24, b"first", {"quality_key": "a"})
+    cache.put("00000002" + "0" * 24, b"second", {})
+    cache.commit()
+
+    view, meta = cache.get("00000001" + "0" * 24)
+    assert isinstance(view, memoryview)
+    assert bytes(view) == b"first"
+    assert meta == {"quality_key": "a"}
+    assert cache.get("00000003" + "0" * 24) is None
+    cache.close()
+
+    # Another process (or run) reads what the writer committed
+    reopened = open_cache(tmp_path, shards=4)
+    assert read(reopened, "00000002" + "0" * 24) == b"second"
+    assert reopened.total_bytes == len(b"first") + len(b"second")
+    reopened.close()
+
+
+def test_metadata_only_update_keeps_bytes(tmp_path):
+    cache = open_cache(tmp_path)
+    key = "0" * 32
+    cache.put(key, b"jpeg", {"quality_key": "old"})
+    cache.put(key, None, {"quality_key": "new"})
+    assert read(cache, key) == b"jpeg"
+    assert cache.get(key)[1] == {"quality_key": "new"}
+    cache.close()
+
+
+def test_eviction_drops_least_recently_used(tmp_path, clock):
+    cache = open_cache(tmp_path, max_bytes=250)
+    keys = [f"{i:08x}" + "0" * 24 for i in range(3)]
+    cache.put(keys[0], b"a" * 100, {})
+    cache.put(keys[1], b"b" * 100, {})
+    cache.touch(keys[0])
+    cache.put(keys[2], b"c" * 100, {})
+
+    assert read(cache, keys[1]) is None
+    assert read(cache, keys[0]) == b"a" * 100
+    assert read(cache, keys[2]) == b"c" * 100
+    assert cache.total_bytes == 200
+    cache.close()
+
+
+def test_compaction_keeps_live_entries_readable(tmp_path, monkeypatch, clock):
+    monkeypatch.setattr(ThumbnailCache, "COMPACT_DEAD_BYTES", 300)
+    cache = open_cache(tmp_path, max_bytes=400)
+    keys = [f"{i:08x}" + "0" * 24 for i in range(8)]
+    for i, key in enumerate(keys):
+        cache.put(key, bytes([i]) * 100, {"n": i})
+
+    # Only the newest four fit; their pack has been rewritten without the dead ones
+    packs = sorted(os.listdir(tmp_path / "thumbs"))
+    assert "pack-00.0.bin" not in packs
+    for i, key in enumerate(keys):
+        expected = bytes([i]) * 100 if i >= 4 else None
+        assert read(cache, key) == expected
+    assert cache.get(keys[-1])[1] == {"n": 7}
+    assert (
+        sum(
+            os.path.getsize(tmp_path / "thumbs" / p)
+            for p in packs
+            if p.endswith(".bin")
+        )
+        < 800
+    )
+    cache.close()
+
+
+@pytest.fixture
+def tagger(tmp_path):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config["pictures_folder"] = tmp_path
+    config["keyword_cache"]["enabled"] = False
+    config["thumbnail_cache"]["path"] = str(tmp_path / "thumbs")
+    tagger = EnhancedPhotoTagger.for_worker(config)
+    yield tagger
+    tagger.thumbnail_cache.close()
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / "photo.jpg"
+    pixels = np.random.default_rng(0).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, quality=90)
+    return path
+
+
+def test_hit_skips_the_decode(tagger, photo):
+    first = tagger.prepare_photo(photo)
+    assert "decode" in first.stage_seconds and not first.thumbnail_hit
+    tagger.store_thumbnail(first)
+
+    second = tagger.prepare_photo(photo)
+    assert "decode" not in second.stage_seconds
+    assert bytes(second.image_bytes) == first.image_bytes
+    assert second.quality_results == first.quality_results
+
+
+def test_quality_settings_mismatch_misses(tagger, photo):
+    first = tagger.prepare_photo(photo)
+    tagger.store_thumbnail(first)
+
+    tagger.config["quality_control"] = dict(
+        tagger.config["quality_control"], blur_threshold=50.0
+    )
+    second = tagger.prepare_photo(photo)
+    # The model input is reused but quality is recomputed under the new settings
+    assert "decode" in second.stage_seconds
+    assert second.thumbnail_hit
+    assert bytes(second.image_bytes) == first.image_bytes
+
+    tagger.store_thumbnail(second)
+    assert (
+        tagger.thumbnail_cache.get(second.thumbnail_key)[1]["quality_key"]
+        == tagger.quality_fingerprint()
+    )
+    assert tagger.quality_fingerprint() != first.thumbnail_meta["quality_key"]
+
+
+def test_triage_only_hit_does_not_hash_the_file(tagger, photo, monkeypatch):
+    tagger.config["keyword_cache"]["enabled"] = True
+    tagger.store_thumbnail(tagger.prepare_photo(photo))
+
+    def file_content_hash(path):
+        raise AssertionError("triage-only passes must not read the whole file")
+
+    monkeypatch.setattr(ai_photo_tagger, "file_content_hash", file_content_hash)
+    tagger.config["triage"] = dict(
+        tagger.config["triage"], enabled=True, triage_only=True
+    )
+    prepared = tagger.prepare_photo(photo)
+    assert "decode" not in prepared.stage_seconds
+    assert prepared.content_hash is None
@@ -0,0 +1,105 @@
+import pytest
+
+import ai_photo_tagger
+from ai_photo_tagger import WorkQueue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ai_photo_tagger.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return tmp_path / "queue.sqlite"
+
+
+def open_queue(queue_path, node):
+    queue = WorkQueue(queue_path, node, lease_seconds=60)
+    queue.join()
+    return queue
+
+
+def seed(queue, *chunks):
+    assert queue.claim_seeding()
+    for paths in chunks:
+        queue.add_chunk(paths)
+    queue.finish_seeding()
+
+
+def test_leased_chunk_is_held_until_the_lease_expires(clock, queue_path):
+    a, b = open_queue(queue_path, "a"), open_queue(queue_path, "b")
+    seed(a, ["1.jpg", "2.jpg"])
+    chunk_id, paths = a.lease()
+    assert paths == ["1.jpg", "2.jpg"]
+
+    clock.now += 59
+    assert b.lease() is None
+    assert b.waiting_on_others()
+
+    clock.now += 2
+    assert b.unleased() == 1
+    assert b.lease() == (chunk_id, paths)
+    assert b.reclaimed == 1
+    # Now b holds it
+    assert a.lease() is None
+    assert a.waiting_on_others()
+
+
+def test_heartbeat_renews_the_lease(clock, queue_path):
+    a, b = open_queue(queue_path, "a"), open_queue(queue_path, "b")
+    seed(a, ["1.jpg"])
+    a.lease()
+    clock.now += 50
+    a.heartbeat({})
+    clock.now += 50
+    assert b.lease() is None
+    clock.now += 11
+    assert b.lease() is not None
+
+
+def test_settled_chunk_is_not_leased_again(clock, queue_path):
+    a, b = open_queue(queue_path, "a"), open_queue(queue_path, "b")
+    seed(a, ["1.jpg", "2.jpg"], ["3.jpg"])
+    chunk_id, paths = a.lease()
+    a.expect(chunk_id, paths)
+    a.settle(["1.jpg"])
+    assert a.holding()
+    a.settle(["2.jpg"])
+    assert not a.holding()
+    assert a.completed == 1
+
+    clock.now += 120
+    assert b.lease()[1] == ["3.jpg"]
+    assert b.reclaimed == 0
+    assert WorkQueue.stats(queue_path)["chunks_done"] == 1
+
+
+def test_close_hands_chunks_back_at_once(clock, queue_path):
+    a, b = open_queue(queue_path, "a"), open_queue(queue_path, "b")
+    seed(a, ["1.jpg"])
+    chunk_id, _ = a.lease()
+    a.close({"processed": 0})
+    assert b.lease()[0] == chunk_id
+    assert b.reclaimed == 0
+
+
+def test_rejoining_node_releases_its_old_leases(clock, queue_path):
+    a = open_queue(queue_path, "a")
+    seed(a, ["1.jpg"])
+    chunk_id, _ = a.lease()
+    a._conn.close()
+    b = open_queue(queue_path, "b")
+    assert b.lease() is None
+    open_queue(queue_path, "a")
+    assert b.lease()[0] == chunk_id